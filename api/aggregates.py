@@ -0,0 +1,208 @@
+import uuid
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from api import inventory
+from api.model import (
+    DailyHarvest,
+    EggStockRecord,
+    FarmHarvest,
+    HarvestAggregate,
+    date_bounds,
+    db,
+    month_start,
+    upsert_rows,
+    week_ending,
+)
+
+# granularity: (DailyHarvest bucket column, function mapping a day to its bucket)
+BUCKETS = {
+    "week": (DailyHarvest.week_ending, week_ending),
+    "month": (DailyHarvest.month, month_start),
+}
+GRANULARITIES = ["day", *BUCKETS]
+
+
+def refresh_daily_harvests(
+    start_date: date, end_date: date
+) -> List[Tuple[date, int, int, int, int]]:
+    """Re-sum every farm's harvests from start_date to end_date into daily_harvests.
+
+    The caller commits.
+
+    :param start_date: earliest farm harvest that changed
+    :param end_date: latest farm harvest that changed
+    :return: (date, pink, brown, blue, total) of each day in the range, in date order
+    """
+    sums = db.session.execute(
+        select(
+            FarmHarvest.harvest_date,
+            func.sum(FarmHarvest.pink),
+            func.sum(FarmHarvest.brown),
+            func.sum(FarmHarvest.blue),
+            func.sum(FarmHarvest.total),
+        )
+        .where(FarmHarvest.harvest_date.between(start_date, end_date))
+        .group_by(FarmHarvest.harvest_date)
+        .order_by(FarmHarvest.harvest_date)
+    )
+    harvests = [tuple(row) for row in sums]
+    now = datetime.utcnow()
+    upsert_rows(
+        DailyHarvest,
+        (DailyHarvest.row(*harvest, now=now) for harvest in harvests),
+        conflict_columns=["harvest_date"],
+        update_columns=["pink", "brown", "blue", "total", "edited_at"],
+    )
+    return harvests
+
+
+def refresh_harvest_aggregates(start_date: date, end_date: date) -> int:
+    """Recompute the week and month buckets that contain any day from start_date to end_date.
+
+    Only the touched buckets are re-summed from daily_harvests, so an import of a few new days
+    refreshes one or two rows per granularity. The caller commits.
+
+    :param start_date: earliest daily harvest that changed
+    :param end_date: latest daily harvest that changed
+    :return: number of aggregate rows written
+    """
+    now = datetime.utcnow()
+    written = 0
+    for granularity, (column, bucket) in BUCKETS.items():
+        sums = db.session.execute(
+            select(
+                column,
+                func.count(),
+                func.sum(DailyHarvest.pink),
+                func.sum(DailyHarvest.brown),
+                func.sum(DailyHarvest.blue),
+                func.sum(DailyHarvest.total),
+            )
+            .where(column.between(bucket(start_date), bucket(end_date)))
+            .group_by(column)
+        )
+        rows = (
+            {
+                "id": uuid.uuid4(),
+                "created_at": now,
+                "edited_at": now,
+                "granularity": granularity,
+                "bucket_date": bucket_date,
+                "days": days,
+                "pink": pink,
+                "brown": brown,
+                "blue": blue,
+                "total": total,
+            }
+            for bucket_date, days, pink, brown, blue, total in sums
+        )
+        written += upsert_rows(
+            HarvestAggregate,
+            rows,
+            conflict_columns=["granularity", "bucket_date"],
+            update_columns=["days", "pink", "brown", "blue", "total", "edited_at"],
+        )
+    return written
+
+
+def upsert_weekly_dozens(
+    weekly_records: Iterable[Tuple[date, int]], batch_size: int = 1000
+) -> int:
+    """Write weekly (date, dozens) records, replacing the quantity of dates already stored, and
+    restock the egg inventory by the change in the latest week. The caller commits.
+
+    :param weekly_records: (record_date, quantity) pairs
+    :param batch_size: rows per INSERT statement
+    :return: number of records written
+    """
+    weekly_records = list(weekly_records)
+    previous = inventory.latest_week()
+    now = datetime.utcnow()
+    rows = (
+        {
+            "id": uuid.uuid4(),
+            "created_at": now,
+            "edited_at": now,
+            "record_date": record_date,
+            "quantity": quantity,
+        }
+        for record_date, quantity in weekly_records
+    )
+    written = upsert_rows(
+        EggStockRecord,
+        rows,
+        conflict_columns=["record_date"],
+        update_columns=["quantity", "edited_at"],
+        batch_size=batch_size,
+    )
+    # the latest week afterwards is the newest written one, unless an older week was rewritten;
+    # of repeated dates the last one is stored
+    newest = max(reversed(weekly_records), key=lambda record: record[0], default=None)
+    if newest is not None and (previous is None or newest[0] >= previous[0]):
+        previous_dozens = (previous[1] or 0) if previous is not None else 0
+        inventory.restock((newest[1] or 0) - previous_dozens)
+    return written
+
+
+def harvest_series(
+    granularity: str,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    window: Optional[int] = None,
+    session=None,
+) -> List[Dict]:
+    """Read a harvest time series at the given granularity.
+
+    Weeks and months come straight from the precomputed aggregates, so the cost is proportional
+    to the number of buckets returned rather than the number of days they cover.
+
+    :param granularity: "day", "week" or "month"
+    :param start_date: earliest bucket_date to include
+    :param end_date: latest bucket_date to include
+    :param window: if given, add a rolling mean of total over this many buckets
+    :param session: session to query with, defaults to db.session
+    :return: one dict per bucket, in date order
+    """
+    session = session or db.session
+    start_date, end_date = date_bounds(start_date, end_date)
+    if granularity == "day":
+        harvests = session.scalars(
+            select(DailyHarvest)
+            .where(DailyHarvest.harvest_date.between(start_date, end_date))
+            .order_by(DailyHarvest.harvest_date)
+        )
+        series = [
+            {
+                "granularity": "day",
+                "bucket_date": harvest.harvest_date,
+                "days": 1,
+                "pink": harvest.pink,
+                "brown": harvest.brown,
+                "blue": harvest.blue,
+                "total": harvest.total,
+                "dozens": harvest.total // 12,
+            }
+            for harvest in harvests
+        ]
+    else:
+        aggregates = session.scalars(
+            select(HarvestAggregate)
+            .where(
+                HarvestAggregate.granularity == granularity,
+                HarvestAggregate.bucket_date.between(start_date, end_date),
+            )
+            .order_by(HarvestAggregate.bucket_date)
+        )
+        series = [aggregate.to_json() for aggregate in aggregates]
+
+    if window:
+        running = 0
+        for i, bucket in enumerate(series):
+            running += bucket["total"]
+            if i >= window:
+                running -= series[i - window]["total"]
+            bucket["rolling_mean"] = running / min(i + 1, window)
+    return series
@@ -0,0 +1,216 @@
+"""Asynchronous serving mode for the hottest read-only API routes.
+
+The same queries and serializers as api/main.py run on aiohttp with an async SQLAlchemy engine
+(asyncpg for postgres), so a single worker can interleave many requests while each one waits on
+the database. Run it with:
+
+    DB_POOL_SIZE=20 DB_MAX_OVERFLOW=10 DB_POOL_RECYCLE=1800 python -m api.aio --port 5000
+
+Only the routes in ROUTES are served; every other path answers 404. The rest of api/main.py,
+such as recipe search, shopping lists, the stock forecast and series, the streaming export,
+writes and jobs, is only served by the Flask app, as is live stock (/api/stock), whose process
+keeps the in-memory availability counter.
+"""
+
+import argparse
+import os
+import uuid
+from datetime import date
+from typing import Dict, List, Optional
+
+from aiohttp import web
+from flask import Flask
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from api.aggregates import GRANULARITIES, harvest_series
+from api.cache import recipe_cache
+from api.main import (
+    EGG_STOCK_RECORDS_DEFAULT_LIMIT,
+    EGG_STOCK_RECORDS_MAX_LIMIT,
+    RECIPES_MAX_IDS,
+)
+from api.model import DEFAULT_DATABASE_URI, date_bounds, engine_options_from_env
+from api.queries import egg_stock_records_statement, load_recipes_json
+from api.serialization import FastJSONProvider
+
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+# the provider keeps only a weak reference to its app, for the FAST_JSON setting
+json_app = Flask(__name__)
+json_provider = FastJSONProvider(json_app)
+
+
+def async_database_uri(db_uri: str) -> str:
+    """Swap a database URI's driver for its asyncio counterpart."""
+    url = make_url(db_uri)
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()]).render_as_string(
+        hide_password=False
+    )
+
+
+def json_response(data, headers: Optional[Dict] = None) -> web.Response:
+    """Encode data exactly as the Flask app's JSON provider does."""
+    return web.Response(
+        body=json_provider.encode(data),
+        content_type="application/json",
+        headers=headers,
+    )
+
+
+def _date_arg(request: web.Request, name: str) -> Optional[date]:
+    value = request.query.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise web.HTTPBadRequest(text=f"{name} must be a yyyy-mm-dd date")
+
+
+def _list_arg(request: web.Request, name: str) -> List[str]:
+    """Values of a repeatable, comma separated query string argument, as api/main.py reads it."""
+    return [
+        value.strip()
+        for arg in request.query.getall(name, [])
+        for value in arg.split(",")
+        if value.strip()
+    ]
+
+
+def _int_arg(request: web.Request, name: str, default: Optional[int] = None):
+    value = request.query.get(name)
+    if not value:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+async def index(request: web.Request) -> web.Response:
+    return web.Response(text="welcome to full spectrum eggs")
+
+
+async def get_about(request: web.Request) -> web.Response:
+    return web.Response(text="Full Spectrum Eggs is based in Clarkston, Georgia.")
+
+
+async def get_stock_history(request: web.Request) -> web.Response:
+    granularity = request.query.get("granularity", "week")
+    if granularity not in GRANULARITIES:
+        raise web.HTTPBadRequest(text=f"granularity must be one of {GRANULARITIES}")
+    window = _int_arg(request, "window")
+    if window is not None and window < 1:
+        raise web.HTTPBadRequest(text="window must be a positive integer")
+    start_date, end_date = _date_arg(request, "start"), _date_arg(request, "end")
+    async with request.app["sessionmaker"]() as session:
+        series = await session.run_sync(
+            lambda sync_session: harvest_series(
+                granularity, start_date, end_date, window=window, session=sync_session
+            )
+        )
+    return json_response(series)
+
+
+async def get_egg_stock_records(request: web.Request) -> web.Response:
+    start_date, end_date = date_bounds(
+        _date_arg(request, "start"), _date_arg(request, "end")
+    )
+    after = _date_arg(request, "after")
+    limit = _int_arg(request, "limit", EGG_STOCK_RECORDS_DEFAULT_LIMIT)
+    if limit < 1:
+        raise web.HTTPBadRequest(text="limit must be a positive integer")
+    limit = min(limit, EGG_STOCK_RECORDS_MAX_LIMIT)
+
+    statement = egg_stock_records_statement(start_date, end_date, after, limit + 1)
+    async with request.app["sessionmaker"]() as session:
+        records = (await session.execute(statement)).mappings().all()
+
+    headers = {}
+    if len(records) > limit:
+        records = records[:limit]
+        next_url = request.rel_url.update_query(
+            after=records[-1]["record_date"].isoformat()
+        )
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return json_response([dict(record) for record in records], headers)
+
+
+async def get_recipes(request: web.Request) -> web.Response:
+    ids = _list_arg(request, "ids")
+    if not ids:
+        async with request.app["sessionmaker"]() as session:
+            recipes = await session.run_sync(load_recipes_json)
+        return json_response(recipes)
+    if len(ids) > RECIPES_MAX_IDS:
+        raise web.HTTPBadRequest(text=f"at most {RECIPES_MAX_IDS} ids per request")
+    try:
+        recipe_ids = list(dict.fromkeys(uuid.UUID(value) for value in ids))
+    except ValueError:
+        raise web.HTTPBadRequest(text="ids must be comma separated recipe ids")
+    async with request.app["sessionmaker"]() as session:
+        recipes = await session.run_sync(recipe_cache.load, recipe_ids)
+    return json_response(
+        [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+    )
+
+
+async def get_recipe(request: web.Request) -> web.Response:
+    try:
+        recipe_id = uuid.UUID(request.match_info["recipe_id"])
+    except ValueError:
+        raise web.HTTPNotFound()
+    async with request.app["sessionmaker"]() as session:
+        recipes = await session.run_sync(recipe_cache.load, [recipe_id])
+    if recipe_id not in recipes:
+        raise web.HTTPNotFound()
+    return json_response(recipes[recipe_id])
+
+
+# the GET routes of api/main.py served here
+ROUTES = [
+    ("/api/", index),
+    ("/api/stock/history", get_stock_history),
+    ("/api/egg-stock-records", get_egg_stock_records),
+    ("/api/about", get_about),
+    ("/api/recipes", get_recipes),
+    ("/api/recipe/{recipe_id}", get_recipe),
+]
+
+
+async def _dispose_engine(application: web.Application) -> None:
+    await application["engine"].dispose()
+
+
+def create_app(
+    db_uri: Optional[str] = None, engine_options: Optional[Dict] = None
+) -> web.Application:
+    """Build the aiohttp application and its async engine.
+
+    :param db_uri: sync-style database URI, defaults to DATABASE_URL or the dev database
+    :param engine_options: create_async_engine options, defaults to engine_options_from_env()
+    :return: aiohttp application
+    """
+    db_uri = async_database_uri(
+        db_uri or os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URI)
+    )
+    if engine_options is None:
+        engine_options = engine_options_from_env(db_uri)
+    engine = create_async_engine(db_uri, **engine_options)
+
+    application = web.Application()
+    application["engine"] = engine
+    application["sessionmaker"] = async_sessionmaker(engine, expire_on_commit=False)
+    application.on_cleanup.append(_dispose_engine)
+    for path, handler in ROUTES:
+        application.router.add_get(path, handler)
+    return application
+
+
+# exclude from coverage
+if __name__ == "__main__":  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Serve the API with aiohttp")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,184 @@
+"""Bulk writes of recipes and stock records, in a few statements per batch instead of per row.
+
+Payloads are validated as a whole before anything is written, and each write leaves the commit
+to the caller, so a batch is stored in one transaction or not at all.
+"""
+
+import uuid
+from datetime import date, datetime
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Tuple
+
+from sqlalchemy import insert, select
+
+from api.model import (
+    AbstractIngredient,
+    Recipe,
+    RecipeIngredient,
+    db,
+    dialect_insert,
+    unit_id,
+)
+
+RECIPE_FIELDS = {"instructions": str, "servings": int, "source": str}
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def validate_recipes(payload: Any) -> List[Dict]:
+    """Check a list of recipes shaped like Recipe.to_json, with ingredients given by name.
+
+    :param payload: decoded JSON body
+    :return: the recipes
+    :raises ValueError: describing the first invalid recipe
+    """
+    if not isinstance(payload, list) or not payload:
+        raise ValueError("body must be a non-empty list of recipes")
+    for index, recipe in enumerate(payload):
+        if not isinstance(recipe, dict):
+            raise ValueError(f"recipe {index} must be an object")
+        if not isinstance(recipe.get("name"), str) or not recipe["name"].strip():
+            raise ValueError(f"recipe {index} needs a name")
+        for field, kind in RECIPE_FIELDS.items():
+            value = recipe.get(field)
+            if value is not None and not (
+                _is_int(value) if kind is int else isinstance(value, kind)
+            ):
+                raise ValueError(f"recipe {index} {field} must be {kind.__name__}")
+        ingredients = recipe.get("ingredients", [])
+        if not isinstance(ingredients, list):
+            raise ValueError(f"recipe {index} ingredients must be a list")
+        for ingredient in ingredients:
+            if (
+                not isinstance(ingredient, dict)
+                or not isinstance(ingredient.get("name"), str)
+                or not ingredient["name"].strip()
+                or not _is_int(ingredient.get("quantity"))
+                or not isinstance(ingredient.get("units", ""), str)
+            ):
+                raise ValueError(
+                    f"recipe {index} ingredients need a name, an integer quantity "
+                    "and string units"
+                )
+    return payload
+
+
+def validate_stock_records(payload: Any) -> List[Tuple[date, int]]:
+    """Check a list of {"record_date": "yyyy-mm-dd", "quantity": dozens} weekly records.
+
+    A date given twice keeps its last quantity.
+
+    :param payload: decoded JSON body
+    :return: (record_date, quantity) pairs in date order
+    :raises ValueError: describing the first invalid record
+    """
+    if not isinstance(payload, list) or not payload:
+        raise ValueError("body must be a non-empty list of stock records")
+    records = {}
+    for index, record in enumerate(payload):
+        if not isinstance(record, dict):
+            raise ValueError(f"record {index} must be an object")
+        try:
+            record_date = date.fromisoformat(record.get("record_date"))
+        except (TypeError, ValueError):
+            raise ValueError(f"record {index} record_date must be a yyyy-mm-dd date")
+        # stock is counted per week, on the Monday that closes it
+        if record_date.weekday() != 0:
+            raise ValueError(f"record {index} record_date must be a Monday")
+        quantity = record.get("quantity")
+        if not _is_int(quantity) or quantity < 0:
+            raise ValueError(f"record {index} quantity must be a non-negative integer")
+        records[record_date] = quantity
+    return sorted(records.items())
+
+
+def resolve_ingredients(
+    names: Iterable[str], batch_size: int = 1000
+) -> Dict[str, uuid.UUID]:
+    """Ids of the named AbstractIngredients, creating the ones that do not exist yet.
+
+    Each batch of names costs one IN lookup and, when some are new, one multi-row INSERT that
+    skips names a concurrent request has just created; only those are read again. The caller
+    commits.
+
+    :param names: ingredient names, repeats allowed
+    :param batch_size: names per statement
+    :return: name to AbstractIngredient id
+    """
+    table = AbstractIngredient.__table__
+    upsert = dialect_insert(db.session)
+    names = iter(dict.fromkeys(names))
+    ids = {}
+    while batch := list(islice(names, batch_size)):
+        lookup = select(table.c.name, table.c.id).where(table.c.name.in_(batch))
+        found = dict(db.session.execute(lookup).all())
+        missing = [name for name in batch if name not in found]
+        if missing:
+            now = datetime.utcnow()
+            rows = [
+                {"id": uuid.uuid4(), "created_at": now, "edited_at": now, "name": name}
+                for name in missing
+            ]
+            statement = (
+                upsert(table)
+                .values(rows)
+                .on_conflict_do_nothing(index_elements=["name"])
+                .returning(table.c.name, table.c.id)
+            )
+            found.update(db.session.execute(statement).all())
+            raced = [name for name in missing if name not in found]
+            if raced:
+                lookup = select(table.c.name, table.c.id).where(table.c.name.in_(raced))
+                found.update(db.session.execute(lookup).all())
+        ids.update(found)
+    return ids
+
+
+def create_recipes(recipes: List[Dict]) -> List[uuid.UUID]:
+    """Insert validated recipes and their ingredients. The caller commits.
+
+    Ingredient names are resolved with resolve_ingredients, then recipes and recipe ingredients
+    are each sent as one executemany INSERT.
+
+    :param recipes: recipes accepted by validate_recipes
+    :return: ids of the new recipes, in the order given
+    """
+    ingredient_ids = resolve_ingredients(
+        ingredient["name"].strip()
+        for recipe in recipes
+        for ingredient in recipe.get("ingredients", [])
+    )
+    now = datetime.utcnow()
+    recipe_rows, ingredient_rows = [], []
+    for recipe in recipes:
+        recipe_id = uuid.uuid4()
+        recipe_rows.append(
+            {
+                "id": recipe_id,
+                "created_at": now,
+                "edited_at": now,
+                "name": recipe["name"].strip(),
+                "instructions": recipe.get("instructions"),
+                "servings": recipe.get("servings"),
+                "source": recipe.get("source"),
+            }
+        )
+        for ingredient in recipe.get("ingredients", []):
+            ingredient_rows.append(
+                {
+                    "id": uuid.uuid4(),
+                    "abstract_ingredient_id": ingredient_ids[
+                        ingredient["name"].strip()
+                    ],
+                    "recipe_id": recipe_id,
+                    "quantity": ingredient["quantity"],
+                    "units": ingredient.get("units"),
+                    "unit_id": unit_id(ingredient.get("units")),
+                }
+            )
+    db.session.execute(insert(Recipe.__table__), recipe_rows)
+    if ingredient_rows:
+        db.session.execute(insert(RecipeIngredient.__table__), ingredient_rows)
+    return [row["id"] for row in recipe_rows]
@@ -0,0 +1,220 @@
+import hashlib
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from functools import wraps
+from threading import Lock
+from time import monotonic
+from typing import Any, Dict, Hashable, List, Optional, Tuple
+
+from flask import current_app, request
+from sqlalchemy import func, select
+
+from api.model import (
+    AbstractIngredient,
+    Recipe,
+    RecipeIngredient,
+    VERSIONED_TABLES,
+    TableVersion,
+    db,
+)
+from api.queries import load_recipes_json
+
+
+class LRUBackend:
+    """Bounded in-process cache backend that evicts the least recently used entry.
+
+    Any object with the same get/set/delete/clear methods can be plugged into ResponseCache,
+    e.g. a thin wrapper around a shared cache server, which sets shared to True so the
+    warm_caches job knows its entries reach every process.
+    """
+
+    shared = False
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def models_version(*models) -> Tuple[Optional[datetime], str]:
+    """Summarize the current state of some tables in a single query.
+
+    Each table contributes its TableVersion counter, which every insert, update and delete
+    moves as the table is in VERSIONED_TABLES, and its max edited_at when it has one. Neither needs a scan: the counter is a primary
+    key lookup and edited_at is indexed.
+
+    :param models: model classes the response is built from
+    :return: (latest edited_at, version string)
+    """
+    versions = TableVersion.__table__
+    columns = []
+    for model in models:
+        columns.append(
+            select(versions.c.version)
+            .where(versions.c.name == model.__tablename__)
+            .scalar_subquery()
+        )
+        if hasattr(model, "edited_at"):
+            columns.append(select(func.max(model.edited_at)).scalar_subquery())
+    values = db.session.execute(select(*columns)).one()
+    edited_ats = [value for value in values if isinstance(value, datetime)]
+    last_modified = max(edited_ats) if edited_ats else None
+    return last_modified, "|".join(str(value) for value in values)
+
+
+class ResponseCache:
+    """Cache GET responses until the tables they are built from change.
+
+    Entries are keyed by request path and query string and tagged with an ETag derived from
+    models_version. A request whose ETag still matches is answered from the cache, or with
+    304 Not Modified when the client sent it in If-None-Match. A mismatch means one of the
+    tables was written, so the entry is rebuilt and replaced.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend if backend is not None else LRUBackend()
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def cached(self, *models):
+        for model in models:
+            if model.__tablename__ not in VERSIONED_TABLES:
+                raise ValueError(
+                    f"{model.__tablename__} must be in VERSIONED_TABLES to be cached"
+                )
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not current_app.config.get("RESPONSE_CACHE_ENABLED", True):
+                    return view(*args, **kwargs)
+
+                last_modified, version = models_version(*models)
+                key = request.full_path
+                etag = hashlib.sha1(f"{key}|{version}".encode()).hexdigest()
+                if request.if_none_match.contains(etag):
+                    response = current_app.response_class(status=304)
+                else:
+                    entry = self.backend.get(key)
+                    if entry is not None and entry[0] == etag:
+                        _, data, headers = entry
+                        response = current_app.response_class(data, headers=headers)
+                    else:
+                        response = current_app.make_response(view(*args, **kwargs))
+                        if response.status_code != 200:
+                            return response
+                        headers = list(response.headers.items())
+                        self.backend.set(key, (etag, response.get_data(), headers))
+                response.set_etag(etag)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+                return response
+
+            return wrapper
+
+        return decorator
+
+
+response_cache = ResponseCache()
+
+
+class RecipeCache:
+    """Recipe JSON by id, reused while the recipe's edited_at and its ingredient tables are
+    unchanged.
+
+    Each load checks the edited_at of the cached recipes and the TableVersion counters of the
+    recipe_ingredients and abstract_ingredients tables in one query, and only rebuilds the
+    recipes that changed, were never cached or evicted, or are older than ttl_seconds. An
+    ingredient write moves the counters, so it rebuilds every cached recipe on the next load;
+    the TTL only bounds writes that bypass the session. Cached dicts are shared between requests
+    and must not be modified.
+    """
+
+    # tables whose writes change a recipe's JSON without moving its edited_at
+    INGREDIENT_MODELS = (RecipeIngredient, AbstractIngredient)
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300, backend=None):
+        self.ttl_seconds = ttl_seconds
+        self.backend = backend if backend is not None else LRUBackend(max_entries)
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+    def _versions(self) -> List:
+        versions = TableVersion.__table__
+        return [
+            select(versions.c.version)
+            .where(versions.c.name == model.__tablename__)
+            .scalar_subquery()
+            for model in self.INGREDIENT_MODELS
+        ]
+
+    def load(self, session, recipe_ids: List[uuid.UUID]) -> Dict[uuid.UUID, Dict]:
+        """Recipes shaped like Recipe.to_json, for those of recipe_ids that exist.
+
+        :param session: session to query with
+        :param recipe_ids: ids to fetch
+        :return: recipe id to recipe
+        """
+        now = monotonic()
+        cached = {}
+        for recipe_id in recipe_ids:
+            entry = self.backend.get(recipe_id)
+            if entry is not None and now - entry[2] < self.ttl_seconds:
+                cached[recipe_id] = entry
+        recipes = {}
+        stale = [recipe_id for recipe_id in recipe_ids if recipe_id not in cached]
+        versions = None
+        if cached:
+            rows = session.execute(
+                select(Recipe.id, Recipe.edited_at, *self._versions()).where(
+                    Recipe.id.in_(list(cached))
+                )
+            ).all()
+            for recipe_id, edited_at, *row_versions in rows:
+                # the counters are the same on every row
+                versions = tuple(row_versions)
+                if cached[recipe_id][:2] == (edited_at, versions):
+                    recipes[recipe_id] = cached[recipe_id][3]
+                else:
+                    stale.append(recipe_id)
+        if stale:
+            # read before the rebuild, so a write in between leaves the entry outdated
+            if versions is None:
+                versions = tuple(session.execute(select(*self._versions())).one())
+            for recipe in load_recipes_json(session, Recipe.id.in_(stale)):
+                self.backend.set(
+                    recipe["id"], (recipe["edited_at"], versions, now, recipe)
+                )
+                recipes[recipe["id"]] = recipe
+        return recipes
+
+
+recipe_cache = RecipeCache()
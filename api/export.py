@@ -0,0 +1,44 @@
+"""Chunked encoders for streaming exports, so response memory does not grow with row count.
+
+Rows arrive in partitions from a result executed with yield_per, which on postgres reads them
+through a server-side cursor. Each partition becomes one chunk of the response body.
+"""
+
+import zlib
+from typing import Callable, Iterable, Iterator
+
+EXPORT_BATCH_SIZE = 1000
+# header row of the farm's egg CSVs, which data/load_data.py reads
+CSV_HEADER = "Date,Pink,Brown,Blue,Total Harvested,Broken/ Etc\n"
+
+
+def ndjson_chunks(
+    partitions: Iterable, encode: Callable[[dict], bytes]
+) -> Iterator[bytes]:
+    """One JSON object per line, encoded by encode, which must end each object with a newline."""
+    for rows in partitions:
+        yield b"".join(encode(dict(row)) for row in rows)
+
+
+def stock_csv_chunks(partitions: Iterable) -> Iterator[bytes]:
+    """Stock records in the layout of the farm's egg CSVs, which read_daily_egg_csvs reads back.
+
+    record_date goes in the Date column and quantity in Total Harvested; the color columns are
+    left blank.
+    """
+    yield CSV_HEADER.encode()
+    for rows in partitions:
+        yield "".join(
+            f"{row['record_date']:%m/%d/%Y},,,,{row['quantity']},\n" for row in rows
+        ).encode()
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a stream of chunks into one gzip member, flushing after each chunk."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        # a sync flush sends each chunk's bytes now instead of when the buffer fills
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
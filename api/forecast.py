@@ -0,0 +1,239 @@
+"""Egg availability forecast from the daily harvest series, kept fitted in harvest_forecasts.
+
+A day's expected harvest is a level times the seasonal factor of its week of the year:
+- the seasonal factor is the mean daily total of that week of the year over all history,
+  divided by the overall mean, so it is stored as per-week sums and day counts
+- the level is an exponentially weighted mean of deseasonalized daily totals, with a half-life
+  of LEVEL_HALF_LIFE_DAYS
+
+Both are updated from new days alone: an import that appends days after the fitted ones adds
+them to the sums and folds them into the level, and only an import that rewrites fitted days
+refits from the whole series. Fitting is done with NumPy array operations and is skipped when
+NumPy is not installed. Forecasting reads the one row of parameters and walks the days ahead,
+so its cost does not depend on the length of the history.
+"""
+
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from sqlalchemy import select
+
+from api.model import DailyHarvest, HarvestForecast, db, upsert_rows, week_ending
+
+FORECASTING = np is not None
+SERIES = "total"
+# weeks of the year; the last one also takes day 365 and leap day 366
+SEASONS = 52
+LEVEL_HALF_LIFE_DAYS = 14
+LEVEL_WEIGHT = 1 - 0.5 ** (1 / LEVEL_HALF_LIFE_DAYS)
+PARAMETERS = [
+    "first_date",
+    "last_date",
+    "days",
+    "level",
+    "week_total",
+    "season_sums",
+    "season_counts",
+]
+
+
+def season(day: date) -> int:
+    """Week of the year of day, from 0 to SEASONS - 1."""
+    return min((day.timetuple().tm_yday - 1) // 7, SEASONS - 1)
+
+
+def seasonal_factors(sums: Sequence[float], counts: Sequence[int]) -> List[float]:
+    """Mean daily harvest of each week of the year relative to the overall mean.
+
+    Weeks never seen get 1, as does every week while nothing has been harvested.
+    """
+    days, eggs = sum(counts), sum(sums)
+    if not days or not eggs:
+        return [1.0] * SEASONS
+    overall = eggs / days
+    return [
+        total / count / overall if count else 1.0 for total, count in zip(sums, counts)
+    ]
+
+
+def empty_parameters() -> Dict:
+    return {
+        "first_date": None,
+        "last_date": None,
+        "days": 0,
+        "level": None,
+        "week_total": 0,
+        "season_sums": [0.0] * SEASONS,
+        "season_counts": [0] * SEASONS,
+    }
+
+
+def _smooth(level: float, values: "np.ndarray", weights: "np.ndarray") -> float:
+    """Exponentially weighted mean of values after level, where day i has weight weights[i].
+
+    Day i keeps a share of weights[i] times the product of (1 - weight) of the days after it,
+    which is what applying level = weight * value + (1 - weight) * level day by day gives.
+    """
+    keep = 1 - weights
+    after = np.append(np.cumprod(keep[:0:-1])[::-1], 1.0)
+    return float(np.prod(keep) * level + np.sum(weights * values * after))
+
+
+def update_forecast(parameters: Dict, harvests: Sequence[Tuple[date, int]]) -> Dict:
+    """Fold days after parameters["last_date"] into the forecast parameters.
+
+    :param parameters: parameters fitted so far, or empty_parameters() to fit from scratch
+    :param harvests: (date, total) of the new days, in date order
+    :return: new parameters; the given ones are not changed
+    """
+    if np is None:
+        raise ImportError("numpy is required to fit the harvest forecast")
+    if not harvests:
+        return parameters
+    days = np.array([harvest[0] for harvest in harvests], dtype="M8[D]")
+    totals = np.array([harvest[1] for harvest in harvests], dtype=np.float64)
+    day_of_year = (days - days.astype("M8[Y]").astype("M8[D]")).astype(np.int64)
+    seasons = np.minimum(day_of_year // 7, SEASONS - 1)
+
+    sums = np.asarray(parameters["season_sums"], dtype=np.float64)
+    sums += np.bincount(seasons, weights=totals, minlength=SEASONS)
+    counts = np.asarray(parameters["season_counts"], dtype=np.int64)
+    counts += np.bincount(seasons, minlength=SEASONS)
+
+    factors = np.array(seasonal_factors(sums.tolist(), counts.tolist()))[seasons]
+    # a week of the year that never had eggs says nothing about the level
+    seen = factors > 0
+    values = totals / np.where(seen, factors, 1.0)
+    level = parameters["level"]
+    if level is None:
+        level = float(values[seen][0]) if seen.any() else None
+    if level is not None:
+        level = _smooth(level, values, np.where(seen, LEVEL_WEIGHT, 0.0))
+
+    # 1970-01-01 was a Thursday, so a day's closing Monday is (4 - day) % 7 days later
+    numbers = days.astype(np.int64)
+    weeks = numbers + (4 - numbers) % 7
+    last_date = harvests[-1][0]
+    week_total = int(totals[weeks == weeks[-1]].sum())
+    if parameters["last_date"] and week_ending(parameters["last_date"]) == week_ending(
+        last_date
+    ):
+        week_total += parameters["week_total"]
+    return {
+        "first_date": parameters["first_date"] or harvests[0][0],
+        "last_date": last_date,
+        "days": parameters["days"] + len(harvests),
+        "level": level,
+        "week_total": week_total,
+        "season_sums": sums.tolist(),
+        "season_counts": counts.tolist(),
+    }
+
+
+def refresh_harvest_forecast(start_date: date, end_date: date) -> Optional[Dict]:
+    """Update the forecast after daily harvests from start_date to end_date changed.
+
+    Days after the fitted ones, up to end_date, are folded in; a change to a fitted day refits
+    from the whole daily series, including days after end_date. The caller commits.
+
+    :param start_date: earliest daily harvest that changed
+    :param end_date: latest daily harvest that changed
+    :return: the new parameters, or None when NumPy is not installed
+    """
+    if np is None:
+        return None
+    columns = [getattr(HarvestForecast, parameter) for parameter in PARAMETERS]
+    fitted = db.session.execute(
+        select(*columns).where(HarvestForecast.series == SERIES)
+    ).first()
+    statement = select(DailyHarvest.harvest_date, DailyHarvest.total)
+    if fitted is not None and fitted.last_date and start_date > fitted.last_date:
+        parameters = dict(fitted._mapping)
+        statement = statement.where(
+            DailyHarvest.harvest_date > fitted.last_date,
+            DailyHarvest.harvest_date <= end_date,
+        )
+    else:
+        # fitted days after end_date are kept, or the forecast would rewind to end_date
+        parameters = empty_parameters()
+    harvests = db.session.execute(statement.order_by(DailyHarvest.harvest_date)).all()
+    parameters = update_forecast(parameters, harvests)
+    now = datetime.utcnow()
+    upsert_rows(
+        HarvestForecast,
+        [
+            {
+                "id": uuid.uuid4(),
+                "created_at": now,
+                "edited_at": now,
+                "series": SERIES,
+                **parameters,
+            }
+        ],
+        conflict_columns=["series"],
+        update_columns=[*PARAMETERS, "edited_at"],
+    )
+    return parameters
+
+
+def forecast_weeks(parameters: Dict, weeks: int) -> List[Dict]:
+    """Expected harvest of each week after the last fitted day.
+
+    The first week is the one the next day belongs to; when that week has already begun, its
+    harvested eggs are counted and only the rest of it is projected.
+
+    :param parameters: fitted parameters
+    :param weeks: number of weeks
+    :return: one dict per week, by its closing Monday
+    """
+    factors = seasonal_factors(parameters["season_sums"], parameters["season_counts"])
+    level = parameters["level"] or 0.0
+    last_date = parameters["last_date"]
+    day = last_date + timedelta(days=1)
+    harvested = parameters["week_total"] if day.weekday() != 1 else 0
+    forecast = []
+    for week in range(weeks):
+        closing = week_ending(last_date + timedelta(days=1)) + timedelta(weeks=week)
+        eggs = float(harvested)
+        while day <= closing:
+            eggs += level * factors[season(day)]
+            day += timedelta(days=1)
+        # rounded first, so float error cannot drop a whole dozen
+        eggs = round(eggs, 1)
+        forecast.append(
+            {
+                "week_ending": closing,
+                "harvested": harvested,
+                "eggs": eggs,
+                "dozens": int(eggs // 12),
+            }
+        )
+        harvested = 0
+    return forecast
+
+
+def harvest_forecast(session, weeks: int = 1) -> Optional[Dict]:
+    """Read the fitted forecast and project it weeks ahead, with one single-row query.
+
+    :param session: session to query with
+    :param weeks: number of weeks
+    :return: the last fitted day, the level and the weeks, or None before the first fit
+    """
+    columns = [getattr(HarvestForecast, parameter) for parameter in PARAMETERS]
+    fitted = session.execute(
+        select(*columns).where(HarvestForecast.series == SERIES)
+    ).first()
+    if fitted is None or fitted.last_date is None:
+        return None
+    parameters = dict(fitted._mapping)
+    return {
+        "as_of": parameters["last_date"],
+        "level": parameters["level"],
+        "weeks": forecast_weeks(parameters, weeks),
+    }
@@ -0,0 +1,211 @@
+"""Live egg availability for checkout, with reservations that cannot oversell.
+
+Reads are answered from an in-memory counter. Reserving and releasing change the inventory row
+with one atomic UPDATE ... RETURNING, so the database decides whether stock remains and the row
+stays locked until the reservation commits. The counter then takes the value the database
+returned. Each process keeps its own counter, so writes of other processes, such as checkouts in
+other workers or a CSV import, are only seen once the value is older than COUNTER_TTL_SECONDS
+and read again; a stale counter can only show too much or too little stock, never let it
+oversell.
+
+Every write of weekly stock records restocks the row by the change in the latest week's dozens,
+in the same transaction, so held reservations keep counting against the new stock. The counter
+takes the restocked value once that transaction commits.
+"""
+
+import uuid
+from datetime import date, datetime
+from threading import Lock
+from time import monotonic
+from typing import Optional, Tuple
+
+from sqlalchemy import event, orm, select, update
+
+from api.model import EggStockRecord, Inventory, Reservation, db, dialect_insert
+
+EGGS = "dozen eggs"
+# seconds a counter value is trusted before it is read from the database again
+COUNTER_TTL_SECONDS = 5
+
+
+class InventoryCounter:
+    """Last known availability per item, shared by every thread of the process.
+
+    Values older than ttl_seconds are forgotten, so writes of other processes are seen.
+    """
+
+    def __init__(self, ttl_seconds: float = COUNTER_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._lock = Lock()
+        self._available = {}
+
+    def get(self, item: str) -> Optional[int]:
+        entry = self._available.get(item)
+        if entry is None or monotonic() - entry[1] >= self.ttl_seconds:
+            return None
+        return entry[0]
+
+    def set(self, item: str, available: int) -> None:
+        with self._lock:
+            self._available[item] = (available, monotonic())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._available.clear()
+
+
+inventory_counter = InventoryCounter()
+
+
+def latest_week() -> Optional[Tuple[date, int]]:
+    """record_date and dozens of the latest weekly stock record, or None before the first one."""
+    latest = db.session.execute(
+        select(EggStockRecord.record_date, EggStockRecord.quantity)
+        .order_by(EggStockRecord.record_date.desc())
+        .limit(1)
+    ).first()
+    return tuple(latest) if latest is not None else None
+
+
+def latest_stock() -> int:
+    """Dozens in the latest weekly stock record, or 0 before the first one."""
+    latest = latest_week()
+    return (latest[1] or 0) if latest is not None else 0
+
+
+def seed_inventory(item: str = EGGS) -> int:
+    """Create the item's inventory row from the latest weekly stock record, if it has none.
+
+    Concurrent first requests may both try; the row is inserted once. The row is read back from
+    the primary, which a replica may not have caught up with. The caller commits.
+
+    :param item: inventory item
+    :return: units available
+    """
+    statement = select(Inventory.available).where(Inventory.item == item)
+    available = db.session.scalars(statement).first()
+    if available is None:
+        now = datetime.utcnow()
+        insert = dialect_insert(db.session)
+        available = db.session.scalars(
+            insert(Inventory.__table__)
+            .values(
+                id=uuid.uuid4(),
+                created_at=now,
+                edited_at=now,
+                item=item,
+                available=latest_stock(),
+            )
+            .on_conflict_do_nothing(index_elements=["item"])
+            .returning(Inventory.available)
+        ).first()
+        if available is None:
+            # another request inserted it first
+            available = db.session.scalars(
+                statement, bind_arguments={"bind": db.engine}
+            ).one()
+    return available
+
+
+def restock(change: int, item: str = EGGS) -> Optional[int]:
+    """Move the item's availability by the change in the latest weekly stock.
+
+    Called after weekly stock records are written, in their transaction. An item without an
+    inventory row is left to seed_inventory. The caller commits, and the counter takes the new
+    value once it has.
+
+    :param change: dozens the latest week gained, negative when it lost some
+    :param item: inventory item
+    :return: units available afterwards, or None when nothing changed
+    """
+    if not change:
+        return None
+    left = db.session.scalars(
+        update(Inventory)
+        .where(Inventory.item == item)
+        .values(available=Inventory.available + change, edited_at=datetime.utcnow())
+        .returning(Inventory.available)
+    ).first()
+    if left is not None:
+        db.session.info.setdefault("restocked", {})[item] = left
+    return left
+
+
+@event.listens_for(orm.Session, "after_commit")
+def _set_restocked_counters(session) -> None:
+    for item, left in session.info.pop("restocked", {}).items():
+        inventory_counter.set(item, left)
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _forget_restocked_counters(session, previous_transaction) -> None:
+    session.info.pop("restocked", None)
+
+
+def refresh(item: str = EGGS) -> int:
+    """Reload the counter from the database, seeding the inventory row when it is missing."""
+    available = seed_inventory(item)
+    db.session.commit()
+    inventory_counter.set(item, available)
+    return available
+
+
+def available(item: str = EGGS) -> int:
+    """Units of item available, from memory. Reads query once the counter has expired."""
+    value = inventory_counter.get(item)
+    if value is None:
+        value = refresh(item)
+    return value
+
+
+def reserve(quantity: int, item: str = EGGS) -> Tuple[Optional[Reservation], int]:
+    """Hold quantity units of item, if that many are available, and commit.
+
+    :param quantity: positive number of units
+    :param item: inventory item
+    :return: the reservation, or None when there is not enough stock, and the units left
+    """
+    if inventory_counter.get(item) is None:
+        seed_inventory(item)
+    now = datetime.utcnow()
+    left = db.session.scalars(
+        update(Inventory)
+        .where(Inventory.item == item, Inventory.available >= quantity)
+        .values(available=Inventory.available - quantity, edited_at=now)
+        .returning(Inventory.available)
+    ).first()
+    if left is None:
+        db.session.rollback()
+        return None, refresh(item)
+    reservation = Reservation(item=item, quantity=quantity)
+    db.session.add(reservation)
+    db.session.commit()
+    inventory_counter.set(item, left)
+    return reservation, left
+
+
+def release(reservation_id: uuid.UUID) -> Optional[int]:
+    """Return a held reservation's units to stock and commit.
+
+    :param reservation_id: id of the reservation
+    :return: units available afterwards, or None if the reservation is unknown or released
+    """
+    now = datetime.utcnow()
+    released = db.session.execute(
+        update(Reservation)
+        .where(Reservation.id == reservation_id, Reservation.released_at.is_(None))
+        .values(released_at=now, edited_at=now)
+        .returning(Reservation.item, Reservation.quantity)
+    ).first()
+    if released is None:
+        db.session.rollback()
+        return None
+    left = db.session.scalars(
+        update(Inventory)
+        .where(Inventory.item == released.item)
+        .values(available=Inventory.available + released.quantity, edited_at=now)
+        .returning(Inventory.available)
+    ).one()
+    db.session.commit()
+    inventory_counter.set(released.item, left)
+    return left
@@ -0,0 +1,401 @@
+"""Background jobs, so CSV imports, aggregate refreshes, snapshots and cache warming run off the
+request path.
+
+Jobs are rows of the jobs table, worked by separate processes:
+
+    python -m api.jobs work                # run jobs as they come due, until interrupted
+    python -m api.jobs work --once         # run every due job, then exit
+    python -m api.jobs enqueue refresh_aggregates '{"start": "2023-01-01"}'
+    python -m api.jobs list
+
+A worker claims the oldest due job with SELECT ... FOR UPDATE SKIP LOCKED, so on postgres
+concurrent workers neither wait on nor share a job, then marks it running and commits before
+the work starts. Handlers report progress between their steps, which commits the step and moves
+the job's edited_at; a running job whose edited_at is older than STALE_AFTER is assumed to have
+lost its worker and is queued again. A job that raises is retried after RETRY_BACKOFF seconds,
+doubling each attempt, until it has run max_attempts times.
+"""
+
+import argparse
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional
+
+from flask import current_app
+from sqlalchemy import func, select, update
+
+from api.aggregates import refresh_daily_harvests, refresh_harvest_aggregates
+from api.cache import response_cache
+from api.model import HOME_FARM, FarmHarvest, Job, db
+from api.snapshot import rebuild_snapshot
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = "queued", "running", "succeeded", "failed"
+DEFAULT_MAX_ATTEMPTS = 3
+# seconds before the first retry, doubled for each one after
+RETRY_BACKOFF = 30
+STALE_AFTER = timedelta(minutes=15)
+POLL_SECONDS = 1.0
+# days of harvests re-summed per step of refresh_aggregates
+REFRESH_STEP_DAYS = 92
+WARM_PATHS = [
+    "/api/recipes",
+    "/api/stock/history",
+    "/api/stock/history?granularity=month",
+    "/api/stock/forecast",
+]
+# payload fields of each kind that must be yyyy-mm-dd dates
+PAYLOAD_DATES = {"refresh_aggregates": ["start", "end"]}
+
+log = logging.getLogger("api.jobs")
+
+# kind: function of (payload, progress) returning a message for the finished job
+HANDLERS: Dict[str, Callable] = {}
+
+
+def handler(kind: str):
+    """Register the decorated function as the handler of jobs of kind."""
+
+    def register(function: Callable) -> Callable:
+        HANDLERS[kind] = function
+        return function
+
+    return register
+
+
+class Progress:
+    """Reports how far a running job has got. Each report commits the session, so handlers call
+    it once a step's work is done and the job's progress and heartbeat are seen at once.
+    """
+
+    def __init__(self, job_id: uuid.UUID):
+        self.job_id = job_id
+
+    def __call__(
+        self, done: int, total: Optional[int] = None, message: Optional[str] = None
+    ) -> None:
+        values = {"progress_done": done, "edited_at": datetime.utcnow()}
+        if total is not None:
+            values["progress_total"] = total
+        if message is not None:
+            values["message"] = message
+        db.session.execute(update(Job).where(Job.id == self.job_id).values(**values))
+        db.session.commit()
+
+
+def enqueue(
+    kind: str,
+    payload: Optional[Dict] = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    run_after: Optional[datetime] = None,
+) -> Job:
+    """Queue a job. The caller commits.
+
+    :param kind: name of a registered handler
+    :param payload: JSON arguments of the handler
+    :param max_attempts: runs allowed before the job is marked failed
+    :param run_after: earliest time to start, defaults to now
+    :return: the queued job
+    :raises ValueError: when no handler is registered for kind, or a payload date is invalid
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"kind must be one of {sorted(HANDLERS)}")
+    for name in PAYLOAD_DATES.get(kind, []):
+        _date(payload or {}, name)
+    job = Job(
+        kind=kind,
+        payload=payload or {},
+        status=QUEUED,
+        max_attempts=max_attempts,
+        run_after=run_after,
+    )
+    db.session.add(job)
+    return job
+
+
+def requeue_stale(now: Optional[datetime] = None) -> int:
+    """Queue again the running jobs that stopped reporting, as their worker is gone.
+
+    Jobs without attempts left are marked failed instead. Commits.
+
+    :return: number of jobs queued again or failed
+    """
+    now = now or datetime.utcnow()
+    stale = (Job.status == RUNNING, Job.edited_at < now - STALE_AFTER)
+    requeued = db.session.execute(
+        update(Job)
+        .where(*stale, Job.attempts < Job.max_attempts)
+        .values(status=QUEUED, run_after=now, edited_at=now, worker=None)
+    ).rowcount
+    failed = db.session.execute(
+        update(Job)
+        .where(*stale)
+        .values(status=FAILED, finished_at=now, edited_at=now, error="worker lost")
+    ).rowcount
+    db.session.commit()
+    return requeued + failed
+
+
+def claim_job(worker: str, kinds: Optional[Iterable[str]] = None) -> Optional[Job]:
+    """Take the oldest due job and mark it running. Commits.
+
+    SQLite has no FOR UPDATE; there the UPDATE's status check keeps two workers from claiming
+    the same job.
+
+    :param worker: name recorded on the job
+    :param kinds: only claim jobs of these kinds
+    :return: the claimed job, or None when no job is due
+    """
+    now = datetime.utcnow()
+    statement = select(Job.id).where(Job.status == QUEUED, Job.run_after <= now)
+    if kinds:
+        statement = statement.where(Job.kind.in_(list(kinds)))
+    statement = (
+        statement.order_by(Job.run_after, Job.created_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    )
+    job_id = db.session.scalars(statement).first()
+    claimed = 0
+    if job_id is not None:
+        claimed = db.session.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.status == QUEUED)
+            .values(
+                status=RUNNING,
+                attempts=Job.attempts + 1,
+                worker=worker,
+                started_at=now,
+                edited_at=now,
+            )
+        ).rowcount
+    db.session.commit()
+    return db.session.get(Job, job_id) if claimed else None
+
+
+def run_job(job: Job) -> bool:
+    """Run a claimed job's handler and record the outcome. Commits.
+
+    :param job: job returned by claim_job
+    :return: whether the handler succeeded
+    """
+    job_id, attempts, max_attempts = job.id, job.attempts, job.max_attempts
+    try:
+        message = HANDLERS[job.kind](job.payload or {}, Progress(job_id))
+    except Exception as error:
+        db.session.rollback()
+        now = datetime.utcnow()
+        values = {"error": f"{type(error).__name__}: {error}", "edited_at": now}
+        if attempts < max_attempts:
+            backoff = timedelta(seconds=RETRY_BACKOFF * 2 ** (attempts - 1))
+            values.update(status=QUEUED, run_after=now + backoff, worker=None)
+        else:
+            values.update(status=FAILED, finished_at=now)
+        db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+        db.session.commit()
+        log.exception(
+            "job %s failed on attempt %s of %s", job_id, attempts, max_attempts
+        )
+        return False
+    now = datetime.utcnow()
+    values = {"status": SUCCEEDED, "finished_at": now, "edited_at": now, "error": None}
+    if message is not None:
+        values["message"] = message
+    db.session.execute(update(Job).where(Job.id == job_id).values(**values))
+    db.session.commit()
+    return True
+
+
+def work(
+    once: bool = False,
+    kinds: Optional[Iterable[str]] = None,
+    worker: Optional[str] = None,
+    poll_seconds: float = POLL_SECONDS,
+) -> int:
+    """Claim and run jobs one at a time, in the current app context.
+
+    :param once: return when no job is due, instead of polling for more
+    :param kinds: only run jobs of these kinds
+    :param worker: name recorded on claimed jobs, defaults to host:pid
+    :param poll_seconds: wait between polls of an empty queue
+    :return: number of jobs run
+    """
+    worker = worker or f"{socket.gethostname()}:{os.getpid()}"
+    ran = 0
+    while True:
+        requeue_stale()
+        job = claim_job(worker, kinds)
+        if job is None:
+            if once:
+                return ran
+            time.sleep(poll_seconds)
+            continue
+        run_job(job)
+        ran += 1
+
+
+def _date(payload: Dict, name: str) -> Optional[date]:
+    value = payload.get(name)
+    if not value:
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f"{name} must be a yyyy-mm-dd date")
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a yyyy-mm-dd date") from None
+
+
+def shared_cache() -> bool:
+    """Whether the response cache's backend is shared by every process serving requests.
+
+    Backends say so with a true shared attribute; the default LRUBackend lives in one process.
+    """
+    return getattr(response_cache.backend, "shared", False)
+
+
+@handler("ingest_csvs")
+def ingest_csvs(payload: Dict, progress: Progress) -> str:
+    """Import egg CSVs one file at a time, committing and reporting after each.
+
+    Payload: {"farms": {farm id: [csv paths]}} or {"files": [csv paths]} of the home farm, and
+    optionally "vectorized": true. Weekly dozens are re-summed from the stored days, so weeks
+    that span files come out as in one import, and a later file of a farm wins a repeated day.
+    The stock snapshot is rebuilt once, after the last file.
+    """
+    # imported on use to keep the CSV loader out of the app's startup
+    from data.load_data import ingest_farm_csvs
+
+    farm_files = payload.get("farms") or {HOME_FARM: payload.get("files", [])}
+    tasks = [
+        (farm_id, file)
+        for farm_id in sorted(farm_files)
+        for file in farm_files[farm_id]
+    ]
+    written = 0
+    for done, (farm_id, file) in enumerate(tasks, start=1):
+        written += ingest_farm_csvs(
+            {farm_id: [file]},
+            max_workers=1,
+            vectorized=payload.get("vectorized", False),
+            snapshot=False,
+        )
+        progress(done, len(tasks), f"imported {os.path.basename(file)} of {farm_id}")
+    rebuild_snapshot()
+    return f"upserted {written} weekly records from {len(tasks)} files"
+
+
+@handler("refresh_aggregates")
+def refresh_aggregates(payload: Dict, progress: Progress) -> str:
+    """Re-sum daily harvests, their week and month aggregates and the forecast, a few months
+    per step.
+
+    Payload: optional "start" and "end" yyyy-mm-dd dates, defaulting to the first and last
+    farm harvest.
+    """
+    from api.forecast import refresh_harvest_forecast
+
+    first, last = db.session.execute(
+        select(func.min(FarmHarvest.harvest_date), func.max(FarmHarvest.harvest_date))
+    ).one()
+    start_date = _date(payload, "start") or first
+    end_date = _date(payload, "end") or last
+    if start_date is None or end_date is None or start_date > end_date:
+        return "no harvests to refresh"
+    steps = (end_date - start_date).days // REFRESH_STEP_DAYS + 1
+    for step in range(steps):
+        step_start = start_date + timedelta(days=step * REFRESH_STEP_DAYS)
+        step_end = min(step_start + timedelta(days=REFRESH_STEP_DAYS - 1), end_date)
+        refresh_daily_harvests(step_start, step_end)
+        refresh_harvest_aggregates(step_start, step_end)
+        progress(step + 1, steps + 1, f"refreshed {step_start} to {step_end}")
+    refresh_harvest_forecast(start_date, end_date)
+    progress(steps + 1, steps + 1, "refreshed the forecast")
+    rebuild_snapshot()
+    return f"refreshed {start_date} to {end_date}"
+
+
+@handler("write_snapshot")
+def write_snapshot(payload: Dict, progress: Progress) -> str:
+    """Rebuild the stock snapshot at the app's STOCK_SNAPSHOT_PATH, after records changed."""
+    if not current_app.config.get("STOCK_SNAPSHOT_PATH"):
+        return "no STOCK_SNAPSHOT_PATH is set"
+    written = rebuild_snapshot()
+    if written is None:
+        return "a snapshot at least as new is already in place"
+    return ", ".join(f"{rows} {series} rows" for series, rows in written.items())
+
+
+@handler("warm_caches")
+def warm_caches(payload: Dict, progress: Progress) -> str:
+    """Request read routes through the app, filling the response cache's shared backend.
+
+    Without a shared backend the responses would only be cached in the worker's own process,
+    so the job does nothing.
+
+    Payload: optional "paths", defaulting to WARM_PATHS.
+    """
+    if not shared_cache():
+        return "the response cache has no shared backend to warm"
+    paths = payload.get("paths") or WARM_PATHS
+    client = current_app.test_client()
+    errors = []
+    for done, path in enumerate(paths, start=1):
+        status = client.get(path).status_code
+        if status >= 500:
+            errors.append(f"{path} returned {status}")
+        progress(done, len(paths), f"{path} returned {status}")
+    if errors:
+        raise RuntimeError("; ".join(errors))
+    return f"requested {len(paths)} paths"
+
+
+def list_jobs(statuses: Optional[List[str]] = None, limit: int = 50) -> List[Job]:
+    """Most recently created jobs, optionally of some statuses only."""
+    statement = select(Job).order_by(Job.created_at.desc()).limit(limit)
+    if statuses:
+        statement = statement.where(Job.status.in_(statuses))
+    return list(db.session.scalars(statement))
+
+
+# exclude from coverage
+if __name__ == "__main__":  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Run or queue background jobs")
+    commands = parser.add_subparsers(dest="command", required=True)
+    work_parser = commands.add_parser("work", help="run queued jobs")
+    work_parser.add_argument(
+        "--once", action="store_true", help="exit when no job is due"
+    )
+    work_parser.add_argument(
+        "--kind", action="append", help="only run jobs of this kind; repeatable"
+    )
+    enqueue_parser = commands.add_parser("enqueue", help="queue a job")
+    enqueue_parser.add_argument("kind")
+    enqueue_parser.add_argument("payload", nargs="?", default="{}", help="JSON object")
+    enqueue_parser.add_argument(
+        "--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS
+    )
+    list_parser = commands.add_parser("list", help="show recent jobs")
+    list_parser.add_argument("--status", action="append")
+    args = parser.parse_args()
+    from api.main import create_app
+
+    logging.basicConfig(level=logging.INFO)
+    with create_app().app_context():
+        if args.command == "work":
+            print(f"ran {work(once=args.once, kinds=args.kind)} jobs")
+        elif args.command == "enqueue":
+            job = enqueue(args.kind, json.loads(args.payload), args.max_attempts)
+            db.session.commit()
+            print(job.id)
+        else:
+            for job in list_jobs(args.status):
+                total = "?" if job.progress_total is None else job.progress_total
+                print(
+                    f"{job.id} {job.kind:18} {job.status:9} "
+                    f"{job.progress_done}/{total} {job.message or job.error or ''}"
+                )
@@ -1,39 +1,492 @@
-from api.model import EggStockRecord, Recipe, app, connect_to_db
+import os
+import uuid
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
 
+from flask import Flask, abort, current_app, request, stream_with_context, url_for
 
-@app.route("/api/")
+from api import bulk, export, inventory, jobs, search
+from api.aggregates import GRANULARITIES, harvest_series, upsert_weekly_dozens
+from api.cache import recipe_cache, response_cache
+from api.metrics import PROMETHEUS_CONTENT_TYPE, instrument, render_metrics
+from api.model import (
+    AbstractIngredient,
+    DailyHarvest,
+    EggStockRecord,
+    HarvestAggregate,
+    HarvestForecast,
+    Job,
+    Recipe,
+    RecipeIngredient,
+    connect_to_db,
+    date_bounds,
+    db,
+)
+from api.queries import (
+    egg_stock_records_statement,
+    load_recipes_json,
+    scale_recipe_json,
+    shopping_list_statement,
+)
+from api.search import SEARCH_DEFAULT_LIMIT, SEARCH_MAX_LIMIT
+from api.serialization import FastJSONProvider
+from api.snapshot import SERIES, read_series
+
+EGG_STOCK_RECORDS_DEFAULT_LIMIT = 100
+EGG_STOCK_RECORDS_MAX_LIMIT = 1000
+RECIPES_MAX_IDS = 100
+FORECAST_MAX_WEEKS = 12
+# imports name files on the server, so they are queued with python -m api.jobs instead
+API_JOB_KINDS = ["refresh_aggregates", "warm_caches", "write_snapshot"]
+BULK_MAX_ROWS = 10000
+
+# (rule, view function, add_url_rule options), registered on each app by create_app
+ROUTES: List[Tuple[str, Callable, Dict]] = []
+
+
+def route(rule: str, **options):
+    """Register the decorated view, like Flask.route, for every app create_app builds.
+
+    Views keep their function names as endpoints, which label the request metrics.
+    """
+
+    def register(view: Callable) -> Callable:
+        ROUTES.append((rule, view, options))
+        return view
+
+    return register
+
+
+def create_app(config: Optional[Dict] = None) -> Flask:
+    """Build the Flask app with every route of this module.
+
+    Nothing connects to the database here; engines open their first connection when a request
+    needs one. Serve it with e.g. gunicorn 'api.main:create_app()'.
+
+    :param config: Flask config; SQLALCHEMY_DATABASE_URI and DATABASE_REPLICA_URLS (a list)
+        default to the DATABASE_URL and DATABASE_REPLICA_URLS environment variables, and
+        STOCK_SNAPSHOT_PATH, the file of api.snapshot, to the environment variable of that name
+    :return: Flask app
+    """
+    application = Flask(__name__)
+    application.json = FastJSONProvider(application)
+    application.config.update(config or {})
+    application.config.setdefault(
+        "STOCK_SNAPSHOT_PATH", os.environ.get("STOCK_SNAPSHOT_PATH")
+    )
+    connect_to_db(
+        application,
+        application.config.get("SQLALCHEMY_DATABASE_URI"),
+        application.config.get("DATABASE_REPLICA_URLS"),
+    )
+    instrument(application)
+    for rule, view, options in ROUTES:
+        application.add_url_rule(rule, view_func=view, **options)
+    return application
+
+
+def _date_arg(name: str) -> Optional[date]:
+    """Parse an optional ISO yyyy-mm-dd query string argument."""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400, description=f"{name} must be a yyyy-mm-dd date")
+
+
+def _bulk_body() -> list:
+    """The JSON list of a bulk write, at most BULK_MAX_ROWS long."""
+    payload = request.get_json(silent=True)
+    if isinstance(payload, list) and len(payload) > BULK_MAX_ROWS:
+        abort(400, description=f"at most {BULK_MAX_ROWS} rows per request")
+    return payload
+
+
+def _list_arg(name: str) -> List[str]:
+    """Values of a repeatable, comma separated query string argument."""
+    return [
+        value.strip()
+        for arg in request.args.getlist(name)
+        for value in arg.split(",")
+        if value.strip()
+    ]
+
+
+@route("/api/")
 def index():
     return f"welcome to full spectrum eggs"
 
 
-@app.route("/api/stock", methods=["GET"])
+@route("/api/stock", methods=["GET"])
 def get_stock():
-    pass
+    """Dozens of eggs available to reserve now, answered from memory without a query."""
+    return {"item": inventory.EGGS, "available": inventory.available()}
+
+
+@route("/api/stock/reservations", methods=["POST"])
+def create_reservation():
+    """Hold dozens of eggs for a checkout. Body: {"quantity": positive integer}.
+
+    Responds 201 with the reservation, or 409 when fewer dozens are available.
+    """
+    quantity = (request.get_json(silent=True) or {}).get("quantity")
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        abort(400, description="quantity must be a positive integer")
+    reservation, available = inventory.reserve(quantity)
+    if reservation is None:
+        return {"error": "not enough stock", "available": available}, 409
+    return {**reservation.to_json(), "available": available}, 201
+
+
+@route("/api/stock/reservations/<uuid:reservation_id>", methods=["DELETE"])
+def release_reservation(reservation_id):
+    """Return a reservation's eggs to stock."""
+    available = inventory.release(reservation_id)
+    if available is None:
+        abort(404, description="no held reservation with that id")
+    return {"id": reservation_id, "available": available}
+
+
+@route("/api/stock/history", methods=["GET"])
+@response_cache.cached(HarvestAggregate, DailyHarvest)
+def get_stock_history():
+    """Harvest totals by color per day, week or month, read from precomputed aggregates.
+
+    Query string arguments:
+    - granularity: day, week (default) or month
+    - start, end: inclusive bucket_date bounds
+    - window: add a rolling mean of total over this many buckets
+    """
+    granularity = request.args.get("granularity", "week")
+    if granularity not in GRANULARITIES:
+        abort(400, description=f"granularity must be one of {GRANULARITIES}")
+    window = request.args.get("window", type=int)
+    if window is not None and window < 1:
+        abort(400, description="window must be a positive integer")
+    return harvest_series(
+        granularity, _date_arg("start"), _date_arg("end"), window=window
+    )
+
+
+@route("/api/stock/forecast", methods=["GET"])
+@response_cache.cached(HarvestForecast)
+def get_stock_forecast():
+    """Eggs and dozens expected in each coming week, projected from the fitted forecast.
+
+    The forecast's parameters are updated by each harvest import, so a request reads one row
+    however long the harvest history is. Responds 404 until the first import has fitted it.
+
+    Query string arguments:
+    - weeks: number of weeks ahead, default 1, capped at FORECAST_MAX_WEEKS
+    """
+    # imported on use, to keep numpy out of the app's startup
+    from api.forecast import harvest_forecast
+
+    weeks = request.args.get("weeks", 1, type=int)
+    if weeks < 1:
+        abort(400, description="weeks must be a positive integer")
+    result = harvest_forecast(db.session, min(weeks, FORECAST_MAX_WEEKS))
+    if result is None:
+        abort(404, description="no harvests have been imported to forecast from")
+    return result
+
+
+@route("/api/stock/series", methods=["GET"])
+def get_stock_series():
+    """Stock records or daily harvests over a date range, with the sum of each count.
+
+    Read from the memory-mapped snapshot at STOCK_SNAPSHOT_PATH without touching the database,
+    or from the database when there is no snapshot file. The snapshot is as new as its last
+    rebuild, which imports and the write_snapshot job do after records change.
 
+    Query string arguments:
+    - series: stock (default) or harvests
+    - start, end: inclusive date bounds, same defaults as read_daily_egg_csvs
+    - rows: 0 to send only the sums
+    """
+    series = request.args.get("series", "stock")
+    if series not in SERIES:
+        abort(400, description=f"series must be one of {list(SERIES)}")
+    return read_series(
+        db.session,
+        series,
+        _date_arg("start"),
+        _date_arg("end"),
+        path=current_app.config.get("STOCK_SNAPSHOT_PATH"),
+        with_rows=request.args.get("rows", "1") != "0",
+    )
 
-@app.route("/api/egg-stock-records", methods=["GET"])
+
+@route("/api/egg-stock-records", methods=["GET"])
+@response_cache.cached(EggStockRecord)
 def get_egg_stock_records():
-    records = EggStockRecord.query.all()
-    return [record.to_json() for record in records]
+    """Page through stock records in record_date order.
+
+    Query string arguments:
+    - start, end: inclusive record_date bounds, same defaults as read_daily_egg_csvs
+    - after: cursor, the record_date of the last record on the previous page
+    - limit: page size, capped at EGG_STOCK_RECORDS_MAX_LIMIT
+
+    When more records remain, the next page's URL is sent in a Link header.
+    """
+    start_date, end_date = date_bounds(_date_arg("start"), _date_arg("end"))
+    after = _date_arg("after")
+    limit = request.args.get("limit", EGG_STOCK_RECORDS_DEFAULT_LIMIT, type=int)
+    if limit < 1:
+        abort(400, description="limit must be a positive integer")
+    limit = min(limit, EGG_STOCK_RECORDS_MAX_LIMIT)
+
+    # fetch one extra row to learn whether another page exists
+    statement = egg_stock_records_statement(start_date, end_date, after, limit + 1)
+    records = db.session.execute(statement).mappings().all()
+
+    headers = {}
+    if len(records) > limit:
+        records = records[:limit]
+        next_args = {**request.args, "after": records[-1]["record_date"].isoformat()}
+        headers["Link"] = (
+            f'<{url_for("get_egg_stock_records", **next_args)}>; rel="next"'
+        )
+    return [dict(record) for record in records], headers
+
+
+@route("/api/egg-stock-records", methods=["POST"])
+def create_egg_stock_records():
+    """Store weekly stock records in one transaction, replacing the quantity of known dates.
+
+    Body: a list of {"record_date": Monday as yyyy-mm-dd, "quantity": dozens}. When the app
+    has a stock snapshot, a job to rebuild it is queued in the same transaction, which keeps
+    the rebuild off the request path; /api/stock/series serves the new records once a worker
+    has run it.
+    """
+    try:
+        records = bulk.validate_stock_records(_bulk_body())
+    except ValueError as error:
+        abort(400, description=str(error))
+    written = upsert_weekly_dozens(records)
+    if current_app.config.get("STOCK_SNAPSHOT_PATH"):
+        jobs.enqueue("write_snapshot")
+    db.session.commit()
+    return {"written": written}, 201
+
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+@route("/api/egg-stock-records/export", methods=["GET"])
+def export_egg_stock_records():
+    """Stream every stock record in record_date order, gzipped when the client accepts it.
+
+    Rows are read through a server-side cursor and sent as they arrive, so memory use does not
+    depend on the number of records.
+
+    Query string arguments:
+    - format: ndjson (default), one JSON record per line, or csv in the egg CSV layout
+    - start, end: inclusive record_date bounds, same defaults as read_daily_egg_csvs
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        abort(400, description=f"format must be one of {list(EXPORT_FORMATS)}")
+    start_date, end_date = date_bounds(_date_arg("start"), _date_arg("end"))
+    statement = egg_stock_records_statement(start_date, end_date)
+    encode = current_app.json.encode
+    gzipped = "gzip" in request.accept_encodings
+
+    @stream_with_context
+    def generate():
+        result = db.session.execute(
+            statement.execution_options(yield_per=export.EXPORT_BATCH_SIZE)
+        ).mappings()
+        if export_format == "csv":
+            chunks = export.stock_csv_chunks(result.partitions())
+        else:
+            chunks = export.ndjson_chunks(result.partitions(), encode)
+        if gzipped:
+            chunks = export.gzip_chunks(chunks)
+        yield from chunks
+
+    headers = {
+        "Content-Disposition": (
+            f"attachment; filename=egg-stock-records.{export_format}"
+        ),
+        "Vary": "Accept-Encoding",
+    }
+    if gzipped:
+        headers["Content-Encoding"] = "gzip"
+    return current_app.response_class(
+        generate(), mimetype=EXPORT_FORMATS[export_format], headers=headers
+    )
+
+
+@route("/api/jobs", methods=["POST"])
+def create_job():
+    """Queue background work for python -m api.jobs workers.
 
+    Body: {"kind": one of API_JOB_KINDS, "payload": object, "max_attempts": positive integer}.
+    Responds 202 with the job, whose progress is at the URL in the Location header. warm_caches
+    is only accepted when the response cache has a shared backend.
+    """
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict) or body.get("kind") not in API_JOB_KINDS:
+        abort(400, description=f"kind must be one of {API_JOB_KINDS}")
+    payload = body.get("payload", {})
+    if not isinstance(payload, dict):
+        abort(400, description="payload must be an object")
+    max_attempts = body.get("max_attempts", jobs.DEFAULT_MAX_ATTEMPTS)
+    if (
+        not isinstance(max_attempts, int)
+        or isinstance(max_attempts, bool)
+        or max_attempts < 1
+    ):
+        abort(400, description="max_attempts must be a positive integer")
+    if body["kind"] == "warm_caches" and not jobs.shared_cache():
+        abort(400, description="warm_caches needs a shared response cache backend")
+    try:
+        job = jobs.enqueue(body["kind"], payload, max_attempts=max_attempts)
+    except ValueError as error:
+        abort(400, description=str(error))
+    db.session.commit()
+    return job.to_json(), 202, {"Location": url_for("get_job", job_id=job.id)}
 
-@app.route("/api/about", methods=["GET"])
+
+@route("/api/jobs/<uuid:job_id>", methods=["GET"])
+def get_job(job_id):
+    """A background job's status, attempts and progress."""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        abort(404, description="no job with that id")
+    return job.to_json()
+
+
+@route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """Prometheus text exposition of the app's runtime metrics."""
+    return render_metrics(), {"Content-Type": PROMETHEUS_CONTENT_TYPE}
+
+
+@route("/api/about", methods=["GET"])
 def get_about():
     return "Full Spectrum Eggs is based in Clarkston, Georgia."
 
 
-@app.route("/api/recipes", methods=["GET"])
+@route("/api/recipes", methods=["GET"])
+@response_cache.cached(Recipe, RecipeIngredient, AbstractIngredient)
 def get_recipes():
-    recipes = Recipe.query.all()
-    return [recipe.to_json() for recipe in recipes]
+    """All recipes, or with ids=a,b,c only those recipes, in the order given.
+
+    Unknown ids are left out. At most RECIPES_MAX_IDS ids may be requested at once.
+    """
+    ids = _list_arg("ids")
+    if not ids:
+        return load_recipes_json(db.session)
+    if len(ids) > RECIPES_MAX_IDS:
+        abort(400, description=f"at most {RECIPES_MAX_IDS} ids per request")
+    try:
+        recipe_ids = list(dict.fromkeys(uuid.UUID(value) for value in ids))
+    except ValueError:
+        abort(400, description="ids must be comma separated recipe ids")
+    recipes = recipe_cache.load(db.session, recipe_ids)
+    return [recipes[recipe_id] for recipe_id in recipe_ids if recipe_id in recipes]
+
+
+@route("/api/recipes", methods=["POST"])
+def create_recipes():
+    """Create recipes in one transaction.
+
+    Body: a list of {"name", "instructions", "servings", "source", "ingredients"}, where each
+    ingredient is {"name", "quantity", "units"}. Ingredients are matched to existing ones by
+    name and created when new. Responds 201 with the new recipe ids, in the order given.
+    """
+    try:
+        recipes = bulk.validate_recipes(_bulk_body())
+    except ValueError as error:
+        abort(400, description=str(error))
+    recipe_ids = bulk.create_recipes(recipes)
+    db.session.commit()
+    return {"ids": recipe_ids}, 201
 
 
-@app.route("/api/recipe/<recipe_id>", methods=["GET"])
+@route("/api/recipes/search", methods=["GET"])
+@response_cache.cached(Recipe, RecipeIngredient, AbstractIngredient)
+def search_recipes():
+    """Recipes matching words and ingredients, best text matches first.
+
+    Query string arguments:
+    - q: words that must all appear in the recipe name or instructions
+    - ingredient: ingredient names the recipe must use, repeated or comma separated
+    - only: the ingredient names the recipe may use, repeated or comma separated
+    - limit: maximum number of recipes, capped at SEARCH_MAX_LIMIT
+    """
+    text = request.args.get("q", "").strip()
+    ingredients, only_ingredients = _list_arg("ingredient"), _list_arg("only")
+    if not (text or ingredients or only_ingredients):
+        abort(400, description="give at least one of q, ingredient or only")
+    limit = request.args.get("limit", SEARCH_DEFAULT_LIMIT, type=int)
+    if limit < 1:
+        abort(400, description="limit must be a positive integer")
+    return search.search_recipes(
+        db.session,
+        text,
+        ingredients,
+        only_ingredients,
+        limit=min(limit, SEARCH_MAX_LIMIT),
+    )
+
+
+@route("/api/recipes/shopping-list", methods=["GET"])
+@response_cache.cached(Recipe, RecipeIngredient, AbstractIngredient)
+def get_shopping_list():
+    """Ingredients of several recipes summed per ingredient, in base units where known.
+
+    Query string arguments:
+    - ids: recipe ids, repeated or comma separated, each optionally followed by :servings to
+      scale that recipe, e.g. ids=<id>:8,<id>. A repeated id keeps its last servings.
+
+    Quantities of known units are converted to ml, g or ea before summing; other units are
+    summed as written. Unknown ids are left out.
+    """
+    ids = _list_arg("ids")
+    if not ids:
+        abort(400, description="give the recipe ids to shop for")
+    if len(ids) > RECIPES_MAX_IDS:
+        abort(400, description=f"at most {RECIPES_MAX_IDS} ids per request")
+    servings = {}
+    try:
+        for value in ids:
+            recipe_id, _, count = value.partition(":")
+            servings[uuid.UUID(recipe_id)] = int(count) if count else None
+    except ValueError:
+        abort(400, description="ids must be recipe ids, each optionally with :servings")
+    if any(count is not None and count < 1 for count in servings.values()):
+        abort(400, description="servings must be positive integers")
+    rows = db.session.execute(shopping_list_statement(servings)).mappings()
+    return [dict(row) for row in rows]
+
+
+@route("/api/recipe/<uuid:recipe_id>", methods=["GET"])
+@response_cache.cached(Recipe, RecipeIngredient, AbstractIngredient)
 def get_recipe(recipe_id):
-    recipe = Recipe.query.get(recipe_id)
-    return recipe.to_json()
+    """One recipe; with servings=N, its ingredients scaled to N servings.
+
+    Scaled ingredients also carry base_quantity and base_units, their quantity in ml, g or ea.
+    """
+    servings = request.args.get("servings", type=int)
+    if servings is not None and servings < 1:
+        abort(400, description="servings must be a positive integer")
+    recipe = recipe_cache.load(db.session, [recipe_id]).get(recipe_id)
+    if recipe is None:
+        abort(404, description="no recipe with that id")
+    if servings is None:
+        return recipe
+    if not recipe["servings"]:
+        abort(409, description="recipe has no servings count to scale from")
+    return scale_recipe_json(recipe, servings)
 
 
 if __name__ == "__main__":
-    connect_to_db(app)
-    app.run(port=5000, host="0.0.0.0")
+    create_app().run(port=5000, host="0.0.0.0")
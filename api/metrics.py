@@ -0,0 +1,214 @@
+import json
+import logging
+import os
+from collections import defaultdict
+from threading import Lock
+from time import perf_counter
+from typing import Dict, List, Tuple
+
+from flask import Flask, current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from api.model import db
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_SLOW_QUERY_MS = 100.0
+# bulk inserts bind thousands of values; the slow query log keeps the start of them
+MAX_LOGGED_PARAMETERS = 1000
+
+request_log = logging.getLogger("api.requests")
+slow_query_log = logging.getLogger("api.slow_queries")
+
+# metric name: (help text, QueuePool method)
+POOL_GAUGES = {
+    "db_pool_size": ("Connections the pool keeps open", "size"),
+    "db_pool_checked_in": ("Idle connections in the pool", "checkedin"),
+    "db_pool_checked_out": ("Connections in use", "checkedout"),
+    "db_pool_overflow": ("Connections open beyond pool_size", "overflow"),
+}
+
+# metric name: (help text, RequestStats field), summed per endpoint
+REQUEST_COUNTERS = {
+    "http_request_duration_seconds_total": ("Time spent handling requests", "seconds"),
+    "http_request_db_queries_total": ("SQL statements run by requests", "queries"),
+    "http_request_db_seconds_total": ("Time requests spent in SQL", "db_seconds"),
+    "http_request_serialize_seconds_total": (
+        "Time requests spent encoding JSON",
+        "serialize_seconds",
+    ),
+    "http_response_bytes_total": ("Response body bytes sent", "response_bytes"),
+}
+
+
+class RequestStats:
+    """Costs of the current request, kept in flask.g.request_stats by instrument().
+
+    serialize_seconds is added to by FastJSONProvider.response.
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+
+
+class RequestMetrics:
+    """Per-endpoint request totals for the Prometheus exposition, shared by all threads."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._requests: Dict[Tuple[str, str, int], int] = defaultdict(int)
+        self._totals: Dict[Tuple[str, str], float] = defaultdict(float)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._requests.clear()
+            self._totals.clear()
+
+    def observe(self, endpoint: str, method: str, status: int, values: Dict) -> None:
+        with self._lock:
+            self._requests[endpoint, method, status] += 1
+            for field, value in values.items():
+                self._totals[endpoint, field] += value
+
+    def lines(self) -> List[str]:
+        with self._lock:
+            requests = sorted(self._requests.items())
+            totals = dict(self._totals)
+        lines = [
+            "# HELP http_requests_total Requests handled",
+            "# TYPE http_requests_total counter",
+        ]
+        for (endpoint, method, status), count in requests:
+            lines.append(
+                f'http_requests_total{{endpoint="{endpoint}",method="{method}",'
+                f'status="{status}"}} {count}'
+            )
+        endpoints = sorted({endpoint for (endpoint, _, _), _ in requests})
+        for name, (help_text, field) in REQUEST_COUNTERS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for endpoint in endpoints:
+                value = totals.get((endpoint, field), 0)
+                lines.append(f'{name}{{endpoint="{endpoint}"}} {value:g}')
+        return lines
+
+
+request_metrics = RequestMetrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["query_started"].pop()
+    if has_request_context() and "request_stats" in g:
+        g.request_stats.queries += 1
+        g.request_stats.db_seconds += elapsed
+    threshold_ms = DEFAULT_SLOW_QUERY_MS
+    if has_app_context():
+        threshold_ms = current_app.config.get("SLOW_QUERY_MS", threshold_ms)
+    if elapsed * 1000 >= threshold_ms:
+        slow_query_log.warning(
+            json.dumps(
+                {
+                    "duration_ms": round(elapsed * 1000, 3),
+                    "statement": statement,
+                    "parameters": repr(parameters)[:MAX_LOGGED_PARAMETERS],
+                    "path": request.path if has_request_context() else None,
+                }
+            )
+        )
+
+
+def _handle_error(context) -> None:
+    if context.connection is not None and context.connection.info.get("query_started"):
+        context.connection.info["query_started"].pop()
+
+
+def _start_request() -> None:
+    g.request_stats = RequestStats()
+
+
+def _finish_request(response):
+    stats = g.pop("request_stats", None)
+    if stats is None:
+        return response
+    seconds = perf_counter() - stats.started
+    response_bytes = 0 if response.is_streamed else response.content_length or 0
+    response.headers["Server-Timing"] = ", ".join(
+        [
+            f'db;dur={stats.db_seconds * 1000:.3f};desc="{stats.queries} queries"',
+            f"serialize;dur={stats.serialize_seconds * 1000:.3f}",
+            f"total;dur={seconds * 1000:.3f}",
+        ]
+    )
+    endpoint = request.endpoint or "unmatched"
+    values = {
+        "seconds": seconds,
+        "queries": stats.queries,
+        "db_seconds": stats.db_seconds,
+        "serialize_seconds": stats.serialize_seconds,
+        "response_bytes": response_bytes,
+    }
+    request_metrics.observe(endpoint, request.method, response.status_code, values)
+    request_log.info(
+        json.dumps(
+            {
+                "method": request.method,
+                "path": request.full_path.rstrip("?"),
+                "endpoint": endpoint,
+                "status": response.status_code,
+                "duration_ms": round(seconds * 1000, 3),
+                "queries": stats.queries,
+                "db_ms": round(stats.db_seconds * 1000, 3),
+                "serialize_ms": round(stats.serialize_seconds * 1000, 3),
+                "response_bytes": response_bytes,
+            }
+        )
+    )
+    return response
+
+
+def instrument(application: Flask) -> None:
+    """Measure every request's SQL, JSON encoding and response size.
+
+    Each response gets a Server-Timing header with its query count and db, serialize and total
+    durations, each request is logged as one JSON line to the api.requests logger, and the
+    totals per endpoint are served by render_metrics(). Statements slower than SLOW_QUERY_MS
+    (app config or environment, default 100) are logged with their parameters to
+    api.slow_queries, whether or not they run in a request.
+
+    :param application: Flask app to instrument
+    """
+    application.config.setdefault(
+        "SLOW_QUERY_MS",
+        float(os.environ.get("SLOW_QUERY_MS", DEFAULT_SLOW_QUERY_MS)),
+    )
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+    application.before_request(_start_request)
+    application.after_request(_finish_request)
+
+
+def pool_metrics() -> List[str]:
+    """Prometheus gauges for each engine's connection pool, labelled primary or replica_<n>.
+
+    Pools without these counters (SQLite's StaticPool) are skipped.
+    """
+    lines = []
+    for name, (help_text, method) in POOL_GAUGES.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for key, engine in db.engines.items():
+            pool_stat = getattr(engine.pool, method, None)
+            if pool_stat is not None:
+                lines.append(f'{name}{{engine="{key or "primary"}"}} {pool_stat()}')
+    return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(pool_metrics() + request_metrics.lines()) + "\n"
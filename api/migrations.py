@@ -0,0 +1,316 @@
+"""Versioned schema migrations, in place of dropping and recreating every table.
+
+Each migration is a function of the engine, registered in order with @migration and recorded in
+the schema_migrations table once applied, so running the upgrade again only applies what is new:
+
+    python -m api.migrations           # apply pending migrations
+    python -m api.migrations --list    # show applied and pending migrations
+
+Migrations must be safe to run against a schema that already has their change. The baseline
+creates every table from the current models, so on a fresh database the later migrations find
+their columns and indexes present and do nothing. Indexes are built with CREATE INDEX
+CONCURRENTLY on postgres, which does not block writes to the table while it is built.
+"""
+
+import argparse
+import uuid
+from datetime import datetime
+from itertools import islice
+from typing import Callable, List, Tuple
+
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Index,
+    MetaData,
+    String,
+    Table,
+    and_,
+    exists,
+    insert,
+    inspect,
+    select,
+    update,
+)
+from sqlalchemy.engine import Engine
+
+from api import forecast
+from api.model import (
+    HOME_FARM,
+    AbstractIngredient,
+    DailyHarvest,
+    EggStockRecord,
+    FarmHarvest,
+    HarvestAggregate,
+    HarvestForecast,
+    ImportCheckpoint,
+    Inventory,
+    Job,
+    Recipe,
+    RecipeIngredient,
+    Reservation,
+    TableVersion,
+    Unit,
+    db,
+    seed_units,
+    unit_id,
+)
+from api.search import RECIPE_TSVECTOR_SQL
+
+Migration = Tuple[str, str, Callable[[Engine], None]]
+
+MIGRATIONS: List[Migration] = []
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", String, primary_key=True),
+    Column("description", String),
+    Column("applied_at", DateTime),
+)
+
+
+def migration(version: str, description: str):
+    """Register the decorated function as the migration after the last one registered."""
+
+    def register(function: Callable[[Engine], None]) -> Callable[[Engine], None]:
+        if MIGRATIONS and MIGRATIONS[-1][0] >= version:
+            raise ValueError(f"migration {version} is out of order")
+        MIGRATIONS.append((version, description, function))
+        return function
+
+    return register
+
+
+def create_index_online(engine: Engine, index: Index) -> None:
+    """Build a model's index if the table does not have it yet.
+
+    On postgres the index is built CONCURRENTLY, which cannot run in a transaction, so the
+    statement is sent in autocommit mode.
+
+    :param engine: engine to build the index with
+    :param index: Index from a model's table
+    """
+    concurrently = "CONCURRENTLY " if engine.dialect.name == "postgresql" else ""
+    columns = ", ".join(column.name for column in index.columns)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(
+            f"CREATE {'UNIQUE ' if index.unique else ''}INDEX {concurrently}"
+            f"IF NOT EXISTS {index.name} ON {index.table.name} ({columns})"
+        )
+
+
+def _model_index(model, column_name: str) -> Index:
+    for index in model.__table__.indexes:
+        if [column.name for column in index.columns] == [column_name]:
+            return index
+    raise LookupError(f"{model.__tablename__} has no index on {column_name}")
+
+
+@migration("0001", "create tables")
+def create_tables(engine: Engine) -> None:
+    db.metadata.create_all(engine)
+
+
+@migration("0002", "index recipe ingredient foreign keys and edited_at")
+def index_hot_lookups(engine: Engine) -> None:
+    indexes = [
+        _model_index(RecipeIngredient, "recipe_id"),
+        _model_index(RecipeIngredient, "abstract_ingredient_id"),
+    ]
+    # response cache validation reads max(edited_at) of these tables on every request
+    for model in [
+        EggStockRecord,
+        DailyHarvest,
+        HarvestAggregate,
+        AbstractIngredient,
+        Recipe,
+    ]:
+        indexes.append(_model_index(model, "edited_at"))
+    for index in indexes:
+        create_index_online(engine, index)
+
+
+@migration("0003", "create inventory and reservations")
+def create_inventory(engine: Engine) -> None:
+    db.metadata.create_all(engine, tables=[Inventory.__table__, Reservation.__table__])
+
+
+@migration("0004", "index recipe text for full-text search on postgres")
+def index_recipe_search(engine: Engine) -> None:
+    # other databases search an in-memory index, see api/search.py
+    if engine.dialect.name != "postgresql":
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_recipes_search "
+            f"ON recipes USING gin ({RECIPE_TSVECTOR_SQL})"
+        )
+
+
+@migration("0005", "create farm harvests from the existing daily harvests")
+def create_farm_harvests(engine: Engine, batch_size: int = 1000) -> None:
+    # daily_harvests becomes the sum over farms, so what it holds so far is the home farm's
+    db.metadata.create_all(engine, tables=[FarmHarvest.__table__])
+    daily, farm = DailyHarvest.__table__, FarmHarvest.__table__
+    already_copied = exists().where(
+        and_(farm.c.farm_id == HOME_FARM, farm.c.harvest_date == daily.c.harvest_date)
+    )
+    columns = ["harvest_date", "pink", "brown", "blue", "total"]
+    with engine.begin() as conn:
+        rows = conn.execute(
+            select(*(daily.c[column] for column in columns)).where(~already_copied)
+        )
+        now = datetime.utcnow()
+        while batch := list(islice(rows, batch_size)):
+            conn.execute(
+                insert(farm),
+                [
+                    {
+                        "id": uuid.uuid4(),
+                        "created_at": now,
+                        "edited_at": now,
+                        "farm_id": HOME_FARM,
+                        **row._mapping,
+                    }
+                    for row in batch
+                ],
+            )
+
+
+@migration("0006", "create units and link recipe ingredients to them")
+def create_units(engine: Engine) -> None:
+    # creating the table seeds it; a table that already exists gets the units it lacks
+    db.metadata.create_all(engine, tables=[Unit.__table__])
+    ingredients = RecipeIngredient.__table__
+    columns = {
+        column["name"] for column in inspect(engine).get_columns("recipe_ingredients")
+    }
+    with engine.begin() as conn:
+        seed_units(conn)
+        if "unit_id" not in columns:
+            column_type = ingredients.c.unit_id.type.compile(engine.dialect)
+            conn.exec_driver_sql(
+                f"ALTER TABLE recipe_ingredients ADD COLUMN unit_id {column_type} "
+                "REFERENCES units (id)"
+            )
+        # one UPDATE per distinct spelling, which are few however many ingredients there are
+        spellings = conn.scalars(
+            select(ingredients.c.units)
+            .where(ingredients.c.unit_id.is_(None), ingredients.c.units.is_not(None))
+            .distinct()
+        ).all()
+        for units in spellings:
+            if unit_id(units) is not None:
+                conn.execute(
+                    update(ingredients)
+                    .where(
+                        ingredients.c.units == units, ingredients.c.unit_id.is_(None)
+                    )
+                    .values(unit_id=unit_id(units))
+                )
+    create_index_online(engine, _model_index(RecipeIngredient, "unit_id"))
+
+
+@migration("0007", "create the harvest forecast, fitted to the existing daily harvests")
+def create_harvest_forecast(engine: Engine) -> None:
+    db.metadata.create_all(engine, tables=[HarvestForecast.__table__])
+    # without numpy the forecast is fitted by the first import on a machine that has it
+    if not forecast.FORECASTING:
+        return
+    with engine.begin() as conn:
+        fitted = select(HarvestForecast.id).where(
+            HarvestForecast.series == forecast.SERIES
+        )
+        if conn.scalars(fitted).first() is not None:
+            return
+        harvests = conn.execute(
+            select(DailyHarvest.harvest_date, DailyHarvest.total).order_by(
+                DailyHarvest.harvest_date
+            )
+        ).all()
+        if not harvests:
+            return
+        now = datetime.utcnow()
+        conn.execute(
+            insert(HarvestForecast.__table__).values(
+                id=uuid.uuid4(),
+                created_at=now,
+                edited_at=now,
+                series=forecast.SERIES,
+                **forecast.update_forecast(forecast.empty_parameters(), harvests),
+            )
+        )
+
+
+@migration("0008", "create the background job queue")
+def create_jobs(engine: Engine) -> None:
+    db.metadata.create_all(engine, tables=[Job.__table__])
+
+
+@migration("0009", "create the table write counters read by cache validation")
+def create_table_versions(engine: Engine) -> None:
+    # tables start unversioned and get a counter on their first write
+    db.metadata.create_all(engine, tables=[TableVersion.__table__])
+
+
+@migration("0010", "drop the partial week sum of import checkpoints")
+def drop_checkpoint_week_sum(engine: Engine) -> None:
+    # weeks are re-summed from the stored daily totals, so the carried sum is never read
+    columns = inspect(engine).get_columns(ImportCheckpoint.__tablename__)
+    if "week_sum" in [column["name"] for column in columns]:
+        with engine.begin() as conn:
+            conn.exec_driver_sql("ALTER TABLE import_checkpoints DROP COLUMN week_sum")
+
+
+def applied_versions(engine: Engine) -> List[str]:
+    """Versions recorded in schema_migrations, or none when the table does not exist."""
+    if not inspect(engine).has_table(schema_migrations.name):
+        return []
+    with engine.connect() as conn:
+        return list(conn.scalars(select(schema_migrations.c.version)))
+
+
+def upgrade(engine: Engine) -> List[Tuple[str, str]]:
+    """Apply every migration not yet recorded in schema_migrations, in order.
+
+    :param engine: engine of the database to migrate
+    :return: (version, description) of each migration applied
+    """
+    schema_migrations.create(engine, checkfirst=True)
+    applied = set(applied_versions(engine))
+    newly_applied = []
+    for version, description, function in MIGRATIONS:
+        if version in applied:
+            continue
+        function(engine)
+        with engine.begin() as conn:
+            conn.execute(
+                schema_migrations.insert().values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.utcnow(),
+                )
+            )
+        newly_applied.append((version, description))
+    return newly_applied
+
+
+# exclude from coverage
+if __name__ == "__main__":  # pragma: no cover
+    parser = argparse.ArgumentParser(description="Apply pending schema migrations")
+    parser.add_argument(
+        "--list", action="store_true", help="list migrations instead of applying them"
+    )
+    args = parser.parse_args()
+    from api.main import create_app
+
+    with create_app().app_context():
+        if args.list:
+            applied = set(applied_versions(db.engine))
+            for version, description, _ in MIGRATIONS:
+                status = "applied" if version in applied else "pending"
+                print(f"{version} {status:7} {description}")
+        else:
+            for version, description in upgrade(db.engine):
+                print(f"applied {version}: {description}")
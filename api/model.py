@@ -1,13 +1,80 @@
+import importlib
+import os
 import uuid
-from datetime import date, datetime
-from typing import Dict, List
+import weakref
+from datetime import date, datetime, timedelta
+from itertools import count, islice
+from typing import Dict, Iterable, List, Optional, Tuple
 
-from flask import Flask
+from flask import Flask, has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy.orm import Mapped, relationship
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, orm, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Mapped, relationship, selectinload
 
-db = SQLAlchemy()
-app = Flask(__name__)
+REPLICA_BIND_PREFIX = "replica_"
+
+
+class RoutingSession(Session):
+    """Session that sends the reads of GET and HEAD requests to a read replica.
+
+    Writes, flushes and anything outside a request use the primary. A replica is picked
+    round-robin once per session, which Flask-SQLAlchemy scopes to the request, so each request
+    reads from a single replica.
+    """
+
+    _replica = None
+    _replica_counter = count()
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and not self._flushing
+            and not getattr(clause, "is_dml", False)
+            and has_request_context()
+            and request.method in ("GET", "HEAD")
+        ):
+            if self._replica is None:
+                replicas = [
+                    engine
+                    for key, engine in self._db.engines.items()
+                    if key and key.startswith(REPLICA_BIND_PREFIX)
+                ]
+                if replicas:
+                    index = next(self._replica_counter) % len(replicas)
+                    self._replica = replicas[index]
+            if self._replica is not None:
+                return self._replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+MIN_RECORD_DATE = date(1, 1, 1)
+# farm_id of Full Spectrum Eggs' own harvests; partner farms use their own ids
+HOME_FARM = "full-spectrum"
+
+
+def date_bounds(
+    start_date: Optional[date] = None, end_date: Optional[date] = None
+) -> Tuple[date, date]:
+    """Resolve optional start/end dates to the inclusive range shared by the loaders and the API.
+
+    :param start_date: earliest date to include, or None for no lower bound
+    :param end_date: latest date to include, or None for today
+    :return: (start_date, end_date)
+    """
+    return start_date or MIN_RECORD_DATE, end_date or date.today()
+
+
+def week_ending(day: date) -> date:
+    """Monday that closes the week containing day, matching EggStockRecord.record_date."""
+    return day + timedelta(days=(7 - day.weekday()) % 7)
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
 
 
 class EggStockRecord(db.Model):
@@ -17,7 +84,8 @@ class EggStockRecord(db.Model):
 
     id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
     created_at: Mapped[datetime] = db.Column(db.DateTime)
-    edited_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime, index=True)
+    # the unique index on record_date also serves the date range scans of /api/egg-stock-records
     record_date: Mapped[date] = db.Column(db.Date, unique=True)
     quantity: Mapped[int] = db.Column(db.Integer)
 
@@ -44,6 +112,358 @@ class EggStockRecord(db.Model):
         return f"<EggStockRecord(id={self.id!r}, record_date={self.record_date}, quantity={self.quantity})>"
 
 
+class ImportCheckpoint(db.Model):
+    """Model class for how far an incremental import has read into a source file."""
+
+    __tablename__ = "import_checkpoints"
+
+    id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
+    created_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime)
+    source: Mapped[str] = db.Column(db.String, unique=True)
+    byte_offset: Mapped[int] = db.Column(db.Integer)
+    # hash of the bytes just before byte_offset, to detect files rewritten in place
+    content_hash: Mapped[str] = db.Column(db.String)
+    last_record_date: Mapped[date] = db.Column(db.Date)
+
+    def to_json(self) -> Dict:
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "edited_at": self.edited_at,
+            "source": self.source,
+            "byte_offset": self.byte_offset,
+            "content_hash": self.content_hash,
+            "last_record_date": self.last_record_date,
+        }
+
+    def __init__(self, source):
+        super().__init__(
+            id=uuid.uuid4(),
+            created_at=datetime.utcnow(),
+            edited_at=datetime.utcnow(),
+            source=source,
+            byte_offset=0,
+            content_hash=None,
+            last_record_date=None,
+        )
+
+    def __repr__(self) -> str:
+        return f"<ImportCheckpoint(id={self.id!r}, source={self.source}, byte_offset={self.byte_offset})>"
+
+
+class DailyHarvest(db.Model):
+    """Model class for the raw eggs harvested on one day, by color."""
+
+    __tablename__ = "daily_harvests"
+
+    id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
+    created_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime, index=True)
+    harvest_date: Mapped[date] = db.Column(db.Date, unique=True)
+    pink: Mapped[int] = db.Column(db.Integer)
+    brown: Mapped[int] = db.Column(db.Integer)
+    blue: Mapped[int] = db.Column(db.Integer)
+    total: Mapped[int] = db.Column(db.Integer)
+    # bucket keys are stored so rollups are a portable GROUP BY
+    week_ending: Mapped[date] = db.Column(db.Date, index=True)
+    month: Mapped[date] = db.Column(db.Date, index=True)
+
+    def to_json(self) -> Dict:
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "edited_at": self.edited_at,
+            "harvest_date": self.harvest_date,
+            "pink": self.pink,
+            "brown": self.brown,
+            "blue": self.blue,
+            "total": self.total,
+        }
+
+    def __init__(self, harvest_date, pink, brown, blue, total):
+        super().__init__(**DailyHarvest.row(harvest_date, pink, brown, blue, total))
+
+    @staticmethod
+    def row(harvest_date, pink, brown, blue, total, now=None) -> Dict:
+        """Column values for a new daily harvest, for bulk inserts that skip the ORM."""
+        now = now or datetime.utcnow()
+        return {
+            "id": uuid.uuid4(),
+            "created_at": now,
+            "edited_at": now,
+            "harvest_date": harvest_date,
+            "pink": pink,
+            "brown": brown,
+            "blue": blue,
+            "total": total,
+            "week_ending": week_ending(harvest_date),
+            "month": month_start(harvest_date),
+        }
+
+    def __repr__(self) -> str:
+        return f"<DailyHarvest(id={self.id!r}, harvest_date={self.harvest_date}, total={self.total})>"
+
+
+class FarmHarvest(db.Model):
+    """Model class for the eggs one farm harvested on one day, by color.
+
+    DailyHarvest holds the sum of these over all farms, maintained by refresh_daily_harvests.
+    """
+
+    __tablename__ = "farm_harvests"
+    __table_args__ = (db.UniqueConstraint("farm_id", "harvest_date"),)
+
+    id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
+    created_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime)
+    farm_id: Mapped[str] = db.Column(db.String)
+    harvest_date: Mapped[date] = db.Column(db.Date, index=True)
+    pink: Mapped[int] = db.Column(db.Integer)
+    brown: Mapped[int] = db.Column(db.Integer)
+    blue: Mapped[int] = db.Column(db.Integer)
+    total: Mapped[int] = db.Column(db.Integer)
+
+    def to_json(self) -> Dict:
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "edited_at": self.edited_at,
+            "farm_id": self.farm_id,
+            "harvest_date": self.harvest_date,
+            "pink": self.pink,
+            "brown": self.brown,
+            "blue": self.blue,
+            "total": self.total,
+        }
+
+    def __init__(self, farm_id, harvest_date, pink, brown, blue, total):
+        super().__init__(
+            **FarmHarvest.row(farm_id, harvest_date, pink, brown, blue, total)
+        )
+
+    @staticmethod
+    def row(farm_id, harvest_date, pink, brown, blue, total, now=None) -> Dict:
+        """Column values for a new farm harvest, for bulk inserts that skip the ORM."""
+        now = now or datetime.utcnow()
+        return {
+            "id": uuid.uuid4(),
+            "created_at": now,
+            "edited_at": now,
+            "farm_id": farm_id,
+            "harvest_date": harvest_date,
+            "pink": pink,
+            "brown": brown,
+            "blue": blue,
+            "total": total,
+        }
+
+    def __repr__(self) -> str:
+        return f"<FarmHarvest(farm_id={self.farm_id}, harvest_date={self.harvest_date}, total={self.total})>"
+
+
+class HarvestAggregate(db.Model):
+    """Model class for daily harvests summed per week or month, maintained by refresh_harvest_aggregates."""
+
+    __tablename__ = "harvest_aggregates"
+    __table_args__ = (db.UniqueConstraint("granularity", "bucket_date"),)
+
+    id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
+    created_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime, index=True)
+    granularity: Mapped[str] = db.Column(db.String)
+    # Monday closing the week, or first day of the month
+    bucket_date: Mapped[date] = db.Column(db.Date)
+    days: Mapped[int] = db.Column(db.Integer)
+    pink: Mapped[int] = db.Column(db.Integer)
+    brown: Mapped[int] = db.Column(db.Integer)
+    blue: Mapped[int] = db.Column(db.Integer)
+    total: Mapped[int] = db.Column(db.Integer)
+
+    def to_json(self) -> Dict:
+        return {
+            "granularity": self.granularity,
+            "bucket_date": self.bucket_date,
+            "days": self.days,
+            "pink": self.pink,
+            "brown": self.brown,
+            "blue": self.blue,
+            "total": self.total,
+            "dozens": self.total // 12,
+        }
+
+    def __repr__(self) -> str:
+        return f"<HarvestAggregate(granularity={self.granularity}, bucket_date={self.bucket_date}, total={self.total})>"
+
+
+class HarvestForecast(db.Model):
+    """Model class for the fitted parameters of a harvest forecast, maintained by
+    refresh_harvest_forecast."""
+
+    __tablename__ = "harvest_forecasts"
+
+    id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
+    created_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime)
+    # the daily harvest column forecast, e.g. total
+    series: Mapped[str] = db.Column(db.String, unique=True)
+    first_date: Mapped[date] = db.Column(db.Date)
+    last_date: Mapped[date] = db.Column(db.Date)
+    days: Mapped[int] = db.Column(db.Integer)
+    # deseasonalized eggs per day, exponentially weighted towards recent days
+    level: Mapped[float] = db.Column(db.Float)
+    # eggs harvested in the week that last_date belongs to
+    week_total: Mapped[int] = db.Column(db.Integer)
+    # eggs and days seen in each week of the year
+    season_sums: Mapped[List[float]] = db.Column(db.JSON)
+    season_counts: Mapped[List[int]] = db.Column(db.JSON)
+
+    def to_json(self) -> Dict:
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "edited_at": self.edited_at,
+            "series": self.series,
+            "first_date": self.first_date,
+            "last_date": self.last_date,
+            "days": self.days,
+            "level": self.level,
+            "week_total": self.week_total,
+            "season_sums": self.season_sums,
+            "season_counts": self.season_counts,
+        }
+
+    def __repr__(self) -> str:
+        return f"<HarvestForecast(series={self.series}, last_date={self.last_date}, level={self.level})>"
+
+
+class Inventory(db.Model):
+    """Model class for the stock of an item that can be reserved right now."""
+
+    __tablename__ = "inventory"
+
+    id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
+    created_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime, index=True)
+    item: Mapped[str] = db.Column(db.String, unique=True)
+    available: Mapped[int] = db.Column(db.Integer)
+
+    def to_json(self) -> Dict:
+        return {"item": self.item, "available": self.available}
+
+    def __init__(self, item, available):
+        super().__init__(
+            id=uuid.uuid4(),
+            created_at=datetime.utcnow(),
+            edited_at=datetime.utcnow(),
+            item=item,
+            available=available,
+        )
+
+    def __repr__(self) -> str:
+        return f"<Inventory(item={self.item}, available={self.available})>"
+
+
+class Reservation(db.Model):
+    """Model class for stock held for a checkout, until it is released."""
+
+    __tablename__ = "reservations"
+
+    id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
+    created_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime)
+    item: Mapped[str] = db.Column(db.String, db.ForeignKey("inventory.item"))
+    quantity: Mapped[int] = db.Column(db.Integer)
+    released_at: Mapped[Optional[datetime]] = db.Column(db.DateTime, nullable=True)
+
+    def to_json(self) -> Dict:
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "item": self.item,
+            "quantity": self.quantity,
+            "released_at": self.released_at,
+        }
+
+    def __init__(self, item, quantity):
+        super().__init__(
+            id=uuid.uuid4(),
+            created_at=datetime.utcnow(),
+            edited_at=datetime.utcnow(),
+            item=item,
+            quantity=quantity,
+            released_at=None,
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"<Reservation(id={self.id!r}, item={self.item}, quantity={self.quantity})>"
+        )
+
+
+class Job(db.Model):
+    """Model class for background work queued for the workers of api.jobs."""
+
+    __tablename__ = "jobs"
+    # workers look for the oldest due job of a status
+    __table_args__ = (db.Index("ix_jobs_status_run_after", "status", "run_after"),)
+
+    id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
+    created_at: Mapped[datetime] = db.Column(db.DateTime)
+    # also the heartbeat of a running job, moved by each progress report
+    edited_at: Mapped[datetime] = db.Column(db.DateTime)
+    kind: Mapped[str] = db.Column(db.String)
+    payload: Mapped[Dict] = db.Column(db.JSON)
+    status: Mapped[str] = db.Column(db.String)
+    attempts: Mapped[int] = db.Column(db.Integer)
+    max_attempts: Mapped[int] = db.Column(db.Integer)
+    run_after: Mapped[datetime] = db.Column(db.DateTime)
+    worker: Mapped[Optional[str]] = db.Column(db.String, nullable=True)
+    progress_done: Mapped[int] = db.Column(db.Integer)
+    progress_total: Mapped[Optional[int]] = db.Column(db.Integer, nullable=True)
+    message: Mapped[Optional[str]] = db.Column(db.String, nullable=True)
+    error: Mapped[Optional[str]] = db.Column(db.String, nullable=True)
+    started_at: Mapped[Optional[datetime]] = db.Column(db.DateTime, nullable=True)
+    finished_at: Mapped[Optional[datetime]] = db.Column(db.DateTime, nullable=True)
+
+    def to_json(self) -> Dict:
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "edited_at": self.edited_at,
+            "kind": self.kind,
+            "payload": self.payload,
+            "status": self.status,
+            "attempts": self.attempts,
+            "max_attempts": self.max_attempts,
+            "run_after": self.run_after,
+            "progress_done": self.progress_done,
+            "progress_total": self.progress_total,
+            "message": self.message,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+    def __init__(self, kind, payload, status, max_attempts, run_after=None):
+        now = datetime.utcnow()
+        super().__init__(
+            id=uuid.uuid4(),
+            created_at=now,
+            edited_at=now,
+            kind=kind,
+            payload=payload,
+            status=status,
+            attempts=0,
+            max_attempts=max_attempts,
+            run_after=run_after or now,
+            progress_done=0,
+        )
+
+    def __repr__(self) -> str:
+        return f"<Job(id={self.id!r}, kind={self.kind}, status={self.status})>"
+
+
 class AbstractIngredient(db.Model):
     """Model class for ingredients of recipes"""
 
@@ -51,7 +471,7 @@ class AbstractIngredient(db.Model):
 
     id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
     created_at: Mapped[datetime] = db.Column(db.DateTime)
-    edited_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime, index=True)
     name: Mapped[str] = db.Column(db.String, unique=True)
     recipe_ingredients: Mapped[List["RecipeIngredient"]] = relationship(
         back_populates="abstract_ingredient"
@@ -82,13 +502,13 @@ class Recipe(db.Model):
 
     id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
     created_at: Mapped[datetime] = db.Column(db.DateTime)
-    edited_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime, index=True)
     name: Mapped[str] = db.Column(db.String)
     instructions: Mapped[str] = db.Column(db.String)
     servings: Mapped[int] = db.Column(db.Integer)
     source: Mapped[str] = db.Column(db.String)
     ingredients: Mapped[List["RecipeIngredient"]] = relationship(
-        back_populates="recipe"
+        back_populates="recipe", order_by="RecipeIngredient.id"
     )
 
     def to_json(self) -> Dict:
@@ -117,6 +537,149 @@ class Recipe(db.Model):
     def __repr__(self) -> str:
         return f"<Recipe(id={self.id!r}, name={self.name})>"
 
+    @staticmethod
+    def eager_ingredients():
+        """Loader option that fetches ingredients and their names alongside recipes.
+
+        Without it, to_json lazy-loads each recipe's ingredients and then each
+        ingredient's AbstractIngredient, issuing 1 + R + I queries per request.
+        selectinload batches all ingredients into one extra query, and the
+        AbstractIngredient join rides along with it.
+        """
+        return selectinload(Recipe.ingredients).joinedload(
+            RecipeIngredient.abstract_ingredient
+        )
+
+
+# the unit every quantity of a dimension is converted to
+BASE_UNITS = {"volume": "ml", "mass": "g", "count": "ea"}
+# spelling, lowercased: (dimension, base units in one of it); "oz" is by weight, "stick" is butter
+UNIT_FACTORS: Dict[str, Tuple[str, float]] = {
+    "ml": ("volume", 1.0),
+    "milliliter": ("volume", 1.0),
+    "milliliters": ("volume", 1.0),
+    "l": ("volume", 1000.0),
+    "liter": ("volume", 1000.0),
+    "liters": ("volume", 1000.0),
+    "tsp": ("volume", 4.92892),
+    "teaspoon": ("volume", 4.92892),
+    "teaspoons": ("volume", 4.92892),
+    "tbsp": ("volume", 14.7868),
+    "tablespoon": ("volume", 14.7868),
+    "tablespoons": ("volume", 14.7868),
+    "fl oz": ("volume", 29.5735),
+    "cup": ("volume", 236.588),
+    "cups": ("volume", 236.588),
+    "stick": ("volume", 118.294),
+    "sticks": ("volume", 118.294),
+    "g": ("mass", 1.0),
+    "gram": ("mass", 1.0),
+    "grams": ("mass", 1.0),
+    "kg": ("mass", 1000.0),
+    "oz": ("mass", 28.3495),
+    "lb": ("mass", 453.592),
+    "ea": ("count", 1.0),
+    "each": ("count", 1.0),
+    "dozen": ("count", 12.0),
+}
+UNIT_NAMESPACE = uuid.UUID("6b1f4f0e-2f8a-4c55-9a3e-0c1d7e5b9a41")
+
+
+def unit_symbol(units: Optional[str]) -> Optional[str]:
+    """The UNIT_FACTORS spelling of free-text units, or None when they are not known."""
+    symbol = " ".join((units or "").lower().replace(".", "").split())
+    return symbol if symbol in UNIT_FACTORS else None
+
+
+def unit_id(units: Optional[str]) -> Optional[uuid.UUID]:
+    """Id of the Unit row for free-text units, without a query, or None when they are not known.
+
+    Ids are derived from the spelling, so every database seeded from UNIT_FACTORS agrees on them.
+    """
+    symbol = unit_symbol(units)
+    return None if symbol is None else uuid.uuid5(UNIT_NAMESPACE, symbol)
+
+
+def to_base_units(
+    quantity, units: Optional[str]
+) -> Tuple[Optional[float], Optional[str]]:
+    """Convert a quantity to its dimension's base unit.
+
+    :return: (quantity in base units, base unit), or (None, None) when the units are not known
+    """
+    symbol = unit_symbol(units)
+    if symbol is None or quantity is None:
+        return None, None
+    dimension, factor = UNIT_FACTORS[symbol]
+    return quantity * factor, BASE_UNITS[dimension]
+
+
+class Unit(db.Model):
+    """Model class for a spelling of a unit and its precomputed factor to the base unit."""
+
+    __tablename__ = "units"
+
+    id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
+    created_at: Mapped[datetime] = db.Column(db.DateTime)
+    edited_at: Mapped[datetime] = db.Column(db.DateTime)
+    symbol: Mapped[str] = db.Column(db.String, unique=True)
+    dimension: Mapped[str] = db.Column(db.String)
+    base_units: Mapped[str] = db.Column(db.String)
+    factor: Mapped[float] = db.Column(db.Float)
+
+    def to_json(self) -> Dict:
+        return {
+            "id": self.id,
+            "created_at": self.created_at,
+            "edited_at": self.edited_at,
+            "symbol": self.symbol,
+            "dimension": self.dimension,
+            "base_units": self.base_units,
+            "factor": self.factor,
+        }
+
+    @staticmethod
+    def rows(now=None) -> List[Dict]:
+        """Column values of every unit in UNIT_FACTORS, for seeding the table."""
+        now = now or datetime.utcnow()
+        return [
+            {
+                "id": unit_id(symbol),
+                "created_at": now,
+                "edited_at": now,
+                "symbol": symbol,
+                "dimension": dimension,
+                "base_units": BASE_UNITS[dimension],
+                "factor": factor,
+            }
+            for symbol, (dimension, factor) in UNIT_FACTORS.items()
+        ]
+
+    def __repr__(self) -> str:
+        return f"<Unit(id={self.id!r}, symbol={self.symbol}, factor={self.factor})>"
+
+
+def seed_units(connection) -> int:
+    """Insert the units of UNIT_FACTORS that the units table does not have yet.
+
+    :param connection: connection to insert with
+    :return: number of units inserted
+    """
+    table = Unit.__table__
+    existing = set(connection.scalars(select(table.c.symbol)))
+    rows = [row for row in Unit.rows() if row["symbol"] not in existing]
+    if rows:
+        connection.execute(table.insert(), rows)
+    return len(rows)
+
+
+# every database that creates the table starts with the known units
+event.listen(
+    Unit.__table__,
+    "after_create",
+    lambda table, connection, **kw: seed_units(connection),
+)
+
 
 class RecipeIngredient(db.Model):
     """Association table for ingredients and recipes. Also specifies quantity of ingredient."""
@@ -125,12 +688,16 @@ class RecipeIngredient(db.Model):
 
     id: Mapped[uuid.UUID] = db.Column(db.Uuid, primary_key=True)
     abstract_ingredient_id: Mapped[uuid.UUID] = db.Column(
-        db.Uuid, db.ForeignKey("abstract_ingredients.id"), nullable=False
+        db.Uuid, db.ForeignKey("abstract_ingredients.id"), nullable=False, index=True
     )
     quantity: Mapped[int] = db.Column(db.Integer)
-    units: Mapped[str] = db.Column(db.String)  # TODO maybe: make a units table
+    # units as written; unit_id is set when they are a known spelling
+    units: Mapped[str] = db.Column(db.String)
+    unit_id: Mapped[uuid.UUID] = db.Column(
+        db.Uuid, db.ForeignKey("units.id"), nullable=True, index=True
+    )
     recipe_id: Mapped[uuid.UUID] = db.Column(
-        db.Uuid, db.ForeignKey("recipes.id"), nullable=False
+        db.Uuid, db.ForeignKey("recipes.id"), nullable=False, index=True
     )
     abstract_ingredient: Mapped[AbstractIngredient] = relationship(
         back_populates="recipe_ingredients"
@@ -154,6 +721,7 @@ class RecipeIngredient(db.Model):
             id=uuid.uuid4(),
             quantity=quantity,
             units=units,
+            unit_id=unit_id(units),
             abstract_ingredient=abstract_ingredient,
             recipe=recipe,
         )
@@ -165,15 +733,219 @@ class RecipeIngredient(db.Model):
         )
 
 
-def connect_to_db(application):
-    application.config["SQLALCHEMY_DATABASE_URI"] = "postgresql:///fullspectrum-dev"
+# dialects whose insert() has on_conflict_do_nothing/do_update
+UPSERT_DIALECTS = ("postgresql", "sqlite")
+
+
+def dialect_insert(session):
+    """The insert() of the session's database dialect, imported on first use.
+
+    :param session: session whose primary database the statement is for
+    :return: sqlalchemy.dialects.<dialect>.insert
+    """
+    name = session.get_bind().dialect.name
+    if name not in UPSERT_DIALECTS:
+        raise LookupError(f"{name} has no INSERT ... ON CONFLICT")
+    return importlib.import_module(f"sqlalchemy.dialects.{name}").insert
+
+
+def upsert_rows(
+    model,
+    rows: Iterable[Dict],
+    conflict_columns: List[str],
+    update_columns: List[str],
+    batch_size: int = 1000,
+) -> int:
+    """Insert rows through SQLAlchemy Core in multi-row batches, updating rows that already exist.
+
+    Rows are consumed lazily, so a generator can be streamed in without building ORM objects.
+
+    :param model: model class whose table receives the rows
+    :param rows: dicts of column name to value, one per row
+    :param conflict_columns: unique columns that identify an existing row
+    :param update_columns: columns overwritten when the row already exists
+    :param batch_size: rows per INSERT statement
+    :return: number of rows written
+    """
+    insert = dialect_insert(db.session)
+    rows = iter(rows)
+    written = 0
+    while batch := list(islice(rows, batch_size)):
+        statement = insert(model.__table__).values(batch)
+        statement = statement.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: statement.excluded[column] for column in update_columns},
+        )
+        db.session.execute(statement)
+        written += len(batch)
+    return written
+
+
+# tables whose writes move their TableVersion: those the response and recipe caches are built
+# from. Other tables, such as jobs and inventory, are written too often to share one counter row.
+VERSIONED_TABLES = frozenset(
+    {
+        "abstract_ingredients",
+        "daily_harvests",
+        "egg_stock_records",
+        "harvest_aggregates",
+        "harvest_forecasts",
+        "recipe_ingredients",
+        "recipes",
+    }
+)
+
+
+class TableVersion(db.Model):
+    """Model class for a counter moved by every insert, update and delete on a table of
+    VERSIONED_TABLES.
+
+    Response cache validation reads these instead of counting rows, so deletes and writes that
+    leave edited_at alone are noticed without scanning the table.
+    """
+
+    __tablename__ = "table_versions"
+
+    name: Mapped[str] = db.Column(db.String, primary_key=True)
+    version: Mapped[int] = db.Column(db.Integer, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<TableVersion(name={self.name}, version={self.version})>"
+
+
+def _written_tables(session) -> set:
+    return session.info.setdefault("written_tables", set())
+
+
+@event.listens_for(orm.Session, "do_orm_execute")
+def _record_statement_write(orm_execute_state) -> None:
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        name = orm_execute_state.statement.table.name
+        if name in VERSIONED_TABLES:
+            _written_tables(orm_execute_state.session).add(name)
+
+
+@event.listens_for(orm.Session, "after_flush")
+def _record_flush_writes(session, flush_context) -> None:
+    for instance in [*session.new, *session.dirty, *session.deleted]:
+        if instance.__table__.name in VERSIONED_TABLES:
+            _written_tables(session).add(instance.__table__.name)
+
+
+@event.listens_for(orm.Session, "before_commit")
+def _bump_table_versions(session) -> None:
+    """Move the TableVersion of each table written in the transaction, in one statement."""
+    session.flush()
+    names = session.info.pop("written_tables", None)
+    if not names:
+        return
+    table = TableVersion.__table__
+    statement = dialect_insert(session)(table).values(
+        [{"name": name, "version": 1} for name in sorted(names)]
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=["name"], set_={"version": table.c.version + 1}
+        )
+    )
+
+
+@event.listens_for(orm.Session, "after_soft_rollback")
+def _forget_written_tables(session, previous_transaction) -> None:
+    session.info.pop("written_tables", None)
+
+
+DEFAULT_DATABASE_URI = "postgresql:///fullspectrum-dev"
+
+
+def engine_options_from_env(db_uri: str, environ=os.environ) -> Dict:
+    """Engine and pool settings for create_engine, read from DB_* environment variables.
+
+    DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT (seconds) and DB_POOL_RECYCLE (seconds) are
+    passed through when set; unset ones keep SQLAlchemy's defaults. DB_POOL_PRE_PING=1 checks
+    connections before use, and DB_STATEMENT_TIMEOUT_MS caps each postgres statement.
+
+    :param db_uri: database the options are for, which decides how the timeout is sent
+    :param environ: environment to read
+    :return: keyword arguments for create_engine or create_async_engine
+    """
+    options = {}
+    for variable, option in [
+        ("DB_POOL_SIZE", "pool_size"),
+        ("DB_MAX_OVERFLOW", "max_overflow"),
+        ("DB_POOL_TIMEOUT", "pool_timeout"),
+        ("DB_POOL_RECYCLE", "pool_recycle"),
+    ]:
+        if environ.get(variable):
+            options[option] = int(environ[variable])
+    if environ.get("DB_POOL_PRE_PING", "").lower() in ("1", "true", "yes"):
+        options["pool_pre_ping"] = True
+    timeout = environ.get("DB_STATEMENT_TIMEOUT_MS")
+    if timeout and make_url(db_uri).get_backend_name() == "postgresql":
+        if make_url(db_uri).get_driver_name() == "asyncpg":
+            options["connect_args"] = {
+                "server_settings": {"statement_timeout": timeout}
+            }
+        else:
+            options["connect_args"] = {"options": f"-c statement_timeout={timeout}"}
+    return options
+
+
+# apps configured by connect_to_db, whose pools a forked child must not share
+_connected_apps = weakref.WeakSet()
+
+
+def _reset_pools_after_fork() -> None:
+    for application in list(_connected_apps):
+        with application.app_context():
+            for engine in db.engines.values():
+                # leave the parent's connections to the parent
+                engine.dispose(close=False)
+
+
+# fork hooks cannot be unregistered, so one is registered for every app
+os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+
+def connect_to_db(
+    application: Flask,
+    db_uri: Optional[str] = None,
+    replica_uris: Optional[List[str]] = None,
+):
+    """Configure the database for application.
+
+    Engines open no connection until a session first needs one. A process forked after this,
+    such as a preforked server worker, starts with empty pools instead of sharing the parent's
+    connections.
+
+    :param application: Flask app
+    :param db_uri: primary database, defaults to DATABASE_URL or the dev database
+    :param replica_uris: read replicas, defaults to the comma separated DATABASE_REPLICA_URLS
+    """
+    db_uri = db_uri or os.environ.get("DATABASE_URL", DEFAULT_DATABASE_URI)
+    if replica_uris is None:
+        replica_uris = [
+            uri for uri in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if uri
+        ]
+    application.config["SQLALCHEMY_DATABASE_URI"] = db_uri
+    application.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options_from_env(db_uri)
+    application.config["SQLALCHEMY_BINDS"] = {
+        f"{REPLICA_BIND_PREFIX}{i}": {"url": uri, **engine_options_from_env(uri)}
+        for i, uri in enumerate(replica_uris)
+    }
     application.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    db.app = application
     db.init_app(application)
-    app.app_context().push()
+    _connected_apps.add(application)
 
 
 if __name__ == "__main__":
-    connect_to_db(app)
-    db.drop_all()
-    db.create_all()
+    from api.main import create_app
+    from api.migrations import upgrade
+
+    with create_app().app_context():
+        for version, description in upgrade(db.engine):
+            print(f"applied {version}: {description}")
@@ -0,0 +1,169 @@
+import uuid
+from datetime import date
+from typing import Dict, List, Optional
+
+from sqlalchemy import Float, case, cast, func, select
+
+from api.model import (
+    AbstractIngredient,
+    EggStockRecord,
+    Recipe,
+    RecipeIngredient,
+    Unit,
+    to_base_units,
+)
+
+# Column lists matching each model's to_json, for list endpoints that read rows straight
+# into dicts instead of hydrating ORM objects.
+EGG_STOCK_RECORD_COLUMNS = [
+    EggStockRecord.id,
+    EggStockRecord.created_at,
+    EggStockRecord.edited_at,
+    EggStockRecord.record_date,
+    EggStockRecord.quantity,
+]
+RECIPE_COLUMNS = [
+    Recipe.id,
+    Recipe.created_at,
+    Recipe.edited_at,
+    Recipe.name,
+    Recipe.instructions,
+    Recipe.servings,
+    Recipe.source,
+]
+RECIPE_INGREDIENT_COLUMNS = [
+    RecipeIngredient.id,
+    RecipeIngredient.abstract_ingredient_id,
+    RecipeIngredient.recipe_id,
+    AbstractIngredient.name,
+    RecipeIngredient.quantity,
+    RecipeIngredient.units,
+]
+
+
+def egg_stock_records_statement(
+    start_date: date,
+    end_date: date,
+    after: Optional[date] = None,
+    limit: Optional[int] = None,
+):
+    """Select stock records in record_date order, one keyset page of them when limit is set."""
+    statement = select(*EGG_STOCK_RECORD_COLUMNS).where(
+        EggStockRecord.record_date.between(start_date, end_date)
+    )
+    if after is not None:
+        statement = statement.where(EggStockRecord.record_date > after)
+    statement = statement.order_by(EggStockRecord.record_date)
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+
+def recipes_statement(*criteria):
+    """Select recipe columns, optionally filtered, in creation order."""
+    return (
+        select(*RECIPE_COLUMNS).where(*criteria).order_by(Recipe.created_at, Recipe.id)
+    )
+
+
+def recipe_ingredients_statement(*criteria):
+    """Select the ingredients, with names, of the recipes matching criteria."""
+    recipe_ids = select(Recipe.id).where(*criteria)
+    return (
+        select(*RECIPE_INGREDIENT_COLUMNS)
+        .join(RecipeIngredient.abstract_ingredient)
+        .where(RecipeIngredient.recipe_id.in_(recipe_ids))
+        .order_by(RecipeIngredient.id)
+    )
+
+
+def recipes_to_json(recipe_rows, ingredient_rows) -> List[Dict]:
+    """Assemble Recipe.to_json-shaped dicts from the rows of the two statements above."""
+    recipes = {row["id"]: {**row, "ingredients": []} for row in recipe_rows}
+    for row in ingredient_rows:
+        recipes[row["recipe_id"]]["ingredients"].append(dict(row))
+    return list(recipes.values())
+
+
+def load_recipes_json(session, *criteria) -> List[Dict]:
+    """Read recipes matching criteria as JSON-ready dicts in two queries.
+
+    :param session: session to query with
+    :param criteria: SQL expressions on Recipe columns
+    :return: one dict per recipe, shaped like Recipe.to_json
+    """
+    recipe_rows = session.execute(recipes_statement(*criteria)).mappings()
+    recipe_rows = recipe_rows.all()
+    if not recipe_rows:
+        return []
+    ingredient_rows = session.execute(recipe_ingredients_statement(*criteria))
+    return recipes_to_json(recipe_rows, ingredient_rows.mappings())
+
+
+def scale_recipe_json(recipe: Dict, servings: int) -> Dict:
+    """A copy of a Recipe.to_json-shaped dict with its ingredients scaled to servings.
+
+    Each ingredient also gets base_quantity and base_units, its scaled quantity in the base unit
+    of its dimension (ml, g or ea), which are None when its units are not a known spelling.
+
+    :param recipe: recipe with a positive servings count
+    :param servings: servings to scale to
+    :return: scaled recipe; the given dict is not changed
+    """
+    scale = servings / recipe["servings"]
+    ingredients = []
+    for ingredient in recipe["ingredients"]:
+        quantity = ingredient["quantity"]
+        if quantity is not None:
+            quantity *= scale
+        base_quantity, base_units = to_base_units(quantity, ingredient["units"])
+        ingredients.append(
+            {
+                **ingredient,
+                "quantity": quantity,
+                "base_quantity": base_quantity,
+                "base_units": base_units,
+            }
+        )
+    return {**recipe, "servings": servings, "ingredients": ingredients}
+
+
+def shopping_list_statement(servings: Dict[uuid.UUID, Optional[int]]):
+    """Select the ingredients of some recipes summed per ingredient and unit, in one pass.
+
+    Quantities are scaled by each recipe's requested servings over its own, or used as written
+    when the recipe has no servings count, converted to base units by the Unit they reference
+    and summed with GROUP BY. Ingredients whose units are not a known spelling are summed per
+    units as written instead.
+
+    :param servings: recipe id to the servings wanted, or None for the recipe as written
+    """
+    requested = {
+        recipe_id: count for recipe_id, count in servings.items() if count is not None
+    }
+    scale = 1.0
+    if requested:
+        wanted = case(
+            requested, value=RecipeIngredient.recipe_id, else_=Recipe.servings
+        )
+        # recipes without a servings count are not scaled, requested or not
+        scale = case(
+            (Recipe.servings > 0, cast(wanted, Float) / Recipe.servings), else_=1.0
+        )
+    units = func.coalesce(Unit.base_units, RecipeIngredient.units)
+    quantity = RecipeIngredient.quantity * func.coalesce(Unit.factor, 1.0) * scale
+    return (
+        select(
+            AbstractIngredient.id.label("abstract_ingredient_id"),
+            AbstractIngredient.name,
+            func.sum(quantity).label("quantity"),
+            units.label("units"),
+        )
+        .select_from(RecipeIngredient)
+        .join(RecipeIngredient.abstract_ingredient)
+        .join(RecipeIngredient.recipe)
+        .outerjoin(Unit, RecipeIngredient.unit_id == Unit.id)
+        .where(RecipeIngredient.recipe_id.in_(list(servings)))
+        .group_by(AbstractIngredient.id, AbstractIngredient.name, units)
+        .order_by(AbstractIngredient.name, units)
+    )
@@ -0,0 +1,173 @@
+"""Recipe search by text in the name and instructions, and by ingredients.
+
+On postgres, text queries match a GIN-indexed tsvector of each recipe (migration 0004) and
+results are ranked with ts_rank. Other databases use an in-process inverted index of the same
+text, rebuilt whenever the recipes table changes. Ingredient filters are SQL on either.
+"""
+
+import re
+import uuid
+from collections import Counter
+from threading import Lock
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import case, desc, distinct, func, literal_column, select
+
+from api.model import AbstractIngredient, Recipe, RecipeIngredient
+from api.queries import load_recipes_json
+
+# must match the expression of the ix_recipes_search index for postgres to use it
+RECIPE_TSVECTOR_SQL = (
+    "to_tsvector('english', coalesce(recipes.name, '') || ' ' || "
+    "coalesce(recipes.instructions, ''))"
+)
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 200
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return WORD.findall((text or "").lower())
+
+
+class RecipeTextIndex:
+    """Inverted index from words to the recipes whose name or instructions contain them.
+
+    Built from one scan of the recipes table and kept until the table's row count or latest
+    edited_at changes, so a search costs one indexed aggregate query while the catalog is
+    unchanged.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._version = None
+        self._postings: Dict[str, Dict[uuid.UUID, int]] = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version = None
+            self._postings = {}
+
+    def _current(self, session) -> Dict[str, Dict[uuid.UUID, int]]:
+        version = tuple(
+            session.execute(
+                select(func.count(Recipe.id), func.max(Recipe.edited_at))
+            ).one()
+        )
+        with self._lock:
+            if version != self._version:
+                postings: Dict[str, Dict[uuid.UUID, int]] = {}
+                rows = session.execute(
+                    select(Recipe.id, Recipe.name, Recipe.instructions)
+                )
+                for recipe_id, name, instructions in rows:
+                    words = Counter(tokenize(name) + tokenize(instructions))
+                    for word, count in words.items():
+                        postings.setdefault(word, {})[recipe_id] = count
+                self._postings, self._version = postings, version
+            return self._postings
+
+    def search(self, session, text: str) -> Dict[uuid.UUID, int]:
+        """Recipes containing every word of text, scored by how often the words occur.
+
+        :param session: session to check for changes and rebuild with
+        :param text: search words
+        :return: recipe id to score
+        """
+        postings = self._current(session)
+        words = set(tokenize(text))
+        if not words:
+            return {}
+        matches = [postings.get(word, {}) for word in words]
+        matches.sort(key=len)
+        scores = dict(matches[0])
+        for match in matches[1:]:
+            scores = {
+                recipe_id: score + match[recipe_id]
+                for recipe_id, score in scores.items()
+                if recipe_id in match
+            }
+        return scores
+
+
+recipe_text_index = RecipeTextIndex()
+
+
+def with_all_ingredients(names: Sequence[str]):
+    """Criterion for recipes that use every one of the named ingredients."""
+    return Recipe.id.in_(
+        select(RecipeIngredient.recipe_id)
+        .join(RecipeIngredient.abstract_ingredient)
+        .where(AbstractIngredient.name.in_(names))
+        .group_by(RecipeIngredient.recipe_id)
+        .having(func.count(distinct(AbstractIngredient.id)) == len(set(names)))
+    )
+
+
+def with_only_ingredients(names: Sequence[str]):
+    """Criterion for recipes whose ingredients are all among the named ones."""
+    outside = case((AbstractIngredient.name.in_(names), 0), else_=1)
+    return Recipe.id.in_(
+        select(RecipeIngredient.recipe_id)
+        .join(RecipeIngredient.abstract_ingredient)
+        .group_by(RecipeIngredient.recipe_id)
+        .having(func.sum(outside) == 0)
+    )
+
+
+def _ranked_ids(session, text: Optional[str], criteria, limit: int) -> List[uuid.UUID]:
+    if not text:
+        statement = select(Recipe.id).where(*criteria)
+        statement = statement.order_by(Recipe.created_at, Recipe.id).limit(limit)
+        return list(session.scalars(statement))
+
+    if session.get_bind().dialect.name == "postgresql":
+        vector = literal_column(RECIPE_TSVECTOR_SQL)
+        query = func.plainto_tsquery("english", text)
+        statement = (
+            select(Recipe.id)
+            .where(vector.op("@@")(query), *criteria)
+            .order_by(desc(func.ts_rank(vector, query)), Recipe.id)
+            .limit(limit)
+        )
+        return list(session.scalars(statement))
+
+    scores = recipe_text_index.search(session, text)
+    if not scores:
+        return []
+    if criteria:
+        matching = select(Recipe.id).where(Recipe.id.in_(list(scores)), *criteria)
+        scores = {
+            recipe_id: scores[recipe_id] for recipe_id in session.scalars(matching)
+        }
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], str(item[0])))
+    return [recipe_id for recipe_id, _ in ranked[:limit]]
+
+
+def search_recipes(
+    session,
+    text: Optional[str] = None,
+    ingredients: Sequence[str] = (),
+    only_ingredients: Sequence[str] = (),
+    limit: int = SEARCH_DEFAULT_LIMIT,
+) -> List[Dict]:
+    """Find recipes by words and ingredients, best text matches first.
+
+    :param session: session to query with
+    :param text: words that must all appear in the name or instructions
+    :param ingredients: names of ingredients the recipe must use
+    :param only_ingredients: names of the only ingredients the recipe may use
+    :param limit: maximum number of recipes
+    :return: recipes shaped like Recipe.to_json, ranked by text match, else in creation order
+    """
+    criteria = []
+    if ingredients:
+        criteria.append(with_all_ingredients(ingredients))
+    if only_ingredients:
+        criteria.append(with_only_ingredients(only_ingredients))
+    ids = _ranked_ids(session, text, criteria, limit)
+    if not ids:
+        return []
+    position = {recipe_id: index for index, recipe_id in enumerate(ids)}
+    recipes = load_recipes_json(session, Recipe.id.in_(ids))
+    return sorted(recipes, key=lambda recipe: position[recipe["id"]])
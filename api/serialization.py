@@ -0,0 +1,99 @@
+import math
+import re
+from datetime import date, datetime
+from time import perf_counter
+from typing import Any
+
+from flask import g, has_request_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# a number with an exponent, where orjson writes 1e-5 and json.dumps writes 1e-05
+FLOAT_EXPONENT = re.compile(rb"[:,\[]-?[0-9]+(?:\.[0-9]+)?[eE]")
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+MONTHS = "Jan Feb Mar Apr May Jun Jul Aug Sep Oct Nov Dec".split()
+
+
+def http_date(value: date) -> str:
+    """Format a date or naive UTC datetime like werkzeug.http.http_date, without strftime."""
+    hms = (0, 0, 0)
+    if isinstance(value, datetime):
+        hms = (value.hour, value.minute, value.second)
+    return "%s, %02d %s %04d %02d:%02d:%02d GMT" % (
+        WEEKDAYS[value.weekday()],
+        value.day,
+        MONTHS[value.month - 1],
+        value.year,
+        *hms,
+    )
+
+
+def has_non_finite(obj: Any) -> bool:
+    """Whether obj holds a NaN or infinite float, which orjson writes as null."""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(has_non_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(has_non_finite(value) for value in obj)
+    return False
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """JSON provider that encodes responses with orjson when it is installed.
+
+    Output is byte-for-byte what DefaultJSONProvider produces: keys are sorted, dates and
+    datetimes go through the same HTTP date default, and compact separators are used. orjson
+    writes non-ASCII characters raw, formats float exponents differently and writes NaN and
+    Infinity as null, so any payload containing one of those is re-encoded with the stdlib, as
+    is anything orjson rejects.
+
+    Set FAST_JSON to False in the app config to always use the stdlib encoder.
+    """
+
+    options = (
+        0 if orjson is None else orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    )
+
+    def fast_default(self, obj: Any) -> Any:
+        if isinstance(obj, date) and getattr(obj, "tzinfo", None) is None:
+            return http_date(obj)
+        return self.default(obj)
+
+    def fast_dumps(self, obj: Any) -> bytes:
+        """Encode obj with orjson, or return None if the stdlib encoder must be used."""
+        if orjson is None or not self._app.config.get("FAST_JSON", True):
+            return None
+        try:
+            data = orjson.dumps(obj, default=self.fast_default, option=self.options)
+        except TypeError:
+            return None
+        if not data.isascii() or FLOAT_EXPONENT.search(data):
+            return None
+        # only a payload with a null can hold a non-finite float
+        if b"null" in data and has_non_finite(obj):
+            return None
+        return data
+
+    def encode(self, obj: Any) -> bytes:
+        """Compact response body for obj, identical to what response() would send."""
+        data = self.fast_dumps(obj)
+        if data is None:
+            data = self.dumps(obj, separators=(",", ":")).encode()
+        return data + b"\n"
+
+    def response(self, *args, **kwargs):
+        started = perf_counter()
+        if (self.compact is None and self._app.debug) or self.compact is False:
+            response = super().response(*args, **kwargs)
+        else:
+            data = self.encode(self._prepare_response_obj(args, kwargs))
+            response = self._app.response_class(data, mimetype=self.mimetype)
+        # counted in the request's Server-Timing when api.metrics instruments the app
+        if has_request_context() and "request_stats" in g:
+            g.request_stats.serialize_seconds += perf_counter() - started
+        return response
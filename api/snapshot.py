@@ -0,0 +1,317 @@
+"""Memory-mapped columnar snapshot of the stock and daily harvest series, for range reads that
+do not query the database.
+
+The file holds each series as fixed-width columns: the days, sorted, as int32 days since
+1970-01-01, then for each count column its int32 values and its int64 running totals. A date
+range is found by binary search over the days, and the sum of a column over the range is the
+difference of two running totals, so neither costs more than O(log n) nor builds per-row
+objects. Workers map the file read-only, which puts every process on the same page cache.
+
+write_snapshot builds a new file beside the old one and renames it over it, so a reader sees
+either snapshot whole. Readers notice the rename on their next read and map the new file. Each
+series records the TableVersion of its table as read before its rows, and writers rename under
+an exclusive lock on a file beside the snapshot, skipping the rename when the snapshot in place
+was built from data at least as new. Two rebuilds racing each other therefore cannot leave the
+older one in place.
+
+The snapshot is only as new as its last rebuild: imports rebuild it once they commit, and
+POST /api/egg-stock-records queues a write_snapshot job, so /api/stock/series serves the posted
+records once a worker has run it.
+"""
+
+import bisect
+import fcntl
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from datetime import date
+from threading import Lock
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app
+from sqlalchemy import func, select
+
+from api.model import DailyHarvest, EggStockRecord, TableVersion, date_bounds, db
+
+MAGIC = b"FSESNAP2"
+# magic, byte order (1 little, 2 big), series count
+HEADER = struct.Struct("<8sII")
+# name, rows, count columns, offset of the days column, TableVersion of the series' table
+DIRECTORY_ENTRY = struct.Struct("<16sIIQQ")
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+BYTE_ORDERS = {"little": 1, "big": 2}
+
+# series: (date column, count columns)
+SERIES = {
+    "stock": (EggStockRecord.record_date, [EggStockRecord.quantity]),
+    "harvests": (
+        DailyHarvest.harvest_date,
+        [DailyHarvest.pink, DailyHarvest.brown, DailyHarvest.blue, DailyHarvest.total],
+    ),
+}
+
+
+def _padded(size: int) -> int:
+    """size rounded up to a multiple of 8, so every column starts aligned."""
+    return (size + 7) // 8 * 8
+
+
+def _epoch_day(day: date) -> int:
+    return day.toordinal() - EPOCH_ORDINAL
+
+
+def source_versions(session) -> Dict[str, int]:
+    """TableVersion of each series' table, 0 for a table never written."""
+    tables = {name: date_column.table.name for name, (date_column, _) in SERIES.items()}
+    versions = dict(
+        session.execute(
+            select(TableVersion.name, TableVersion.version).where(
+                TableVersion.name.in_(list(tables.values()))
+            )
+        ).all()
+    )
+    return {name: versions.get(table, 0) for name, table in tables.items()}
+
+
+def read_versions(path: str) -> Optional[Dict[str, int]]:
+    """Source versions of the snapshot at path, or None when there is no readable snapshot."""
+    try:
+        with open(path, "rb") as file:
+            data = file.read(HEADER.size)
+            if len(data) < HEADER.size:
+                return None
+            magic, _, count = HEADER.unpack(data)
+            if magic != MAGIC:
+                return None
+            data += file.read(DIRECTORY_ENTRY.size * count)
+    except FileNotFoundError:
+        return None
+    versions = {}
+    for index in range(count):
+        name, _, _, _, version = DIRECTORY_ENTRY.unpack_from(
+            data, HEADER.size + index * DIRECTORY_ENTRY.size
+        )
+        versions[name.rstrip(b"\0").decode()] = version
+    return versions
+
+
+def write_snapshot(session, path: str) -> Optional[Dict[str, int]]:
+    """Write both series to path, replacing any older snapshot atomically.
+
+    :param session: session to read the series with
+    :param path: snapshot file
+    :return: rows written per series, or None when the snapshot in place is at least as new
+    """
+    # read before the rows, so the snapshot never claims newer data than it holds
+    versions = source_versions(session)
+    names, blocks = [], []
+    for name, (date_column, columns) in SERIES.items():
+        rows = session.execute(select(date_column, *columns).order_by(date_column))
+        days, values = array("i"), [array("i") for _ in columns]
+        for row in rows:
+            days.append(_epoch_day(row[0]))
+            for column, value in zip(values, row[1:]):
+                column.append(value or 0)
+        names.append((name, len(days), len(columns)))
+        block = [days]
+        for column in values:
+            running, totals = 0, array("q", [0])
+            for value in column:
+                running += value
+                totals.append(running)
+            block += [column, totals]
+        blocks.append(block)
+
+    offset = _padded(HEADER.size + DIRECTORY_ENTRY.size * len(names))
+    directory = b""
+    for (name, rows, columns), block in zip(names, blocks):
+        directory += DIRECTORY_ENTRY.pack(
+            name.encode(), rows, columns, offset, versions[name]
+        )
+        offset += sum(_padded(len(column) * column.itemsize) for column in block)
+
+    directory_name = os.path.dirname(os.path.abspath(path))
+    descriptor, temporary = tempfile.mkstemp(dir=directory_name, suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as file:
+            header = HEADER.pack(MAGIC, BYTE_ORDERS[sys.byteorder], len(names))
+            file.write(header + directory)
+            file.write(bytes(_padded(file.tell()) - file.tell()))
+            for block in blocks:
+                for column in block:
+                    data = column.tobytes()
+                    file.write(data + bytes(_padded(len(data)) - len(data)))
+            file.flush()
+            os.fsync(file.fileno())
+        with open(f"{path}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            current = read_versions(path)
+            if current is not None and all(
+                current.get(name, -1) >= version for name, version in versions.items()
+            ):
+                os.unlink(temporary)
+                return None
+            os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.unlink(temporary)
+        raise
+    return {name: rows for name, rows, _ in names}
+
+
+def rebuild_snapshot() -> Optional[Dict[str, int]]:
+    """Rewrite the app's STOCK_SNAPSHOT_PATH after an import has committed, if one is set.
+
+    :return: rows written per series, or None without a snapshot path or a newer snapshot
+    """
+    path = current_app.config.get("STOCK_SNAPSHOT_PATH")
+    if not path:
+        return None
+    return write_snapshot(db.session, path)
+
+
+class Snapshot:
+    """A snapshot file mapped read-only, with its columns as zero-copy memoryviews."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._map)
+        magic, byte_order, count = HEADER.unpack_from(buffer)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a stock snapshot")
+        if byte_order != BYTE_ORDERS[sys.byteorder]:
+            raise ValueError(f"{path} was written on a machine of another byte order")
+        # series name: (days, [(values, running totals)])
+        self._series = {}
+        for index in range(count):
+            name, rows, columns, offset, _ = DIRECTORY_ENTRY.unpack_from(
+                buffer, HEADER.size + index * DIRECTORY_ENTRY.size
+            )
+            days = buffer[offset : offset + rows * 4].cast("i")
+            offset += _padded(rows * 4)
+            counts = []
+            for _ in range(columns):
+                values = buffer[offset : offset + rows * 4].cast("i")
+                offset += _padded(rows * 4)
+                totals = buffer[offset : offset + (rows + 1) * 8].cast("q")
+                offset += _padded((rows + 1) * 8)
+                counts.append((values, totals))
+            self._series[name.rstrip(b"\0").decode()] = (days, counts)
+
+    def _bounds(self, series: str, start_date: date, end_date: date) -> Tuple:
+        days, counts = self._series[series]
+        low = bisect.bisect_left(days, _epoch_day(start_date))
+        high = bisect.bisect_right(days, _epoch_day(end_date))
+        return days, counts, low, max(low, high)
+
+    def sums(self, series: str, start_date: date, end_date: date) -> Dict:
+        """Days and the sum of each count column from start_date to end_date, in O(log n)."""
+        _, counts, low, high = self._bounds(series, start_date, end_date)
+        _, columns = SERIES[series]
+        result = {"days": high - low}
+        for column, (_, totals) in zip(columns, counts):
+            result[column.key] = totals[high] - totals[low]
+        return result
+
+    def rows(self, series: str, start_date: date, end_date: date) -> List[Dict]:
+        """Each row from start_date to end_date, in date order."""
+        days, counts, low, high = self._bounds(series, start_date, end_date)
+        date_column, columns = SERIES[series]
+        return [
+            {
+                date_column.key: date.fromordinal(days[i] + EPOCH_ORDINAL),
+                **{
+                    column.key: values[i]
+                    for column, (values, _) in zip(columns, counts)
+                },
+            }
+            for i in range(low, high)
+        ]
+
+
+class SnapshotCache:
+    """The current Snapshot of each path in this process, mapped again when the file is replaced.
+
+    Replacing the file gives it a new inode, which one stat per read detects. A Snapshot that
+    is replaced is left to be unmapped once no reader holds it.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._snapshots = {}
+
+    def get(self, path: str) -> Optional[Snapshot]:
+        """The snapshot at path, or None when there is no file."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._snapshots.get(path)
+            if cached is None or cached[0] != version:
+                cached = (version, Snapshot(path))
+                self._snapshots[path] = cached
+            return cached[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+
+
+snapshot_cache = SnapshotCache()
+
+
+def read_series(
+    session,
+    series: str,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    path: Optional[str] = None,
+    with_rows: bool = True,
+) -> Dict:
+    """Rows and sums of a series over a date range, from the snapshot when there is one.
+
+    Without a snapshot file the same answer is read from the database.
+
+    :param session: session to fall back to
+    :param series: "stock" or "harvests"
+    :param start_date: earliest date to include, defaults to no lower bound
+    :param end_date: latest date to include, defaults to today
+    :param path: snapshot file, if any
+    :param with_rows: include each row, not only the sums
+    :return: {"series", "start", "end", "source", "sums", and "rows" when with_rows}
+    """
+    start_date, end_date = date_bounds(start_date, end_date)
+    snapshot = snapshot_cache.get(path) if path else None
+    result = {"series": series, "start": start_date, "end": end_date}
+    if snapshot is not None:
+        result["source"] = "snapshot"
+        result["sums"] = snapshot.sums(series, start_date, end_date)
+        if with_rows:
+            result["rows"] = snapshot.rows(series, start_date, end_date)
+        return result
+
+    date_column, columns = SERIES[series]
+    in_range = date_column.between(start_date, end_date)
+    result["source"] = "database"
+    sums = session.execute(
+        select(
+            func.count(),
+            *(func.coalesce(func.sum(column), 0) for column in columns),
+        ).where(in_range)
+    ).one()
+    result["sums"] = {
+        "days": sums[0],
+        **{column.key: total for column, total in zip(columns, sums[1:])},
+    }
+    if with_rows:
+        rows = session.execute(
+            select(date_column, *columns).where(in_range).order_by(date_column)
+        )
+        result["rows"] = [dict(row) for row in rows.mappings()]
+    return result
@@ -0,0 +1,172 @@
+"""Per-endpoint latencies and query plans against a seeded database.
+
+Seeds a scratch database (in-memory SQLite by default) through the schema migrations, requests
+each endpoint repeatedly through the Flask test client, then prints the latency and the plan of
+every distinct SQL statement the endpoint ran: EXPLAIN QUERY PLAN on SQLite, EXPLAIN ANALYZE on
+postgres. Point --database-url at an empty database; the seed data is not cleaned up.
+
+    python -m bench.query_plans --recipes 10000 --stock-rows 100000
+"""
+
+import argparse
+import statistics
+import time
+from datetime import timedelta
+from typing import Dict, List, Tuple
+
+from sqlalchemy import event, func, select
+
+from api.main import create_app
+from api.migrations import upgrade
+from api.model import EggStockRecord, Recipe, db
+from bench.seed import seed_database
+
+
+def endpoint_paths() -> Dict[str, str]:
+    """Representative requests for every read route, built from the seeded rows.
+
+    Writes are left out: the bulk POSTs and POST /api/jobs would change the rows the next run
+    measures. So is GET /api/jobs/<id>, as the seed queues no jobs to look up.
+
+    :return: a name for each request that does not change with the seed data, and its path
+    """
+    page_ids = list(db.session.scalars(select(Recipe.id).limit(30)))
+    recipe_id = page_ids[0]
+    latest = db.session.scalars(select(func.max(EggStockRecord.record_date))).one()
+    year_ago = (latest - timedelta(days=365)).isoformat()
+    decades_ago = (latest - timedelta(days=20 * 365)).isoformat()
+    return {
+        "/api/": "/api/",
+        "/api/about": "/api/about",
+        "/api/metrics": "/api/metrics",
+        "/api/recipes": "/api/recipes",
+        "/api/recipe/<id>": f"/api/recipe/{recipe_id}",
+        "/api/recipe/<id>?servings=8": f"/api/recipe/{recipe_id}?servings=8",
+        "/api/recipes/shopping-list?ids=<30 ids>:4": (
+            "/api/recipes/shopping-list?ids="
+            + ",".join(f"{page_id}:4" for page_id in page_ids)
+        ),
+        "/api/recipes?ids=<30 ids>": "/api/recipes?ids="
+        + ",".join(str(page_id) for page_id in page_ids),
+        "/api/recipes/search?q=<name>": "/api/recipes/search?q=recipe+42",
+        "/api/recipes/search?ingredient=<two names>": (
+            "/api/recipes/search?ingredient=ingredient+1,ingredient+2"
+        ),
+        "/api/recipes/search?q=<word>&only=<pantry>": (
+            "/api/recipes/search?q=whisk&only="
+            + ",".join(f"ingredient+{i}" for i in range(100))
+        ),
+        "/api/egg-stock-records": "/api/egg-stock-records",
+        "/api/egg-stock-records?start=<year ago>": f"/api/egg-stock-records?start={year_ago}",
+        "/api/egg-stock-records?after=<20 years ago>&limit=1000": (
+            f"/api/egg-stock-records?after={decades_ago}&limit=1000"
+        ),
+        "/api/egg-stock-records/export?start=<year ago>": (
+            f"/api/egg-stock-records/export?start={year_ago}"
+        ),
+        "/api/egg-stock-records/export?format=csv&start=<year ago>": (
+            f"/api/egg-stock-records/export?format=csv&start={year_ago}"
+        ),
+        "/api/stock": "/api/stock",
+        "/api/stock/history": "/api/stock/history",
+        "/api/stock/history?granularity=day&window=7": (
+            "/api/stock/history?granularity=day&window=7"
+        ),
+        "/api/stock/history?granularity=month": "/api/stock/history?granularity=month",
+        "/api/stock/forecast?weeks=4": "/api/stock/forecast?weeks=4",
+        "/api/stock/series?series=stock&start=<year ago>": (
+            f"/api/stock/series?series=stock&start={year_ago}"
+        ),
+        "/api/stock/series?series=harvests&start=<year ago>": (
+            f"/api/stock/series?series=harvests&start={year_ago}"
+        ),
+    }
+
+
+def explain(statement: str, parameters) -> List[str]:
+    """Plan of one statement as the database reports it."""
+    connection = db.session.connection()
+    if connection.dialect.name == "postgresql":
+        rows = connection.exec_driver_sql(f"EXPLAIN ANALYZE {statement}", parameters)
+        return [row[0] for row in rows]
+    rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    return [row[-1] for row in rows]
+
+
+def profile_endpoint(client, path: str, repeat: int) -> Dict:
+    """Request path repeat times, timing each request and capturing the SQL of the last one."""
+    statements: List[Tuple[str, object]] = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    timings = []
+    for _ in range(repeat):
+        statements.clear()
+        event.listen(db.engine, "before_cursor_execute", capture)
+        started = time.perf_counter()
+        response = client.get(path)
+        timings.append(time.perf_counter() - started)
+        event.remove(db.engine, "before_cursor_execute", capture)
+        assert response.status_code == 200, f"{path} returned {response.status_code}"
+
+    distinct = list(
+        dict((statement, parameters) for statement, parameters in statements).items()
+    )
+    return {
+        "path": path,
+        "median_ms": statistics.median(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "bytes": len(response.data),
+        "queries": len(statements),
+        "plans": [
+            (statement, explain(statement, params)) for statement, params in distinct
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--recipes", type=int, default=10_000)
+    parser.add_argument("--stock-rows", type=int, default=100_000)
+    parser.add_argument("--harvest-days", type=int, default=3 * 365)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--cache", action="store_true", help="measure with the response cache enabled"
+    )
+    args = parser.parse_args()
+
+    application = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": args.database_url,
+            "RESPONSE_CACHE_ENABLED": args.cache,
+        }
+    )
+    application.app_context().push()
+    upgrade(db.engine)
+    started = time.perf_counter()
+    counts = seed_database(
+        recipes=args.recipes,
+        stock_rows=args.stock_rows,
+        harvest_days=args.harvest_days,
+    )
+    print(f"seeded {counts} in {time.perf_counter() - started:.1f}s\n")
+
+    client = application.test_client()
+    for path in endpoint_paths().values():
+        result = profile_endpoint(client, path, args.repeat)
+        print(
+            f"GET {result['path']}: median {result['median_ms']:.1f}ms, "
+            f"max {result['max_ms']:.1f}ms, {result['queries']} queries, "
+            f"{result['bytes']} bytes"
+        )
+        for statement, plan in result["plans"]:
+            print("    " + " ".join(statement.split()))
+            for line in plan:
+                print("        " + line)
+        print()
+
+
+if __name__ == "__main__":
+    main()
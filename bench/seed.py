@@ -0,0 +1,176 @@
+"""Synthetic data at benchmark scale: recipes with ingredients, weekly stock and daily harvests."""
+
+import os
+import random
+import uuid
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List
+
+from sqlalchemy import insert
+
+from api.aggregates import refresh_harvest_aggregates
+from api.export import CSV_HEADER
+from api.forecast import refresh_harvest_forecast
+from api.model import (
+    AbstractIngredient,
+    DailyHarvest,
+    EggStockRecord,
+    Recipe,
+    RecipeIngredient,
+    db,
+    unit_id,
+    upsert_rows,
+    week_ending,
+)
+
+UNITS = ["cup", "tbsp", "tsp", "oz", "g", "each"]
+
+
+def _insert_batches(model, rows: Iterator[Dict], batch_size: int = 1000) -> None:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            db.session.execute(insert(model), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(model), batch)
+
+
+def seed_database(
+    recipes: int = 10_000,
+    ingredients: int = 500,
+    ingredients_per_recipe: int = 8,
+    stock_rows: int = 100_000,
+    harvest_days: int = 3 * 365,
+    seed: int = 0,
+) -> Dict[str, int]:
+    """Fill empty tables with reproducible synthetic data and commit.
+
+    Weekly stock records and daily harvests both end at the latest Monday, one stock row per
+    week going back from there, so a large stock_rows reaches far into the past.
+
+    :param recipes: number of recipes
+    :param ingredients: number of distinct abstract ingredients shared between recipes
+    :param ingredients_per_recipe: ingredients listed on each recipe
+    :param stock_rows: number of weekly egg stock records
+    :param harvest_days: number of daily harvests, rolled up into week and month aggregates
+    :param seed: random seed, so that runs with the same arguments compare like with like
+    :return: rows inserted per table
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    last_monday = week_ending(date.today()) - timedelta(days=7)
+
+    ingredient_ids = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(ingredients)]
+    _insert_batches(
+        AbstractIngredient,
+        (
+            {
+                "id": ingredient_id,
+                "created_at": now,
+                "edited_at": now,
+                "name": f"ingredient {i}",
+            }
+            for i, ingredient_id in enumerate(ingredient_ids)
+        ),
+    )
+    recipe_ids = [uuid.UUID(int=rng.getrandbits(128)) for _ in range(recipes)]
+    _insert_batches(
+        Recipe,
+        (
+            {
+                "id": recipe_id,
+                "created_at": now,
+                "edited_at": now,
+                "name": f"recipe {i}",
+                "instructions": "Whisk the eggs. " * rng.randint(1, 20),
+                "servings": rng.randint(1, 12),
+                "source": "bench",
+            }
+            for i, recipe_id in enumerate(recipe_ids)
+        ),
+    )
+    _insert_batches(
+        RecipeIngredient,
+        (
+            {**row, "unit_id": unit_id(row["units"])}
+            for row in (
+                {
+                    "id": uuid.UUID(int=rng.getrandbits(128)),
+                    "recipe_id": recipe_id,
+                    "abstract_ingredient_id": ingredient_id,
+                    "quantity": rng.randint(1, 16),
+                    "units": rng.choice(UNITS),
+                }
+                for recipe_id in recipe_ids
+                for ingredient_id in rng.sample(ingredient_ids, ingredients_per_recipe)
+            )
+        ),
+    )
+    _insert_batches(
+        EggStockRecord,
+        (
+            {
+                "id": uuid.UUID(int=rng.getrandbits(128)),
+                "created_at": now,
+                "edited_at": now,
+                "record_date": last_monday - timedelta(weeks=week),
+                "quantity": rng.randint(0, 40),
+            }
+            for week in range(stock_rows)
+        ),
+    )
+    if harvest_days:
+        first_day = last_monday - timedelta(days=harvest_days - 1)
+        upsert_rows(
+            DailyHarvest,
+            (
+                DailyHarvest.row(
+                    first_day + timedelta(days=day), *colors, sum(colors), now
+                )
+                for day in range(harvest_days)
+                for colors in [[rng.randint(0, 4) for _ in range(3)]]
+            ),
+            ["harvest_date"],
+            ["pink", "brown", "blue", "total", "edited_at"],
+        )
+        refresh_harvest_aggregates(first_day, last_monday)
+        refresh_harvest_forecast(first_day, last_monday)
+    db.session.commit()
+    return {
+        "abstract_ingredients": ingredients,
+        "recipes": recipes,
+        "recipe_ingredients": recipes * ingredients_per_recipe,
+        "egg_stock_records": stock_rows,
+        "daily_harvests": harvest_days,
+    }
+
+
+def write_harvest_csvs(directory: str, days: int, seed: int = 0) -> List[str]:
+    """Write days of synthetic harvests ending at the latest Monday, one egg CSV per year.
+
+    The files have the layout of data/2021.csv, so they go through the same parsers.
+
+    :param directory: directory to write the files into
+    :param days: number of daily rows across all files
+    :param seed: random seed
+    :return: file paths in date order
+    """
+    rng = random.Random(seed)
+    last_monday = week_ending(date.today()) - timedelta(days=7)
+    first_day = last_monday - timedelta(days=days - 1)
+    files = {}
+    for day in range(days):
+        harvest_date = first_day + timedelta(days=day)
+        if harvest_date.year not in files:
+            path = os.path.join(directory, f"{harvest_date.year}.csv")
+            files[harvest_date.year] = open(path, "w")
+            files[harvest_date.year].write(CSV_HEADER)
+        colors = [rng.randint(0, 4) for _ in range(3)]
+        files[harvest_date.year].write(
+            f"{harvest_date:%m/%d/%Y},{colors[0]},{colors[1]},{colors[2]},{sum(colors)},\n"
+        )
+    for f in files.values():
+        f.close()
+    return [f.name for f in files.values()]
@@ -0,0 +1,125 @@
+"""Cold start of a worker: how long a fresh process takes to import, build and serve the app.
+
+Each run starts a new interpreter that imports api.main, calls create_app() and answers one
+request through the test client, timing each phase; the process time also covers interpreter
+startup and shutdown. --imports lists the slowest modules reported by python -X importtime,
+which is where to look when the import phase grows. With --budget-ms, exits non-zero when the
+median process time is over budget:
+
+    python -m bench.startup --runs 10
+    python -m bench.startup --imports 20 --budget-ms 1500
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PHASES = ["import_ms", "create_app_ms", "first_request_ms", "process_ms"]
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+from api.main import create_app
+imported = time.perf_counter()
+application = create_app({"SQLALCHEMY_DATABASE_URI": sys.argv[1]})
+created = time.perf_counter()
+status = application.test_client().get(sys.argv[2]).status_code
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (created - imported) * 1000,
+    "first_request_ms": (served - created) * 1000,
+    "status": status,
+}))
+"""
+
+
+def _environ() -> Dict[str, str]:
+    path = os.environ.get("PYTHONPATH")
+    return {**os.environ, "PYTHONPATH": ROOT + (os.pathsep + path if path else "")}
+
+
+def cold_start(database_url: str = "sqlite://", path: str = "/api/") -> Dict:
+    """Time one fresh process importing, building and serving the app.
+
+    :param database_url: database the app is configured with
+    :param path: route of the first request
+    :return: milliseconds per phase and the first response's status
+    """
+    started = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, database_url, path],
+        cwd=ROOT,
+        env=_environ(),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    result = json.loads(output.splitlines()[-1])
+    result["process_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+def measure_cold_starts(runs: int, database_url: str = "sqlite://") -> Dict:
+    """Median milliseconds of each phase over runs fresh processes."""
+    results = [cold_start(database_url) for _ in range(runs)]
+    return {
+        phase: statistics.median(result[phase] for result in results)
+        for phase in PHASES
+    }
+
+
+def slowest_imports(module: str = "api.main", count: int = 15) -> List[Tuple]:
+    """Modules with the highest cumulative import time when a fresh process imports module.
+
+    :return: (cumulative ms, self ms, module name) tuples, slowest first
+    """
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=_environ(),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    imports = []
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[0].strip().isdigit():
+            imports.append(
+                (int(fields[1]) / 1000, int(fields[0]) / 1000, fields[2].strip())
+            )
+    return sorted(imports, reverse=True)[:count]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--imports", type=int, default=0, metavar="COUNT")
+    parser.add_argument("--budget-ms", type=float)
+    args = parser.parse_args()
+
+    medians = measure_cold_starts(args.runs, args.database_url)
+    print(", ".join(f"{phase} {value:.1f}" for phase, value in medians.items()))
+    if args.imports:
+        for cumulative_ms, self_ms, name in slowest_imports(count=args.imports):
+            print(f"{cumulative_ms:8.1f}ms {self_ms:8.1f}ms  {name}")
+    if args.budget_ms is not None and medians["process_ms"] > args.budget_ms:
+        print(
+            f"REGRESSION process_ms {medians['process_ms']:.1f} > {args.budget_ms}",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
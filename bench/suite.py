@@ -0,0 +1,231 @@
+"""Endpoint and import benchmarks, compared against stored baselines.
+
+Seeds a scratch database (in-memory SQLite by default) at the chosen scale, requests every read
+route of api/main.py and runs the data/load_data.py pipeline over synthetic CSVs, recording
+throughput, p50/p95/p99 latency and queries per run. Exits non-zero when a result regresses past
+bench/baselines.json:
+
+    python -m bench.suite --scale small
+    python -m bench.suite --scale small --update-baselines
+
+Median latency may grow by --tolerance (a fraction of the baseline) plus --slack-ms before
+failing, and p95 by twice that, since timings vary between runs and machines. Query counts are deterministic
+and may not grow at all. Baselines are only comparable when recorded on similar hardware, so
+refresh them with --update-baselines when the build machine changes.
+"""
+
+import argparse
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from sqlalchemy import event
+
+from api.main import create_app
+from api.migrations import upgrade
+from api.model import db
+from bench.query_plans import endpoint_paths
+from bench.seed import seed_database, write_harvest_csvs
+from data.load_data import ingest_egg_csvs, parse_egg_csv_file
+
+SCALES = {
+    "small": {
+        "recipes": 1_000,
+        "stock_rows": 10_000,
+        "harvest_days": 365,
+        "csv_days": 3 * 365,
+    },
+    "large": {
+        "recipes": 10_000,
+        "stock_rows": 100_000,
+        "harvest_days": 3 * 365,
+        "csv_days": 20 * 365,
+    },
+}
+BASELINES_FILE = os.path.join(os.path.dirname(__file__), "baselines.json")
+DEFAULT_TOLERANCE = 1.0
+# absolute latency allowance, so sub-millisecond routes do not fail on timer noise
+DEFAULT_SLACK_MS = 1.0
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of values, q between 0 and 100."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100 * len(ordered)) - 1)]
+
+
+def measure(run: Callable[[], int], repeat: int) -> Dict:
+    """Time repeat calls of run, which returns how many items it processed.
+
+    One untimed call first warms up connections and caches.
+
+    :return: throughput in items per second, latency percentiles in ms and queries per call
+    """
+    query_counts = []
+    timings = []
+    items = 0
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        query_counts[-1] += 1
+
+    run()
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        for _ in range(repeat):
+            query_counts.append(0)
+            started = time.perf_counter()
+            items += run()
+            timings.append(time.perf_counter() - started)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    return {
+        "throughput": round(items / sum(timings), 3),
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "queries": max(query_counts),
+    }
+
+
+def benchmark_endpoints(client, repeat: int) -> Dict[str, Dict]:
+    """Request every read route repeat times; throughput is in requests per second."""
+
+    def request(path: str) -> Callable[[], int]:
+        def run() -> int:
+            response = client.get(path)
+            assert (
+                response.status_code == 200
+            ), f"{path} returned {response.status_code}"
+            return 1
+
+        return run
+
+    return {
+        f"GET {name}": measure(request(path), repeat)
+        for name, path in endpoint_paths().items()
+    }
+
+
+def benchmark_load_data(files: List[str], repeat: int) -> Dict[str, Dict]:
+    """Parse and ingest the CSV files repeat times; throughput is in CSV rows per second."""
+
+    def parse() -> int:
+        return sum(len(parse_egg_csv_file(file)) for file in files)
+
+    rows = parse()
+
+    def ingest() -> int:
+        ingest_egg_csvs(files, max_workers=1)
+        return rows
+
+    return {
+        "load_data.parse": measure(parse, repeat),
+        "load_data.ingest": measure(ingest, repeat),
+    }
+
+
+def run_suite(client, scale: Dict[str, int], repeat: int) -> Dict[str, Dict]:
+    """Seed the connected, empty database and benchmark every read route and the import pipeline."""
+    seed_database(
+        recipes=scale["recipes"],
+        stock_rows=scale["stock_rows"],
+        harvest_days=scale["harvest_days"],
+    )
+    results = benchmark_endpoints(client, repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        files = write_harvest_csvs(directory, scale["csv_days"])
+        results.update(benchmark_load_data(files, repeat))
+    return results
+
+
+def compare(
+    results: Dict[str, Dict],
+    baselines: Dict[str, Dict],
+    tolerance: float = DEFAULT_TOLERANCE,
+    slack_ms: float = DEFAULT_SLACK_MS,
+) -> List[str]:
+    """Describe every result that regressed past its baseline.
+
+    :param results: benchmark name to metrics, as returned by run_suite
+    :param baselines: the same, from a previous run
+    :param tolerance: fraction the median latency may grow before failing
+    :param slack_ms: latency growth allowed on top of the tolerance
+    :return: one message per regression, empty if there are none
+    """
+    regressions = []
+    for name, baseline in baselines.items():
+        result = results.get(name)
+        if result is None:
+            regressions.append(f"{name}: missing from results")
+            continue
+        # tails are noisier than medians: p95 gets twice the tolerance, and p99 of a few dozen
+        # runs is a single sample, so it is reported but not gated, as is throughput (1 / mean).
+        for metric, allowed in [("p50_ms", tolerance), ("p95_ms", 2 * tolerance)]:
+            if result[metric] > baseline[metric] * (1 + allowed) + slack_ms:
+                regressions.append(
+                    f"{name}: {metric} {result[metric]:.1f} > baseline {baseline[metric]:.1f}"
+                )
+        if result["queries"] > baseline["queries"]:
+            regressions.append(
+                f"{name}: {result['queries']} queries > baseline {baseline['queries']}"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--slack-ms", type=float, default=DEFAULT_SLACK_MS)
+    parser.add_argument("--baselines", default=BASELINES_FILE)
+    parser.add_argument(
+        "--update-baselines",
+        action="store_true",
+        help="store this run's results as the baselines for its scale",
+    )
+    args = parser.parse_args()
+
+    application = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": args.database_url,
+            "RESPONSE_CACHE_ENABLED": False,
+        }
+    )
+    application.app_context().push()
+    upgrade(db.engine)
+    results = run_suite(application.test_client(), SCALES[args.scale], args.repeat)
+
+    for name, metrics in results.items():
+        print(
+            f"{name}: {metrics['throughput']:.1f}/s, p50 {metrics['p50_ms']:.1f}ms, "
+            f"p95 {metrics['p95_ms']:.1f}ms, p99 {metrics['p99_ms']:.1f}ms, "
+            f"{metrics['queries']} queries"
+        )
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+    if args.update_baselines:
+        baselines[args.scale] = results
+        with open(args.baselines, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        return 0
+    if args.scale not in baselines:
+        print(f"no {args.scale} baselines in {args.baselines}", file=sys.stderr)
+        return 1
+    regressions = compare(results, baselines[args.scale], args.tolerance, args.slack_ms)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
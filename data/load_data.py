@@ -1,26 +1,69 @@
+import argparse
+import glob
+import hashlib
+import io
 import logging
-from datetime import datetime, date
-from typing import List, TextIO, Tuple
+import os
+from datetime import datetime, date, timedelta
+from functools import partial
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
 
+from sqlalchemy import select
+
+from api.aggregates import (
+    refresh_daily_harvests,
+    refresh_harvest_aggregates,
+    upsert_weekly_dozens,
+)
+from api.forecast import refresh_harvest_forecast
+from api.snapshot import rebuild_snapshot
 from api.model import (
+    HOME_FARM,
     AbstractIngredient,
+    DailyHarvest,
     EggStockRecord,
+    FarmHarvest,
+    ImportCheckpoint,
     Recipe,
     RecipeIngredient,
-    app,
-    connect_to_db,
+    date_bounds,
     db,
+    upsert_rows,
+    week_ending,
 )
 
 log = logging.Logger("LoadData")
 
 TEXT_SOURCES = {"about": "../data/about.txt", "test": "../tests/test.txt"}
+# (date, pink, brown, blue, total harvested)
+Harvest = Tuple[date, int, int, int, int]
+EGG_CSV_FILES = ["2021.csv", "2022.csv", "2023.csv"]
+# bytes before a checkpoint's offset that are hashed to detect a rewritten file
+CHECKPOINT_HASH_WINDOW = 4096
 
 
-def create_custard_recipe() -> Recipe:
+def create_custard_recipe(session=None) -> Recipe:
     """Create steamed custard recipe with four AbstractIngredients + RecipeIngredients.
+    :param session: session to look up AbstractIngredients that already exist, which are reused
+    instead of colliding with their unique name
     :return: custard Recipe SQLAlchemy object with connected RecipeIngredients and AbstractIngredients
     """
+    ingredients = [
+        ["egg", 4, "ea"],
+        ["milk", 500, "mL"],
+        ["sugar", 125, "g"],
+        ["water", 125, "mL"],
+    ]
+    existing = {}
+    if session is not None:
+        names = [name for name, _, _ in ingredients]
+        existing = {
+            ingredient.name: ingredient
+            for ingredient in session.scalars(
+                select(AbstractIngredient).where(AbstractIngredient.name.in_(names))
+            )
+        }
     custard = Recipe(
         name="Custard Pudding (Steamed)",
         instructions="1. Mix rock sugar and water in a saucepan. Boil on low heat, stirring occasionally. Once the "
@@ -36,94 +79,471 @@ def create_custard_recipe() -> Recipe:
     )
     _ = [
         RecipeIngredient(
-            abstract_ingredient=AbstractIngredient(name=name),
+            abstract_ingredient=existing.get(name) or AbstractIngredient(name=name),
             quantity=qty,
             units=units,
             recipe=custard,
         )
-        for name, qty, units in [
-            ["egg", 4, "ea"],
-            ["milk", 500, "mL"],
-            ["sugar", 125, "g"],
-            ["water", 125, "mL"],
-        ]
+        for name, qty, units in ingredients
     ]
     return custard
 
 
+def parse_mdy_date(value: str) -> date:
+    """Parse a zero-padded mm/dd/yyyy date by position, which is much faster than strptime.
+
+    :param value: date string, e.g. "05/15/2021"
+    :return: parsed date
+    """
+    return date(int(value[6:10]), int(value[0:2]), int(value[3:5]))
+
+
+def _count(field: str) -> int:
+    """Parse a per-color count, treating blanks and "-0" as zero."""
+    return int(field) if field.lstrip("-").isdigit() else 0
+
+
+def iter_daily_harvest_csv(
+    filestream: TextIO,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> Iterator[Harvest]:
+    """Lazily yield (date, pink, brown, blue, total harvested) for each CSV row, one row at a time.
+
+    :param filestream: opened csv file
+    :param start_date: date of the earliest record to be included, defaults to no lower bound
+    :param end_date: date of the latest record to be included, defaults to today
+    :return: iterator of (date, pink, brown, blue, total)
+    """
+    start_date, end_date = date_bounds(start_date, end_date)
+    for line in filestream:
+        # skip the header and any row missing a date or a total
+        if not line[:1].isdigit():
+            continue
+        fields = line.split(",", 5)
+        total = fields[4].strip() if len(fields) > 4 else ""
+        if not total.isdigit():
+            continue
+        # date column must already be in mm/dd/yyyy format
+        record_date = parse_mdy_date(fields[0])
+        if start_date <= record_date <= end_date:
+            yield (
+                record_date,
+                _count(fields[1]),
+                _count(fields[2]),
+                _count(fields[3]),
+                int(total),
+            )
+
+
+def iter_daily_egg_csv(
+    filestream: TextIO,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> Iterator[Tuple[date, int]]:
+    """Lazily yield (date, total harvested) for each CSV row, one row at a time.
+
+    :param filestream: opened csv file
+    :param start_date: date of the earliest record to be included, defaults to no lower bound
+    :param end_date: date of the latest record to be included, defaults to today
+    :return: iterator of (date, quantity)
+    """
+    for harvest in iter_daily_harvest_csv(filestream, start_date, end_date):
+        yield harvest[0], harvest[4]
+
+
 def read_daily_egg_csvs(
     filestream: TextIO,
-    start_date: date = date(1, 1, 1),
-    end_date: date = date.today(),
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
 ) -> List[Tuple[date, int]]:
-    """Format CSV data into EggStockRecord and commit to db
+    """Read daily (date, total harvested) records from an egg CSV
 
     :param filestream: opened csv file
-    :param start_date: date of the earliest record to be included
-    :param end_date: date of the latest record to be included
-    :return: EggStockRecords
-    """
-    # split at comma delimiter and exclude rows missing dates or quantity data
-    relevant_lines = [
-        line.split(",")
-        for line in filestream
-        if line[0][0].isdigit() and line[4].isdigit()
-    ]
-    # date column must already be in mm/dd/yyyy format
-    formatted_fields = [
-        (datetime.date(datetime.strptime(line[0], "%m/%d/%Y")), int(line[4]))
-        for line in relevant_lines
-    ]
-    # in order to use a list comp here & above, line[0] must be a date type already
-    egg_records = [
-        (line[0], line[1])
-        for line in formatted_fields
-        if start_date <= line[0] <= end_date
-    ]
-    return egg_records
+    :param start_date: date of the earliest record to be included, defaults to no lower bound
+    :param end_date: date of the latest record to be included, defaults to today
+    :return: list of (date, quantity)
+    """
+    return list(iter_daily_egg_csv(filestream, start_date, end_date))
 
 
-def convert_daily_eggs_to_weekly_dozens(
-    records: List[Tuple[date, int]]
-) -> List[EggStockRecord]:
+def sum_weekly_dozens(records: Iterable[Tuple[date, int]]) -> List[Tuple[date, int]]:
+    """Sum daily records into weeks ending on Monday, rounded down to dozens.
+
+    Days after the last Monday are left out, as their week is not complete.
+
+    :param records: daily (date, quantity) records in date order
+    :return: weekly (date, dozens) records
+    """
     weekly_records = []
     week_sum = 0
     # sum all eggs harvested per week
-    for record in records:
-        week_sum += record[1]
-        if record[0].weekday() == 0:
+    for record_date, quantity in records:
+        week_sum += quantity
+        if record_date.weekday() == 0:
             # maintain tuple structure: (date, quantity)
             # round down dozens
-            weekly_records.append((record[0], week_sum // 12))
+            weekly_records.append((record_date, week_sum // 12))
             week_sum = 0
+    return weekly_records
 
+
+def convert_daily_eggs_to_weekly_dozens(
+    records: List[Tuple[date, int]]
+) -> List[EggStockRecord]:
+    weekly_records = sum_weekly_dozens(records)
     db_records = [
         EggStockRecord(record_date=wr[0], quantity=wr[1]) for wr in weekly_records
     ]
     return db_records
 
 
+def parse_egg_csv_file(file: str, vectorized: bool = False) -> List[Harvest]:
+    """Read one egg CSV from disk. Module level so worker processes can pickle it.
+
+    :param file: csv path
+    :param vectorized: parse with the NumPy implementation in data/vectorized.py
+    :return: (date, pink, brown, blue, total) rows
+    """
+    with open(file) as f:
+        if vectorized:
+            from data.vectorized import read_daily_harvests
+
+            return read_daily_harvests(f)
+        return list(iter_daily_harvest_csv(f))
+
+
+def _upsert_farm_harvests(
+    farm_id: str, harvests: List[Harvest], batch_size: int = 1000
+) -> None:
+    now = datetime.utcnow()
+    upsert_rows(
+        FarmHarvest,
+        (FarmHarvest.row(farm_id, *harvest, now=now) for harvest in harvests),
+        conflict_columns=["farm_id", "harvest_date"],
+        update_columns=["pink", "brown", "blue", "total", "edited_at"],
+        batch_size=batch_size,
+    )
+
+
+def _store_weekly_dozens(
+    start_date: date, end_date: date, batch_size: int = 1000
+) -> int:
+    # the first changed week starts the day after the Monday before it
+    totals = db.session.execute(
+        select(DailyHarvest.harvest_date, DailyHarvest.total)
+        .where(
+            DailyHarvest.harvest_date.between(
+                week_ending(start_date) - timedelta(days=6), week_ending(end_date)
+            )
+        )
+        .order_by(DailyHarvest.harvest_date)
+    )
+    weekly_records = sum_weekly_dozens(totals)
+    return upsert_weekly_dozens(weekly_records, batch_size=batch_size)
+
+
+def store_harvests(
+    harvests: List[Harvest],
+    batch_size: int = 1000,
+    farm_id: str = HOME_FARM,
+) -> int:
+    """Upsert one farm's daily harvests, then the daily totals, weekly dozens, aggregates and
+    forecast they touch. The caller commits.
+
+    Weekly dozens are re-summed from the stored daily totals of every week that contains a
+    changed day, as in store_farm_harvests, so a week keeps the eggs of other farms and of days
+    loaded by earlier imports.
+
+    :param harvests: (date, pink, brown, blue, total) rows in date order
+    :param batch_size: rows per INSERT statement
+    :param farm_id: farm that harvested the eggs
+    :return: number of weekly records written
+    """
+    if not harvests:
+        return 0
+    _upsert_farm_harvests(farm_id, harvests, batch_size=batch_size)
+    start_date, end_date = harvests[0][0], harvests[-1][0]
+    refresh_daily_harvests(start_date, end_date)
+    refresh_harvest_aggregates(start_date, end_date)
+    refresh_harvest_forecast(start_date, end_date)
+    return _store_weekly_dozens(start_date, end_date, batch_size=batch_size)
+
+
+def store_farm_harvests(
+    farm_harvests: Dict[str, List[Harvest]], batch_size: int = 1000
+) -> int:
+    """Upsert the daily harvests of several farms and re-sum everything they touch.
+
+    Weekly dozens are recomputed from the stored daily totals of every week that contains a
+    changed day, so a week gets the eggs of all farms and of days loaded earlier, wherever the
+    files split it. The caller commits.
+
+    :param farm_harvests: farm id to (date, pink, brown, blue, total) rows
+    :param batch_size: rows per INSERT statement
+    :return: number of weekly records written
+    """
+    dates = [harvest[0] for harvests in farm_harvests.values() for harvest in harvests]
+    if not dates:
+        return 0
+    for farm_id in sorted(farm_harvests):
+        _upsert_farm_harvests(farm_id, farm_harvests[farm_id], batch_size=batch_size)
+    start_date, end_date = min(dates), max(dates)
+    refresh_daily_harvests(start_date, end_date)
+    refresh_harvest_aggregates(start_date, end_date)
+    refresh_harvest_forecast(start_date, end_date)
+    return _store_weekly_dozens(start_date, end_date, batch_size=batch_size)
+
+
+def merge_harvest_files(parsed_files: Iterable[List[Harvest]]) -> List[Harvest]:
+    """Combine one farm's parsed files into date order. A day in several files keeps the row
+    from the last of them.
+
+    :param parsed_files: (date, pink, brown, blue, total) rows of each file, in file order
+    :return: one row per day, in date order
+    """
+    by_date = {harvest[0]: harvest for harvest in chain.from_iterable(parsed_files)}
+    return [by_date[day] for day in sorted(by_date)]
+
+
+def farm_csv_files(sources: Dict[str, str]) -> Dict[str, List[str]]:
+    """Expand each farm's directory or glob pattern to its CSV files, sorted by path.
+
+    :param sources: farm id to a directory of CSVs or a glob such as partners/acme/*.csv
+    :return: farm id to csv paths
+    :raises FileNotFoundError: when a farm's source matches no file
+    """
+    farm_files = {}
+    for farm_id, source in sources.items():
+        pattern = os.path.join(source, "*.csv") if os.path.isdir(source) else source
+        farm_files[farm_id] = sorted(glob.glob(pattern))
+        if not farm_files[farm_id]:
+            raise FileNotFoundError(f"no CSV files for farm {farm_id} at {source}")
+    return farm_files
+
+
+def ingest_farm_csvs(
+    farm_files: Dict[str, List[str]],
+    batch_size: int = 1000,
+    max_workers: Optional[int] = None,
+    vectorized: bool = False,
+    snapshot: bool = True,
+) -> int:
+    """Parse the egg CSVs of several farms in parallel and bulk upsert them in one transaction.
+
+    Every file, whatever its farm, is one task for the process pool. Each farm's rows are then
+    merged in date order and stored with store_farm_harvests. Re-running over the same files is
+    idempotent. Once committed, the stock snapshot is rebuilt if the app has one.
+
+    :param farm_files: farm id to csv paths; a day in several of a farm's files keeps the row
+        from the last of them
+    :param batch_size: rows per INSERT statement
+    :param max_workers: parser processes, defaults to one per CPU
+    :param vectorized: parse with NumPy, for large backfills
+    :param snapshot: rebuild the stock snapshot, False when the caller rebuilds it later
+    :return: number of weekly records written
+    """
+    tasks = [(farm_id, file) for farm_id, files in farm_files.items() for file in files]
+    files = [file for _, file in tasks]
+    parse = partial(parse_egg_csv_file, vectorized=vectorized)
+    if len(files) > 1 and max_workers != 1:
+        # imported here to keep process pool machinery out of the API's startup
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            parsed = list(executor.map(parse, files))
+    else:
+        parsed = [parse(file) for file in files]
+    farm_harvests = {
+        farm_id: merge_harvest_files(
+            rows for (task_farm, _), rows in zip(tasks, parsed) if task_farm == farm_id
+        )
+        for farm_id in farm_files
+    }
+    written = store_farm_harvests(farm_harvests, batch_size=batch_size)
+    db.session.commit()
+    if snapshot:
+        rebuild_snapshot()
+    return written
+
+
+def ingest_egg_csvs(
+    files: List[str],
+    batch_size: int = 1000,
+    max_workers: Optional[int] = None,
+    vectorized: bool = False,
+) -> int:
+    """Parse Full Spectrum Eggs' own CSVs in parallel and bulk upsert them, see ingest_farm_csvs.
+
+    :param files: csv paths, in date order
+    :param batch_size: rows per INSERT statement
+    :param max_workers: parser processes, defaults to one per CPU
+    :param vectorized: parse with NumPy, for large backfills
+    :return: number of weekly records written
+    """
+    return ingest_farm_csvs(
+        {HOME_FARM: files},
+        batch_size=batch_size,
+        max_workers=max_workers,
+        vectorized=vectorized,
+    )
+
+
+def _checkpoint_hash(window: bytes) -> str:
+    return hashlib.sha256(window).hexdigest()
+
+
+def _find_checkpoint(file: str) -> Optional[ImportCheckpoint]:
+    return ImportCheckpoint.query.filter_by(source=os.path.realpath(file)).first()
+
+
+def import_egg_csv_incrementally(file: str, batch_size: int = 1000) -> int:
+    """Import only the complete rows appended to an egg CSV since its last checkpoint.
+
+    The checkpoint stores the byte offset already read, a hash of the bytes just before it and
+    the last day imported. If the file no longer matches the hash it was rewritten, so it is
+    re-read from the start; the upsert keeps that idempotent. Weeks are re-summed from the
+    stored daily totals, so a partial week needs no state of its own. The caller commits.
+
+    :param file: csv path
+    :param batch_size: rows per INSERT statement
+    :return: number of weekly records written
+    """
+    checkpoint = _find_checkpoint(file)
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(source=os.path.realpath(file))
+        db.session.add(checkpoint)
+
+    with open(file, "rb") as f:
+        offset = checkpoint.byte_offset
+        f.seek(max(0, offset - CHECKPOINT_HASH_WINDOW))
+        window = f.read(offset - f.tell())
+        if offset and _checkpoint_hash(window) != checkpoint.content_hash:
+            log.warning(f"{file} changed before byte {offset}, re-importing it")
+            checkpoint.byte_offset = offset = 0
+            checkpoint.last_record_date = None
+            window = b""
+            f.seek(0)
+        appended = f.read()
+
+    # leave a trailing partial line for the next run
+    complete = appended[: appended.rfind(b"\n") + 1]
+    if not complete:
+        return 0
+    harvests = [
+        harvest
+        for harvest in iter_daily_harvest_csv(io.StringIO(complete.decode()))
+        if checkpoint.last_record_date is None
+        or harvest[0] > checkpoint.last_record_date
+    ]
+    written = store_harvests(harvests, batch_size=batch_size)
+
+    checkpoint.byte_offset = offset + len(complete)
+    checkpoint.content_hash = _checkpoint_hash(
+        (window + complete)[-CHECKPOINT_HASH_WINDOW:]
+    )
+    if harvests:
+        checkpoint.last_record_date = harvests[-1][0]
+    checkpoint.edited_at = datetime.utcnow()
+    return written
+
+
+def import_egg_csvs_incrementally(files: List[str], batch_size: int = 1000) -> int:
+    """Incrementally import egg CSVs in date order, committing once for all of them.
+
+    Weeks are re-summed from the stored daily totals, so weeks that span two files are summed
+    together. Once committed, the stock snapshot is rebuilt if the app has one.
+
+    :param files: csv paths, in date order
+    :param batch_size: rows per INSERT statement
+    :return: number of weekly records written
+    """
+    written = 0
+    for file in files:
+        written += import_egg_csv_incrementally(file, batch_size=batch_size)
+    db.session.commit()
+    rebuild_snapshot()
+    return written
+
+
 # exclude from coverage because only file opening is not covered by other unit tests
 def file_helper(files: List[str]) -> List[EggStockRecord]:  # pragma: no cover
-    db_records = []
+    """Weekly records of CSV files, parsed but not stored, so no snapshot goes stale.
+
+    The command line stores files with ingest_egg_csvs, which rebuilds the snapshot.
+    """
+    egg_records = []
     for file in files:
         with open(file) as f:
-            egg_records = read_daily_egg_csvs(f)
-            db_records += convert_daily_eggs_to_weekly_dozens(egg_records)
-    return db_records
+            egg_records += read_daily_egg_csvs(f)
+    # convert once, so weeks that span two files are summed together
+    return convert_daily_eggs_to_weekly_dozens(egg_records)
 
 
 # exclude from coverage
 if __name__ == "__main__":  # pragma: no cover
-    connect_to_db(app)
-    with app.app_context():
+    parser = argparse.ArgumentParser(description="Load Full Spectrum Eggs data")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="import only egg rows appended since the last run, without prompting",
+    )
+    parser.add_argument(
+        "--vectorized", action="store_true", help="parse CSVs with NumPy"
+    )
+    parser.add_argument(
+        "--farm",
+        action="append",
+        default=[],
+        metavar="FARM_ID=PATH",
+        help="ingest a farm's CSVs from a directory or glob, without prompting; "
+        "repeat for each farm",
+    )
+    parser.add_argument(
+        "--enqueue",
+        action="store_true",
+        help="queue the import for python -m api.jobs workers instead of running it",
+    )
+    parser.add_argument("files", nargs="*", default=EGG_CSV_FILES)
+    args = parser.parse_args()
+    from api.main import create_app
+
+    with create_app().app_context():
+        if args.enqueue:
+            from api.jobs import enqueue
+
+            # workers may run from another directory
+            if args.farm:
+                sources = dict(farm.split("=", 1) for farm in args.farm)
+                farms = {
+                    farm_id: [os.path.abspath(file) for file in files]
+                    for farm_id, files in farm_csv_files(sources).items()
+                }
+            else:
+                farms = {HOME_FARM: [os.path.abspath(file) for file in args.files]}
+            job = enqueue(
+                "ingest_csvs", {"farms": farms, "vectorized": args.vectorized}
+            )
+            db.session.commit()
+            print(f"Queued import job {job.id}")
+            raise SystemExit(0)
+        if args.farm:
+            sources = dict(farm.split("=", 1) for farm in args.farm)
+            written = ingest_farm_csvs(
+                farm_csv_files(sources), vectorized=args.vectorized
+            )
+            print(f"Upserted {written} weekly records")
+            raise SystemExit(0)
+        if args.incremental:
+            written = import_egg_csvs_incrementally(args.files)
+            print(f"Upserted {written} weekly records")
+            raise SystemExit(0)
         user_wants_custard = input("Recreate custard recipe? y/n ")
         user_wants_eggs = input("Recreate egg quantity records? y/n ")
         if user_wants_custard in "yY":
-            c = create_custard_recipe()
+            c = create_custard_recipe(db.session)
             db.session.add(c)
-        if user_wants_eggs in "yY":
-            r = file_helper(["2021.csv", "2022.csv", "2023.csv"])
-            db.session.add_all(r)
-            print(f"Committing {len(r)} new records")
         db.session.commit()
+        if user_wants_eggs in "yY":
+            written = ingest_egg_csvs(args.files, vectorized=args.vectorized)
+            print(f"Upserted {written} weekly records")
@@ -0,0 +1,225 @@
+"""NumPy implementations of the harvest CSV parsing and weekly rollup in data/load_data.py.
+
+Each file is decoded as one byte array: dates, counts and week buckets are computed with array
+operations instead of a Python loop per row. The list-returning functions produce the same
+output as their load_data counterparts. NumPy is optional: install it to use this module.
+"""
+
+from datetime import date
+from typing import Dict, List, Optional, TextIO, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+from api.model import EggStockRecord, date_bounds
+
+HARVEST_COLUMNS = ["pink", "brown", "blue", "total"]
+# widest count field decoded, in bytes
+MAX_FIELD_WIDTH = 9
+
+
+if np is not None:
+    IS_WHITESPACE = np.zeros(256, dtype=bool)
+    # what str.strip removes, short of the newline that ends the row
+    IS_WHITESPACE[
+        [ord(" "), ord("\t"), ord("\r"), 0x0B, 0x0C, 0x1C, 0x1D, 0x1E, 0x1F]
+    ] = True
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("numpy is required for the vectorized harvest parser")
+
+
+def _dates_from_digits(digits: "np.ndarray") -> "np.ndarray":
+    """Build datetime64[D] from an (n, 10) array of mm/dd/yyyy character codes."""
+    digits = digits.astype(np.int32) - ord("0")
+    month = digits[:, 0] * 10 + digits[:, 1]
+    day = digits[:, 3] * 10 + digits[:, 4]
+    year = digits[:, 6] * 1000 + digits[:, 7] * 100 + digits[:, 8] * 10 + digits[:, 9]
+    months = (year - 1970) * 12 + month - 1
+    return months.astype("M8[M]").astype("M8[D]") + (day - 1).astype("m8[D]")
+
+
+def parse_mdy_dates(values: "np.ndarray") -> "np.ndarray":
+    """Parse an array of zero-padded mm/dd/yyyy strings into datetime64[D] by digit position.
+
+    :param values: array of strings
+    :return: array of datetime64[D]
+    """
+    _require_numpy()
+    return _dates_from_digits(values.astype("U10").view(np.uint32).reshape(-1, 10))
+
+
+def _parse_int_fields(
+    padded: "np.ndarray",
+    starts: "np.ndarray",
+    ends: "np.ndarray",
+    signed: bool = False,
+    padding: bool = False,
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Parse the integer in padded[starts[i]:ends[i]] for every i at once.
+
+    Loops over character positions, not rows. A field of anything but digits, or of no digits
+    at all, is invalid, matching load_data: counts may have one leading minus sign and totals
+    may be padded with whitespace.
+
+    :param padded: file bytes followed by MAX_FIELD_WIDTH zero bytes
+    :param starts: first byte of each field
+    :param ends: byte after the last of each field
+    :param signed: allow one leading minus sign
+    :param padding: allow whitespace before and after the digits
+    :return: (values, valid)
+    """
+    values = np.zeros(len(starts), dtype=np.int64)
+    digit_count = np.zeros(len(starts), dtype=np.int32)
+    negative = np.zeros(len(starts), dtype=bool)
+    # whitespace seen after the digits, which must end the field
+    trailing = np.zeros(len(starts), dtype=bool)
+    lengths = ends - starts
+    valid = lengths <= MAX_FIELD_WIDTH
+    for offset in range(min(MAX_FIELD_WIDTH, int(lengths.max(initial=0)))):
+        inside = offset < lengths
+        char = padded[starts + offset]
+        is_digit = inside & (char >= ord("0")) & (char <= ord("9"))
+        is_minus = inside & (char == ord("-")) & (signed and offset == 0)
+        is_space = inside & IS_WHITESPACE[char] & padding
+        values = np.where(is_digit, values * 10 + (char - ord("0")), values)
+        negative |= is_minus
+        valid &= ~inside | is_digit | is_minus | is_space
+        valid &= ~(is_digit & trailing)
+        digit_count += is_digit
+        trailing |= is_space & (digit_count > 0)
+    valid &= digit_count > 0
+    return np.where(negative, -values, values), valid
+
+
+def read_daily_harvest_arrays(
+    filestream: TextIO,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> Dict[str, "np.ndarray"]:
+    """Parse an egg CSV into typed columns without a Python loop over its rows.
+
+    The file is read as one byte array. Line and comma positions are found with array searches,
+    then the date and count fields of every row are decoded together. Rows are kept or skipped
+    by the same rules as load_data.iter_daily_harvest_csv.
+
+    :param filestream: opened csv file
+    :param start_date: date of the earliest record to be included, defaults to no lower bound
+    :param end_date: date of the latest record to be included, defaults to today
+    :return: {"date": datetime64[D], "pink", "brown", "blue", "total": int32} arrays
+    """
+    _require_numpy()
+    start_date, end_date = date_bounds(start_date, end_date)
+    buffer = np.frombuffer(filestream.read().encode(), dtype=np.uint8)
+    padded = np.concatenate([buffer, np.zeros(MAX_FIELD_WIDTH, dtype=np.uint8)])
+
+    newlines = np.flatnonzero(buffer == ord("\n"))
+    starts = np.concatenate([[0], newlines + 1])
+    ends = np.concatenate([newlines, [len(buffer)]])
+    # skip the header and blank lines: data rows start with a digit
+    first_chars = padded[np.minimum(starts, len(buffer))]
+    rows = (first_chars >= ord("0")) & (first_chars <= ord("9")) & (ends - starts >= 10)
+    starts, ends = starts[rows], ends[rows]
+
+    # field j runs from after the line's (j-1)th comma to its jth comma or the line end
+    commas = np.flatnonzero(buffer == ord(","))
+    first_comma = np.searchsorted(commas, starts)
+    padded_commas = np.concatenate([commas, [len(buffer)]])
+    separators = [starts - 1]
+    for j in range(len(HARVEST_COLUMNS) + 1):
+        comma = padded_commas[np.minimum(first_comma + j, len(commas))]
+        separators.append(np.minimum(comma, ends))
+    # like iter_daily_harvest_csv, counts may be negative and totals may be padded
+    fields = {
+        name: _parse_int_fields(
+            padded,
+            np.minimum(separators[j] + 1, ends),
+            separators[j + 1],
+            signed=name != "total",
+            padding=name == "total",
+        )
+        for j, name in enumerate(HARVEST_COLUMNS, start=1)
+    }
+
+    dates = _dates_from_digits(padded[starts[:, None] + np.arange(10)])
+    total, total_valid = fields["total"]
+    keep = (
+        total_valid
+        & (dates >= np.datetime64(start_date, "D"))
+        & (dates <= np.datetime64(end_date, "D"))
+    )
+    columns = {"date": dates[keep]}
+    for name in HARVEST_COLUMNS:
+        values, valid = fields[name]
+        columns[name] = np.where(valid, values, 0)[keep].astype(np.int32)
+    return columns
+
+
+def weekly_dozens_arrays(
+    dates: "np.ndarray", quantities: "np.ndarray"
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Sum daily quantities into weeks ending on Monday, rounded down to dozens.
+
+    Same semantics as load_data.sum_weekly_dozens: each Monday closes the week made of every
+    row since the previous Monday, and rows after the last Monday are left out.
+
+    :param dates: datetime64[D] array in date order
+    :param quantities: integer array, one per date
+    :return: Monday dates and dozens per week
+    """
+    _require_numpy()
+    # 1970-01-01 was a Thursday, so Mondays are 4 days after a multiple of 7
+    is_monday = (dates.astype(np.int64) - 4) % 7 == 0
+    week = np.cumsum(is_monday) - is_monday
+    mondays = int(is_monday.sum())
+    sums = np.bincount(week, weights=quantities, minlength=mondays + 1).astype(np.int64)
+    return dates[is_monday], sums[:mondays] // 12
+
+
+def read_daily_egg_csvs(
+    filestream: TextIO,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> List[Tuple[date, int]]:
+    """Vectorized load_data.read_daily_egg_csvs."""
+    columns = read_daily_harvest_arrays(filestream, start_date, end_date)
+    return list(zip(columns["date"].tolist(), columns["total"].tolist()))
+
+
+def read_daily_harvests(
+    filestream: TextIO,
+    start_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+) -> List[Tuple[date, int, int, int, int]]:
+    """Vectorized list(load_data.iter_daily_harvest_csv(...))."""
+    columns = read_daily_harvest_arrays(filestream, start_date, end_date)
+    return list(
+        zip(
+            columns["date"].tolist(),
+            *(columns[name].tolist() for name in HARVEST_COLUMNS),
+        )
+    )
+
+
+def sum_weekly_dozens(records: List[Tuple[date, int]]) -> List[Tuple[date, int]]:
+    """Vectorized load_data.sum_weekly_dozens."""
+    _require_numpy()
+    dates = np.array([record[0] for record in records], dtype="M8[D]")
+    quantities = np.array([record[1] for record in records], dtype=np.int64)
+    mondays, dozens = weekly_dozens_arrays(dates, quantities)
+    return list(zip(mondays.tolist(), dozens.tolist()))
+
+
+def convert_daily_eggs_to_weekly_dozens(
+    records: List[Tuple[date, int]],
+) -> List[EggStockRecord]:
+    """Vectorized load_data.convert_daily_eggs_to_weekly_dozens."""
+    weekly_records = sum_weekly_dozens(records)
+    return [
+        EggStockRecord(record_date=record_date, quantity=quantity)
+        for record_date, quantity in weekly_records
+    ]
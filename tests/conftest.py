@@ -0,0 +1,39 @@
+import pytest
+from sqlalchemy import event
+
+from api.main import create_app
+from api.model import db
+
+
+@pytest.fixture(scope="session", autouse=True)
+def app():
+    """The app on an in-memory SQLite stand-in for the postgres dev database."""
+    application = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite://"})
+    with application.app_context():
+        yield application
+
+
+@pytest.fixture(scope="session")
+def database(app):
+    return db
+
+
+@pytest.fixture()
+def db_session(database):
+    database.create_all()
+    yield database.session
+    database.session.remove()
+    database.drop_all()
+
+
+@pytest.fixture()
+def query_counter(database):
+    """Count the SQL statements sent to the database while the test runs."""
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(database.engine, "before_cursor_execute", count)
+    yield statements
+    event.remove(database.engine, "before_cursor_execute", count)
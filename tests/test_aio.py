@@ -0,0 +1,101 @@
+import asyncio
+import datetime
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("aiosqlite")
+
+from aiohttp.test_utils import TestClient, TestServer
+from sqlalchemy.pool import StaticPool
+
+from api.aio import ROUTES, async_database_uri, create_app, json_provider
+from api.model import EggStockRecord, db
+from api.queries import load_recipes_json
+from data.load_data import create_custard_recipe
+
+
+def test_async_database_uri():
+    assert (
+        async_database_uri("postgresql:///fullspectrum-dev")
+        == "postgresql+asyncpg:///fullspectrum-dev"
+    )
+    assert async_database_uri("sqlite://") == "sqlite+aiosqlite://"
+
+
+def seed(session):
+    session.add(create_custard_recipe())
+    session.add_all(
+        EggStockRecord(
+            record_date=datetime.date(2021, 1, 4) + datetime.timedelta(weeks=week),
+            quantity=week,
+        )
+        for week in range(3)
+    )
+    session.commit()
+    return json_provider.encode(load_recipes_json(session))
+
+
+def test_async_routes():
+    async def run():
+        application = create_app(
+            "sqlite://",
+            {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}},
+        )
+        async with application["engine"].begin() as conn:
+            await conn.run_sync(db.metadata.create_all)
+        async with application["sessionmaker"]() as session:
+            expected_recipes = await session.run_sync(seed)
+
+        async with TestClient(TestServer(application)) as client:
+            response = await client.get("/api/recipes")
+            assert response.status == 200
+            assert await response.read() == expected_recipes
+
+            recipe_id = (await response.json())[0]["id"]
+            response = await client.get(f"/api/recipe/{recipe_id}")
+            assert (await response.json())["name"] == "Custard Pudding (Steamed)"
+            assert (await client.get("/api/recipe/not-a-uuid")).status == 404
+            response = await client.get(f"/api/recipes?ids={recipe_id},{recipe_id}")
+            assert [recipe["id"] for recipe in await response.json()] == [recipe_id]
+            # repeated ids arguments are read as in api/main.py
+            response = await client.get(f"/api/recipes?ids=&ids={recipe_id}")
+            assert [recipe["id"] for recipe in await response.json()] == [recipe_id]
+            response = await client.get(f"/api/recipes?ids={recipe_id}&ids=nope")
+            assert response.status == 400
+
+            response = await client.get("/api/egg-stock-records?limit=2")
+            assert [r["quantity"] for r in await response.json()] == [0, 1]
+            assert "after=2021-01-11" in response.headers["Link"]
+            response = await client.get("/api/egg-stock-records?start=nope")
+            assert response.status == 400
+
+            response = await client.get("/api/stock/history?granularity=month")
+            assert await response.json() == []
+
+            # the rest of api/main.py is left to the Flask app
+            for path in ["/api/stock", "/api/stock/forecast", "/api/recipes/search"]:
+                assert (await client.get(path)).status == 404
+
+    asyncio.run(run())
+
+
+def test_async_routes_are_the_documented_subset():
+    application = create_app("sqlite://")
+    served = {
+        route.resource.canonical
+        for route in application.router.routes()
+        if route.method == "GET"
+    }
+    assert (
+        served
+        == {path for path, _ in ROUTES}
+        == {
+            "/api/",
+            "/api/about",
+            "/api/egg-stock-records",
+            "/api/recipe/{recipe_id}",
+            "/api/recipes",
+            "/api/stock/history",
+        }
+    )
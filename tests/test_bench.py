@@ -0,0 +1,73 @@
+from bench.startup import cold_start
+from bench.suite import compare, percentile, run_suite
+
+TINY_SCALE = {"recipes": 5, "stock_rows": 20, "harvest_days": 30, "csv_days": 60}
+
+
+def metrics(p50_ms=1.0, p95_ms=2.0, queries=1):
+    return {
+        "throughput": 1000 / p50_ms,
+        "p50_ms": p50_ms,
+        "p95_ms": p95_ms,
+        "p99_ms": p95_ms,
+        "queries": queries,
+    }
+
+
+def test_percentile():
+    values = list(range(1, 101))
+
+    assert percentile(values, 50) == 50
+    assert percentile(values, 95) == 95
+    assert percentile(values, 99) == 99
+    assert percentile([7], 99) == 7
+
+
+def test_compare_within_tolerance():
+    baselines = {"GET /api/stock": metrics(p50_ms=10.0, p95_ms=20.0)}
+    results = {"GET /api/stock": metrics(p50_ms=14.0, p95_ms=35.0)}
+
+    assert compare(results, baselines, tolerance=0.5, slack_ms=0) == []
+
+
+def test_compare_reports_regressions():
+    baselines = {
+        "GET /api/stock": metrics(p50_ms=10.0),
+        "GET /api/recipes": metrics(queries=2),
+        "load_data.ingest": metrics(),
+    }
+    results = {
+        "GET /api/stock": metrics(p50_ms=16.0),
+        "GET /api/recipes": metrics(queries=3),
+    }
+
+    assert compare(results, baselines, tolerance=0.5, slack_ms=0) == [
+        "GET /api/stock: p50_ms 16.0 > baseline 10.0",
+        "GET /api/recipes: 3 queries > baseline 2",
+        "load_data.ingest: missing from results",
+    ]
+
+
+def test_run_suite_covers_routes_and_pipeline(app, db_session):
+    app.config.update({"TESTING": True, "RESPONSE_CACHE_ENABLED": False})
+
+    results = run_suite(app.test_client(), TINY_SCALE, repeat=2)
+
+    assert results["GET /api/recipes"]["queries"] == 2
+    assert results["GET /api/egg-stock-records"]["queries"] == 1
+    assert results["GET /api/about"]["queries"] == 0
+    # without a snapshot file the series are summed and listed by the database
+    assert (
+        results["GET /api/stock/series?series=harvests&start=<year ago>"]["queries"]
+        == 2
+    )
+    assert results["GET /api/egg-stock-records/export?start=<year ago>"]["queries"] == 1
+    assert {"load_data.parse", "load_data.ingest"} <= set(results)
+    assert all(result["p50_ms"] <= result["p99_ms"] for result in results.values())
+
+
+def test_cold_start():
+    result = cold_start()
+
+    assert result["status"] == 200
+    assert 0 < result["import_ms"] < result["process_ms"]
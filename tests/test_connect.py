@@ -0,0 +1,93 @@
+import os
+import tempfile
+
+import pytest
+from flask import Flask
+from sqlalchemy import update
+
+from api import model
+from api.metrics import pool_metrics
+from api.model import Inventory, connect_to_db, db, engine_options_from_env
+
+
+def test_engine_options_from_env():
+    environ = {
+        "DB_POOL_SIZE": "20",
+        "DB_MAX_OVERFLOW": "5",
+        "DB_POOL_PRE_PING": "true",
+        "DB_STATEMENT_TIMEOUT_MS": "2000",
+    }
+    options = engine_options_from_env("postgresql:///fullspectrum-dev", environ)
+    assert options == {
+        "pool_size": 20,
+        "max_overflow": 5,
+        "pool_pre_ping": True,
+        "connect_args": {"options": "-c statement_timeout=2000"},
+    }
+    options = engine_options_from_env("postgresql+asyncpg:///db", environ)
+    assert options["connect_args"] == {"server_settings": {"statement_timeout": "2000"}}
+    assert "connect_args" not in engine_options_from_env("sqlite://", environ)
+    assert engine_options_from_env("sqlite://", {}) == {}
+
+
+@pytest.fixture()
+def replicated_app():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        primary, *replicas = [
+            f"sqlite:///{os.path.join(tmpdir, name)}.db"
+            for name in ["primary", "replica_a", "replica_b"]
+        ]
+        application = Flask(__name__)
+        connect_to_db(application, primary, replicas)
+        with application.app_context():
+            yield application
+            db.session.remove()
+            for engine in db.engines.values():
+                engine.dispose()
+        # init_app registered (empty) metadata for the replica binds on the shared db
+        for key in [key for key in db.metadatas if key]:
+            del db.metadatas[key]
+
+
+def test_reads_in_get_requests_go_to_replicas(replicated_app):
+    primary = db.engines[None]
+    with replicated_app.test_request_context(method="POST"):
+        assert db.session.get_bind() is primary
+    with replicated_app.test_request_context(method="GET"):
+        first = db.session.get_bind()
+        assert first is not primary
+        # the replica is pinned for the rest of the request
+        assert db.session.get_bind() is first
+        # writes issued as Core statements still go to the primary
+        assert db.session.get_bind(clause=update(Inventory)) is primary
+        db.session.remove()
+    with replicated_app.test_request_context(method="GET"):
+        assert db.session.get_bind() not in (primary, first)
+        db.session.remove()
+    assert db.session.get_bind() is primary
+
+
+def test_pool_metrics(replicated_app):
+    with db.engines[None].connect():
+        metrics = pool_metrics()
+    assert 'db_pool_checked_out{engine="primary"} 1' in metrics
+    assert 'db_pool_checked_out{engine="replica_1"} 0' in metrics
+    assert "# TYPE db_pool_overflow gauge" in metrics
+
+
+def test_connect_to_db_tracks_apps_for_the_fork_hook(replicated_app, monkeypatch):
+    registered = []
+    monkeypatch.setattr(
+        os, "register_at_fork", lambda **hooks: registered.append(hooks)
+    )
+    other = Flask(__name__)
+    connect_to_db(other, "sqlite://", [])
+    # the module level hook covers every app without registering another
+    assert registered == []
+    assert {replicated_app, other} <= set(model._connected_apps)
+    disposed = []
+    monkeypatch.setattr(
+        type(db.engines[None]), "dispose", lambda engine, close: disposed.append(close)
+    )
+    model._reset_pools_after_fork()
+    assert disposed and not any(disposed)
@@ -0,0 +1,89 @@
+from datetime import date, timedelta
+
+import pytest
+
+from api import forecast
+from api.model import HarvestForecast
+from data.load_data import store_harvests
+
+pytestmark = pytest.mark.skipif(
+    not forecast.FORECASTING, reason="numpy is not installed"
+)
+
+
+def daily_harvests(first_day, days, total=24):
+    return [(first_day + timedelta(days=day), 0, 0, 0, total) for day in range(days)]
+
+
+def test_smooth_matches_day_by_day_updates():
+    values = forecast.np.array([10.0, 12.0, 0.0, 30.0, 8.0])
+    weights = forecast.np.array([0.2, 0.2, 0.0, 0.2, 0.2])
+    level = 5.0
+    for value, weight in zip(values, weights):
+        level = weight * value + (1 - weight) * level
+    assert forecast._smooth(5.0, values, weights) == pytest.approx(level)
+
+
+def test_update_forecast_incrementally_keeps_season_sums():
+    harvests = [
+        (day, 10 + day.month) for day, *_, _ in daily_harvests(date(2022, 1, 1), 400)
+    ]
+    whole = forecast.update_forecast(forecast.empty_parameters(), harvests)
+    halves = forecast.update_forecast(
+        forecast.update_forecast(forecast.empty_parameters(), harvests[:200]),
+        harvests[200:],
+    )
+    for parameter in ["first_date", "last_date", "days", "week_total", "season_counts"]:
+        assert halves[parameter] == whole[parameter]
+    assert halves["season_sums"] == pytest.approx(whole["season_sums"])
+
+
+def test_stock_forecast_updated_by_imports(app, db_session, query_counter):
+    # the first import ends on Monday 2023-01-02, which closes a full week
+    store_harvests(daily_harvests(date(2022, 12, 1), 33))
+    db_session.commit()
+    fitted = db_session.query(HarvestForecast).one()
+    assert (fitted.days, fitted.last_date, fitted.week_total) == (
+        33,
+        date(2023, 1, 2),
+        7 * 24,
+    )
+
+    # the second ends on a Saturday, five days into the next week
+    store_harvests(daily_harvests(date(2023, 1, 3), 5))
+    db_session.commit()
+    fitted = db_session.query(HarvestForecast).one()
+    assert (fitted.days, fitted.first_date) == (38, date(2022, 12, 1))
+    assert fitted.level == pytest.approx(24)
+
+    client = app.test_client()
+    app.config["RESPONSE_CACHE_ENABLED"] = False
+    query_counter.clear()
+    response = client.get("/api/stock/forecast?weeks=2")
+    app.config["RESPONSE_CACHE_ENABLED"] = True
+    assert response.status_code == 200
+    assert len(query_counter) == 1
+    weeks = response.json["weeks"]
+    assert [week["harvested"] for week in weeks] == [5 * 24, 0]
+    assert [week["dozens"] for week in weeks] == [14, 14]
+
+
+def test_stock_forecast_before_any_import(app, db_session):
+    app.config["RESPONSE_CACHE_ENABLED"] = False
+    response = app.test_client().get("/api/stock/forecast")
+    app.config["RESPONSE_CACHE_ENABLED"] = True
+    assert response.status_code == 404
+
+
+def test_stock_forecast_refit_keeps_days_after_rewritten_ones(db_session):
+    store_harvests(daily_harvests(date(2022, 1, 3), 60))
+    db_session.commit()
+    fitted = db_session.query(HarvestForecast).one()
+    assert (fitted.days, fitted.last_date) == (60, date(2022, 3, 3))
+
+    # re-importing the first week rewrites fitted days
+    store_harvests(daily_harvests(date(2022, 1, 3), 7, total=30))
+    db_session.commit()
+    db_session.refresh(fitted)
+    assert (fitted.days, fitted.last_date) == (60, date(2022, 3, 3))
+    assert fitted.season_sums[0] == 5 * 30
@@ -0,0 +1,86 @@
+import os
+import tempfile
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from flask import Flask
+from sqlalchemy import func, select, update
+
+from api import inventory
+from api.aggregates import upsert_weekly_dozens
+from api.model import EggStockRecord, Inventory, Reservation, connect_to_db, db
+
+
+@pytest.fixture()
+def file_app():
+    """An app on a SQLite file, so concurrent checkouts use separate connections."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        application = Flask(__name__)
+        connect_to_db(
+            application,
+            f"sqlite:///{os.path.join(tmpdir, 'inventory.db')}",
+        )
+        with application.app_context():
+            db.create_all()
+            db.session.add(EggStockRecord(record_date=date(2023, 1, 2), quantity=20))
+            db.session.commit()
+            inventory.inventory_counter.clear()
+            yield application
+            inventory.inventory_counter.clear()
+            db.session.remove()
+            db.engine.dispose()
+
+
+def test_concurrent_reservations_do_not_oversell(file_app):
+    def checkout(_):
+        with file_app.app_context():
+            reservation, _ = inventory.reserve(1)
+            db.session.remove()
+            return reservation is not None
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(checkout, range(50)))
+
+    assert results.count(True) == 20
+    assert inventory.refresh() == 0
+    held = db.session.scalar(select(func.sum(Reservation.quantity)))
+    assert held == 20
+
+
+def test_stock_record_writes_restock_inventory(file_app):
+    reservation, left = inventory.reserve(5)
+    assert left == 15
+    # a new week of 30 dozen comes in while the reservation is held
+    upsert_weekly_dozens([(date(2023, 1, 9), 30)])
+    db.session.commit()
+    assert inventory.available() == 25
+    assert inventory.refresh() == 25
+    # rewriting a past week leaves the latest alone
+    upsert_weekly_dozens([(date(2023, 1, 2), 40)])
+    db.session.commit()
+    assert inventory.refresh() == 25
+    assert inventory.release(reservation.id) == 30
+
+
+def test_restock_sets_counter_only_once_committed(file_app):
+    assert inventory.available() == 20
+    upsert_weekly_dozens([(date(2023, 1, 9), 30)])
+    db.session.rollback()
+    assert inventory.available() == 20
+
+    upsert_weekly_dozens([(date(2023, 1, 9), 30)])
+    assert inventory.available() == 20
+    db.session.commit()
+    assert inventory.available() == 30
+
+
+def test_counter_expires_to_see_other_processes(file_app, monkeypatch):
+    assert inventory.available() == 20
+    # another process restocks the row
+    db.session.execute(update(Inventory).values(available=Inventory.available + 7))
+    db.session.commit()
+    assert inventory.available() == 20
+
+    monkeypatch.setattr(inventory.inventory_counter, "ttl_seconds", 0)
+    assert inventory.available() == 27
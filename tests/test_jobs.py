@@ -0,0 +1,167 @@
+import datetime
+
+import pytest
+from sqlalchemy import select
+
+from api import jobs
+from api.cache import LRUBackend, response_cache
+from api.model import EggStockRecord, FarmHarvest, HarvestAggregate, Job
+
+
+@pytest.fixture()
+def client(app):
+    app.config.update({"TESTING": True, "RESPONSE_CACHE_ENABLED": False})
+    yield app.test_client()
+    app.config["RESPONSE_CACHE_ENABLED"] = True
+
+
+def write_csv(path, rows):
+    path.write_text(
+        "Date,Pink,Brown,Blue,Total Harvested\n"
+        + "".join(f"{day:%m/%d/%Y},0,0,0,{total},\n" for day, total in rows)
+    )
+    return str(path)
+
+
+def test_ingest_job_imports_files_with_progress(db_session, tmp_path):
+    first = write_csv(
+        tmp_path / "a.csv",
+        [(datetime.date(2021, 12, 27), 24), (datetime.date(2021, 12, 30), 12)],
+    )
+    second = write_csv(tmp_path / "b.csv", [(datetime.date(2022, 1, 3), 12)])
+    job = jobs.enqueue("ingest_csvs", {"files": [first, second]})
+    db_session.commit()
+
+    assert jobs.work(once=True) == 1
+
+    job = db_session.get(Job, job.id)
+    assert (job.status, job.attempts) == (jobs.SUCCEEDED, 1)
+    assert (job.progress_done, job.progress_total) == (2, 2)
+    # the week ending 2022-01-03 spans both files
+    records = db_session.execute(
+        select(EggStockRecord.record_date, EggStockRecord.quantity).order_by(
+            EggStockRecord.record_date
+        )
+    ).all()
+    assert records == [
+        (datetime.date(2021, 12, 27), 2),
+        (datetime.date(2022, 1, 3), 2),
+    ]
+
+
+def test_refresh_aggregates_job(db_session):
+    db_session.add_all(
+        FarmHarvest("acme", datetime.date(2023, 1, day), 0, 0, 0, 12)
+        for day in range(1, 4)
+    )
+    db_session.commit()
+    job = jobs.enqueue("refresh_aggregates")
+    db_session.commit()
+
+    jobs.work(once=True)
+
+    assert db_session.get(Job, job.id).status == jobs.SUCCEEDED
+    month = db_session.scalars(
+        select(HarvestAggregate).where(HarvestAggregate.granularity == "month")
+    ).one()
+    assert (month.days, month.total) == (3, 36)
+
+
+def test_failed_job_retried_then_failed(db_session, monkeypatch):
+    calls = []
+
+    def flaky(payload, progress):
+        calls.append(payload)
+        if len(calls) == 1:
+            raise RuntimeError("database went away")
+        return "done"
+
+    monkeypatch.setitem(jobs.HANDLERS, "flaky", flaky)
+    monkeypatch.setattr(jobs, "RETRY_BACKOFF", 0)
+    retried = jobs.enqueue("flaky", {"n": 1})
+    db_session.commit()
+
+    assert jobs.work(once=True) == 2
+    retried = db_session.get(Job, retried.id)
+    assert (retried.status, retried.attempts, retried.message) == (
+        jobs.SUCCEEDED,
+        2,
+        "done",
+    )
+
+    monkeypatch.setitem(jobs.HANDLERS, "flaky", lambda payload, progress: 1 / 0)
+    failed = jobs.enqueue("flaky", max_attempts=2)
+    db_session.commit()
+    jobs.work(once=True)
+    failed = db_session.get(Job, failed.id)
+    assert (failed.status, failed.attempts) == (jobs.FAILED, 2)
+    assert failed.error.startswith("ZeroDivisionError")
+
+
+def test_claimed_job_not_claimed_twice(db_session):
+    job = jobs.enqueue("warm_caches")
+    db_session.commit()
+
+    assert jobs.claim_job("worker 1").id == job.id
+    assert jobs.claim_job("worker 2") is None
+
+
+def test_stale_running_job_requeued(db_session):
+    job = jobs.enqueue("warm_caches")
+    db_session.commit()
+    jobs.claim_job("lost worker")
+
+    later = datetime.datetime.utcnow() + jobs.STALE_AFTER * 2
+    assert jobs.requeue_stale(now=later) == 1
+    job = db_session.get(Job, job.id)
+    assert (job.status, job.worker) == (jobs.QUEUED, None)
+
+
+@pytest.fixture()
+def shared_backend(monkeypatch):
+    backend = LRUBackend()
+    backend.shared = True
+    monkeypatch.setattr(response_cache, "backend", backend)
+    return backend
+
+
+def test_create_and_get_job(app, client, db_session, shared_backend):
+    response = client.post("/api/jobs", json={"kind": "warm_caches"})
+    assert response.status_code == 202
+    assert response.json["status"] == jobs.QUEUED
+
+    app.config["RESPONSE_CACHE_ENABLED"] = True
+    jobs.work(once=True)
+    response = client.get(response.headers["Location"])
+    assert response.status_code == 200
+    assert response.json["status"] == jobs.SUCCEEDED
+    assert response.json["progress_done"] == len(jobs.WARM_PATHS)
+    # the forecast is 404 until harvests are imported, and errors are not cached
+    assert shared_backend.get("/api/recipes?") is not None
+
+
+def test_warm_caches_needs_a_shared_backend(client, db_session):
+    response = client.post("/api/jobs", json={"kind": "warm_caches"})
+    assert response.status_code == 400
+    assert db_session.query(Job).count() == 0
+
+    # a job queued from the command line does nothing
+    job = jobs.enqueue("warm_caches")
+    db_session.commit()
+    jobs.work(once=True)
+    job = db_session.get(Job, job.id)
+    assert (job.status, job.progress_done) == (jobs.SUCCEEDED, 0)
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"kind": "ingest_csvs", "payload": {"files": ["/etc/passwd"]}},
+        {"kind": "warm_caches", "payload": []},
+        {"kind": "warm_caches", "max_attempts": 0},
+        {"kind": "refresh_aggregates", "payload": {"start": "garbage"}},
+        {"kind": "refresh_aggregates", "payload": {"end": 20230101}},
+    ],
+)
+def test_create_job_rejects_bad_body(client, db_session, body):
+    assert client.post("/api/jobs", json=body).status_code == 400
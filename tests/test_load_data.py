@@ -1,12 +1,32 @@
 import datetime
 import io
+import os
+import tempfile
 import unittest
 
-from api.model import Recipe, RecipeIngredient, EggStockRecord
+from api.model import (
+    HOME_FARM,
+    AbstractIngredient,
+    DailyHarvest,
+    EggStockRecord,
+    FarmHarvest,
+    ImportCheckpoint,
+    Recipe,
+    RecipeIngredient,
+    db,
+)
 from data.load_data import (
     create_custard_recipe,
+    farm_csv_files,
+    import_egg_csvs_incrementally,
+    ingest_egg_csvs,
+    ingest_farm_csvs,
+    iter_daily_egg_csv,
+    parse_mdy_date,
     read_daily_egg_csvs,
     convert_daily_eggs_to_weekly_dozens,
+    store_harvests,
+    sum_weekly_dozens,
 )
 
 
@@ -58,3 +78,144 @@ class LoadDataTests(unittest.TestCase):
         record_0524 = db_records[-1]
         self.assertEqual(record_0524.record_date, datetime.date(2021, 5, 24))
         self.assertEqual(record_0524.quantity, 6)
+
+    def test_parse_mdy_date(self):
+        self.assertEqual(parse_mdy_date("05/04/2023"), datetime.date(2023, 5, 4))
+
+    def test_iter_daily_egg_csv_skips_header_and_missing_totals(self):
+        s = "Date,Pink,Brown,Blue,Total Harvested,Broken/ Etc\n05/04/2023,,-0,-0,0,\n05/05/2023,,,,,\n"
+        records = iter_daily_egg_csv(io.StringIO(s))
+        self.assertTupleEqual(next(records), (datetime.date(2023, 5, 4), 0))
+        self.assertIsNone(next(records, None))
+
+    def test_sum_weekly_dozens_leaves_out_partial_week(self):
+        records = [
+            (datetime.date(2021, 5, 16), 12),
+            (datetime.date(2021, 5, 17), 12),
+            (datetime.date(2021, 5, 18), 13),
+        ]
+        weekly = sum_weekly_dozens(records)
+        self.assertListEqual(weekly, [(datetime.date(2021, 5, 17), 2)])
+
+
+class IngestEggCsvsTests(unittest.TestCase):
+    def setUp(self):
+        db.create_all()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.files = []
+        for name, s in [
+            (
+                "2021.csv",
+                "Date,Pink,Brown,Blue,Total Harvested\n12/26/2021,1,5,6,12,\n12/27/2021,1,5,6,12,\n12/31/2021,1,5,6,12,\n",
+            ),
+            (
+                "2022.csv",
+                "Date,Pink,Brown,Blue,Total Harvested\n01/01/2022,1,5,6,12,\n01/03/2022,1,5,6,12,\n",
+            ),
+        ]:
+            path = os.path.join(self.tmpdir.name, name)
+            with open(path, "w") as f:
+                f.write(s)
+            self.files.append(path)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.tmpdir.cleanup()
+
+    def test_create_custard_recipe_reuses_ingredients(self):
+        db.session.add(create_custard_recipe(db.session))
+        db.session.commit()
+        db.session.add(create_custard_recipe(db.session))
+        db.session.commit()
+        self.assertEqual(Recipe.query.count(), 2)
+        self.assertEqual(AbstractIngredient.query.count(), 4)
+
+    def test_ingest_egg_csvs_spans_files_and_is_idempotent(self):
+        self.assertEqual(ingest_egg_csvs(self.files, max_workers=2), 2)
+        self.assertEqual(ingest_egg_csvs(self.files, batch_size=1), 2)
+        records = EggStockRecord.query.order_by(EggStockRecord.record_date).all()
+        self.assertListEqual(
+            [(r.record_date, r.quantity) for r in records],
+            [(datetime.date(2021, 12, 27), 2), (datetime.date(2022, 1, 3), 3)],
+        )
+
+    def write_partner_files(self):
+        partner_dir = os.path.join(self.tmpdir.name, "acme")
+        os.mkdir(partner_dir)
+        for name, s in [
+            (
+                "b.csv",
+                "Date,Pink,Brown,Blue,Total Harvested\n01/02/2022,1,5,6,12,\n01/03/2022,1,5,6,12,\n",
+            ),
+            (
+                "a.csv",
+                "Date,Pink,Brown,Blue,Total Harvested\n12/27/2021,2,10,12,24,\n12/30/2021,1,5,6,12,\n",
+            ),
+        ]:
+            with open(os.path.join(partner_dir, name), "w") as f:
+                f.write(s)
+        return partner_dir
+
+    def test_ingest_farm_csvs_sums_farms_across_file_boundaries(self):
+        farm_files = farm_csv_files({"acme": self.write_partner_files()})
+        self.assertListEqual(
+            [os.path.basename(file) for file in farm_files["acme"]], ["a.csv", "b.csv"]
+        )
+        farm_files[HOME_FARM] = self.files
+        self.assertEqual(ingest_farm_csvs(farm_files, max_workers=2), 2)
+        expected = [(datetime.date(2021, 12, 27), 4), (datetime.date(2022, 1, 3), 6)]
+        self.assertListEqual(self.weekly_records(), expected)
+        self.assertEqual(FarmHarvest.query.count(), 9)
+        monday = DailyHarvest.query.filter_by(harvest_date=datetime.date(2021, 12, 27))
+        self.assertEqual(monday.one().total, 36)
+
+        # reloading one farm keeps the other farm's eggs in the totals
+        del farm_files[HOME_FARM]
+        self.assertEqual(ingest_farm_csvs(farm_files, max_workers=1), 2)
+        self.assertListEqual(self.weekly_records(), expected)
+
+    def test_farm_csv_files_requires_matches(self):
+        with self.assertRaises(FileNotFoundError):
+            farm_csv_files({"acme": os.path.join(self.tmpdir.name, "*.txt")})
+
+    def weekly_records(self):
+        records = EggStockRecord.query.order_by(EggStockRecord.record_date).all()
+        return [(r.record_date, r.quantity) for r in records]
+
+    def test_import_egg_csvs_incrementally_reads_only_appended_rows(self):
+        self.assertEqual(import_egg_csvs_incrementally(self.files), 2)
+        self.assertEqual(import_egg_csvs_incrementally(self.files), 0)
+        with open(self.files[1], "a") as f:
+            f.write("01/09/2022,1,5,6,12,\n01/10/2022,1,5,6,24,\n01/11/2022,1")
+        self.assertEqual(import_egg_csvs_incrementally(self.files), 1)
+        self.assertListEqual(
+            self.weekly_records(),
+            [
+                (datetime.date(2021, 12, 27), 2),
+                (datetime.date(2022, 1, 3), 3),
+                (datetime.date(2022, 1, 10), 3),
+            ],
+        )
+        checkpoint = ImportCheckpoint.query.filter_by(
+            source=os.path.realpath(self.files[1])
+        ).first()
+        self.assertEqual(checkpoint.last_record_date, datetime.date(2022, 1, 10))
+
+    def test_store_harvests_resums_weeks_with_other_farms(self):
+        import_egg_csvs_incrementally(self.files)
+        # a partner's Sunday lands in the week the home farm's files already wrote
+        store_harvests([(datetime.date(2022, 1, 2), 0, 0, 0, 24)], farm_id="acme")
+        db.session.commit()
+        self.assertEqual(self.weekly_records()[-1], (datetime.date(2022, 1, 3), 5))
+
+    def test_import_egg_csvs_incrementally_rereads_rewritten_file(self):
+        import_egg_csvs_incrementally(self.files)
+        with open(self.files[1], "w") as f:
+            f.write(
+                "Date,Pink,Brown,Blue,Total Harvested\n"
+                "01/01/2022,1,5,6,12,\n01/03/2022,1,5,6,48,\n"
+            )
+        self.assertEqual(import_egg_csvs_incrementally(self.files[1:]), 1)
+        # the days of the week read from the first file still count
+        self.assertEqual(self.weekly_records()[-1], (datetime.date(2022, 1, 3), 6))
@@ -1,17 +1,35 @@
 import datetime
+import gzip
+import io
 import json
+import uuid
 
 import pytest
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select
 
-from api.main import app
-from api.model import Recipe, EggStockRecord
+from api.cache import LRUBackend, RecipeCache, recipe_cache, response_cache
+from api.inventory import inventory_counter
+from api.main import create_app
+from api.search import recipe_text_index
+from api.metrics import request_metrics
+from api.model import (
+    AbstractIngredient,
+    EggStockRecord,
+    Job,
+    Recipe,
+    RecipeIngredient,
+    TableVersion,
+)
+from data.load_data import read_daily_egg_csvs, store_harvests
 
 
 @pytest.fixture()
-def client():
+def client(app):
     app.config.update(
         {
             "TESTING": True,
+            "RESPONSE_CACHE_ENABLED": False,
         }
     )
     return app.test_client()
@@ -128,52 +146,39 @@ class MockPilafRecipe:
         }
 
 
-class MockRecipeQuery:
-    @staticmethod
-    def get(*args, **kwargs):
-        return MockFruitPieRecipe()
-
-    @staticmethod
-    def all(*args, **kwargs):
-        return [MockFruitPieRecipe(), MockPilafRecipe()]
-
-
-class MockEggStockRecord1:
-    @staticmethod
-    def to_json():
-        date = datetime.date(2023, 1, 1)
-        return {
-            "id": "record_1_id",
-            "created_at": date,
-            "edited_at": date,
-            "record_date": datetime.date(2021, 1, 1),
-            "quantity": 3,
-        }
-
-
-class MockEggStockRecord2:
-    @staticmethod
-    def to_json():
-        date = datetime.date(2023, 1, 1)
-        return {
-            "id": "record_1_id",
-            "created_at": date,
-            "edited_at": date,
-            "record_date": datetime.date(2021, 1, 8),
-            "quantity": 6,
-        }
-
-
-class MockEggStockRecordQuery:
-    @staticmethod
-    def all(*args, **kwargs):
-        return [MockEggStockRecord1(), MockEggStockRecord2()]
+def add_mock_recipes(session, *mock_recipes):
+    """Store mock recipes, keeping their ingredient order and shared ingredients."""
+    abstract_ingredients = {}
+    for day, mock_recipe in enumerate(mock_recipes):
+        data = mock_recipe.to_json()
+        recipe = Recipe(
+            name=data["name"],
+            instructions=data["instructions"],
+            servings=data["servings"],
+            source=data["source"],
+        )
+        recipe.created_at = datetime.datetime(2023, 1, 1 + day)
+        for ingredient in data["ingredients"]:
+            name = ingredient["name"]
+            if name not in abstract_ingredients:
+                abstract_ingredients[name] = AbstractIngredient(name=name)
+            recipe_ingredient = RecipeIngredient(
+                quantity=ingredient["quantity"],
+                units=ingredient["units"],
+                abstract_ingredient=abstract_ingredients[name],
+                recipe=recipe,
+            )
+            recipe_ingredient.id = uuid.UUID(int=int(ingredient["id"].split("_")[1]))
+        session.add(recipe)
+    session.commit()
+    session.expunge_all()
 
 
-def test_get_single_recipe(client, monkeypatch):
+def test_get_single_recipe(app, client, db_session):
     with app.app_context():
-        monkeypatch.setattr(Recipe, "query", MockRecipeQuery)
-        response = client.get("/api/recipe/fruit_pie_id")
+        add_mock_recipes(db_session, MockFruitPieRecipe)
+        recipe_id = db_session.query(Recipe.id).scalar()
+        response = client.get(f"/api/recipe/{recipe_id}")
         assert response.status_code == 200
         data_dict = json.loads(response.data)
         assert len(data_dict) == 8
@@ -181,9 +186,14 @@ def test_get_single_recipe(client, monkeypatch):
         assert data_dict.get("ingredients")[0].get("name") == "hearty durian"
 
 
-def test_get_all_recipes(client, monkeypatch):
+def test_get_single_recipe_not_found(client, db_session):
+    response = client.get("/api/recipe/0c9ac1c4-6e0f-4a4b-9d3a-5c4b8ad1f7a2")
+    assert response.status_code == 404
+
+
+def test_get_all_recipes(app, client, db_session):
     with app.app_context():
-        monkeypatch.setattr(Recipe, "query", MockRecipeQuery)
+        add_mock_recipes(db_session, MockFruitPieRecipe, MockPilafRecipe)
         response = client.get("/api/recipes")
         assert response.status_code == 200
         data_dicts = json.loads(response.data)
@@ -192,9 +202,15 @@ def test_get_all_recipes(client, monkeypatch):
         assert data_dicts[1].get("ingredients")[0].get("name") == "hylian rice"
 
 
-def test_get_egg_stock_records(client, monkeypatch):
+def test_get_egg_stock_records(app, client, db_session):
     with app.app_context():
-        monkeypatch.setattr(EggStockRecord, "query", MockEggStockRecordQuery)
+        db_session.add_all(
+            [
+                EggStockRecord(record_date=datetime.date(2021, 1, 1), quantity=3),
+                EggStockRecord(record_date=datetime.date(2021, 1, 8), quantity=6),
+            ]
+        )
+        db_session.commit()
         response = client.get("/api/egg-stock-records")
         assert response.status_code == 200
         data_dicts = json.loads(response.data)
@@ -206,3 +222,719 @@ def test_get_egg_stock_records(client, monkeypatch):
             )
         ).date()
         assert record_date == datetime.date(2021, 1, 8)
+
+
+def add_recipes(session, count):
+    butter = AbstractIngredient(name="goat butter")
+    for i in range(count):
+        recipe = Recipe(
+            name=f"recipe {i}",
+            instructions="Combine all ingredients in pot",
+            servings=1,
+            source="http://botw-recipes.com/",
+        )
+        RecipeIngredient(
+            quantity=1, units="stick", abstract_ingredient=butter, recipe=recipe
+        )
+        RecipeIngredient(
+            quantity=i,
+            units="ea",
+            abstract_ingredient=AbstractIngredient(name=f"ingredient {i}"),
+            recipe=recipe,
+        )
+        session.add(recipe)
+    session.commit()
+    session.expunge_all()
+
+
+def test_get_all_recipes_query_count(client, db_session, query_counter):
+    add_recipes(db_session, 10)
+    query_counter.clear()
+    response = client.get("/api/recipes")
+    assert response.status_code == 200
+    data_dicts = json.loads(response.data)
+    assert len(data_dicts) == 10
+    assert all(len(recipe["ingredients"]) == 2 for recipe in data_dicts)
+    # one query for recipes, one for their ingredients joined to names
+    assert len(query_counter) == 2
+
+
+def test_get_single_recipe_query_count(client, db_session, query_counter):
+    add_recipes(db_session, 3)
+    recipe_id = db_session.query(Recipe.id).first()[0]
+    db_session.expunge_all()
+    query_counter.clear()
+    response = client.get(f"/api/recipe/{recipe_id}")
+    assert response.status_code == 200
+    assert len(json.loads(response.data)["ingredients"]) == 2
+    # the ingredient table counters, the recipe and its ingredients
+    assert len(query_counter) == 3
+
+
+def test_get_recipe_scaled_to_servings(client, db_session):
+    add_mock_recipes(db_session, MockFruitPieRecipe)
+    recipe_id = db_session.query(Recipe.id).scalar()
+    response = client.get(f"/api/recipe/{recipe_id}?servings=3")
+    assert response.status_code == 200
+    assert response.json["servings"] == 3
+    butter = response.json["ingredients"][3]
+    assert (butter["quantity"], butter["units"]) == (3, "stick")
+    assert butter["base_quantity"] == pytest.approx(3 * 118.294)
+    assert butter["base_units"] == "ml"
+
+    response = client.get(f"/api/recipe/{recipe_id}?servings=0")
+    assert response.status_code == 400
+
+
+def test_get_shopping_list(client, db_session, query_counter):
+    add_mock_recipes(db_session, MockFruitPieRecipe, MockPilafRecipe)
+    pie_id, pilaf_id = [
+        recipe_id
+        for recipe_id, in db_session.query(Recipe.id).order_by(Recipe.created_at)
+    ]
+    query_counter.clear()
+    response = client.get(f"/api/recipes/shopping-list?ids={pie_id}:2,{pilaf_id}")
+    assert response.status_code == 200
+    totals = {row["name"]: (row["quantity"], row["units"]) for row in response.json}
+    assert len(totals) == 7
+    assert totals["cane sugar"] == (400, "g")
+    assert totals["bird egg"] == (2, "ea")
+    # one stick doubled plus half a stick, in ml
+    assert totals["goat butter"][0] == pytest.approx(2.5 * 118.294)
+    assert len(query_counter) == 1
+
+    # a recipe without a servings count is summed as written, whether asked to scale or not
+    for servings in [None, 0]:
+        db_session.get(Recipe, pilaf_id).servings = servings
+        db_session.commit()
+        for ids in [f"{pie_id}:2,{pilaf_id}", f"{pie_id}:2,{pilaf_id}:3"]:
+            response = client.get(f"/api/recipes/shopping-list?ids={ids}")
+            assert response.status_code == 200
+            totals = {row["name"]: row["quantity"] for row in response.json}
+            assert totals["goat butter"] == pytest.approx(2.5 * 118.294)
+            assert totals["bird egg"] == 2
+
+
+def test_get_shopping_list_rejects_bad_ids(client, db_session):
+    assert client.get("/api/recipes/shopping-list").status_code == 400
+    response = client.get(f"/api/recipes/shopping-list?ids={uuid.uuid4()}:none")
+    assert response.status_code == 400
+
+
+def add_egg_stock_records(session, count, first_date=datetime.date(2021, 1, 4)):
+    session.add_all(
+        EggStockRecord(
+            record_date=first_date + datetime.timedelta(weeks=week), quantity=week
+        )
+        for week in range(count)
+    )
+    session.commit()
+
+
+def test_get_egg_stock_records_keyset_pages(client, db_session):
+    add_egg_stock_records(db_session, 5)
+    response = client.get("/api/egg-stock-records?limit=2")
+    assert [record["quantity"] for record in response.json] == [0, 1]
+    next_url = response.headers["Link"].split(">")[0].lstrip("<")
+    assert "after=2021-01-11" in next_url
+
+    response = client.get(next_url)
+    assert [record["quantity"] for record in response.json] == [2, 3]
+    response = client.get(response.headers["Link"].split(">")[0].lstrip("<"))
+    assert [record["quantity"] for record in response.json] == [4]
+    assert "Link" not in response.headers
+
+
+def test_get_egg_stock_records_date_filters(client, db_session):
+    add_egg_stock_records(db_session, 5)
+    response = client.get("/api/egg-stock-records?start=2021-01-10&end=2021-01-25")
+    assert [record["quantity"] for record in response.json] == [1, 2, 3]
+    assert client.get("/api/egg-stock-records?start=01/10/2021").status_code == 400
+    assert client.get("/api/egg-stock-records?limit=0").status_code == 400
+
+
+@pytest.fixture()
+def cached_client(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, "RESPONSE_CACHE_ENABLED", True)
+    response_cache.clear()
+    yield client
+    response_cache.clear()
+
+
+def test_lru_backend_evicts_least_recently_used():
+    backend = LRUBackend(max_entries=2)
+    backend.set("a", 1)
+    backend.set("b", 2)
+    backend.get("a")
+    backend.set("c", 3)
+    assert backend.get("b") is None
+    assert backend.get("a") == 1
+    assert len(backend) == 2
+
+
+def test_cached_recipes_answer_conditional_requests(
+    cached_client, db_session, query_counter
+):
+    add_recipes(db_session, 3)
+    response = cached_client.get("/api/recipes")
+    etag = response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+
+    query_counter.clear()
+    cached = cached_client.get("/api/recipes")
+    assert cached.data == response.data
+    assert cached.headers["ETag"] == etag
+    # only the version check reaches the database
+    assert len(query_counter) == 1
+
+    not_modified = cached_client.get("/api/recipes", headers={"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.data == b""
+
+
+def test_cached_records_invalidated_when_edited(cached_client, db_session):
+    add_egg_stock_records(db_session, 2)
+    etag = cached_client.get("/api/egg-stock-records").headers["ETag"]
+    record = EggStockRecord.query.first()
+    record.quantity = 100
+    record.edited_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=1)
+    db_session.commit()
+
+    response = cached_client.get(
+        "/api/egg-stock-records", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.json[0]["quantity"] == 100
+
+
+def test_cached_records_invalidated_when_deleted(cached_client, db_session):
+    add_egg_stock_records(db_session, 2)
+    etag = cached_client.get("/api/egg-stock-records").headers["ETag"]
+    # the oldest record goes, leaving max(edited_at) where it was
+    db_session.delete(EggStockRecord.query.order_by(EggStockRecord.edited_at).first())
+    db_session.commit()
+
+    response = cached_client.get(
+        "/api/egg-stock-records", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 200
+    assert len(response.json) == 1
+
+
+def test_only_cached_tables_are_versioned(db_session):
+    db_session.add(EggStockRecord(record_date=datetime.date(2021, 1, 4), quantity=1))
+    db_session.add(
+        Job(kind="write_snapshot", payload={}, status="queued", max_attempts=1)
+    )
+    db_session.commit()
+
+    names = set(db_session.scalars(select(TableVersion.name)))
+    assert "egg_stock_records" in names
+    assert "jobs" not in names
+    with pytest.raises(ValueError):
+        response_cache.cached(Job)
+
+
+def add_harvests(session, days, first_date=datetime.date(2021, 5, 26)):
+    store_harvests(
+        [
+            (first_date + datetime.timedelta(days=day), 1, 5, 6, 12)
+            for day in range(days)
+        ]
+    )
+    session.commit()
+
+
+def test_get_stock_history_weekly_and_monthly(client, db_session):
+    add_harvests(db_session, 14)
+    weeks = client.get("/api/stock/history").json
+    assert [(w["days"], w["total"], w["dozens"]) for w in weeks] == [
+        (6, 72, 6),
+        (7, 84, 7),
+        (1, 12, 1),
+    ]
+    assert weeks[0]["blue"] == 36
+    months = client.get("/api/stock/history?granularity=month").json
+    assert [(m["days"], m["total"]) for m in months] == [(6, 72), (8, 96)]
+
+
+def test_get_stock_history_daily_rolling_mean(client, db_session):
+    add_harvests(db_session, 3)
+    days = client.get(
+        "/api/stock/history?granularity=day&start=2021-05-27&window=2"
+    ).json
+    assert [d["rolling_mean"] for d in days] == [12, 12]
+    assert client.get("/api/stock/history?granularity=year").status_code == 400
+
+
+def test_stock_aggregates_refreshed_incrementally(client, db_session):
+    add_harvests(db_session, 14)
+    store_harvests([(datetime.date(2021, 6, 9), 0, 0, 0, 24)])
+    db_session.commit()
+    weeks = client.get("/api/stock/history?start=2021-06-07").json
+    assert [(w["days"], w["total"]) for w in weeks] == [(7, 84), (2, 36)]
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        [{"id": uuid.UUID(int=7), "at": datetime.datetime(2023, 1, 2, 3, 4, 5)}],
+        {"b": datetime.date(2021, 1, 8), "a": [1, 0.5, None, True, "text"]},
+        {"name": "crème brûlée", "quantity": 1e-05},
+        {"big": 2**70},
+    ],
+)
+def test_fast_json_provider_matches_default(app, payload):
+    with app.app_context():
+        expected = DefaultJSONProvider(app).response(payload).data
+        assert app.json.response(payload).data == expected
+
+
+def test_list_payloads_match_orm_to_json(app, client, db_session):
+    add_mock_recipes(db_session, MockFruitPieRecipe, MockPilafRecipe)
+    add_egg_stock_records(db_session, 3)
+    default_json = DefaultJSONProvider(app)
+
+    recipes = Recipe.query.options(Recipe.eager_ingredients())
+    recipes = recipes.order_by(Recipe.created_at).all()
+    expected = default_json.response([recipe.to_json() for recipe in recipes])
+    assert client.get("/api/recipes").data == expected.data
+
+    records = EggStockRecord.query.order_by(EggStockRecord.record_date).all()
+    expected = default_json.response([record.to_json() for record in records])
+    assert client.get("/api/egg-stock-records").data == expected.data
+
+
+def test_fast_json_provider_keeps_uuids_on_fast_path(app):
+    pytest.importorskip("orjson")
+    with app.app_context():
+        payload = {"id": uuid.UUID("0c9ac1c4-6e0f-4a4b-9d3a-5c4b8ad1f3e5"), "n": 1.5}
+        data = app.json.fast_dumps(payload)
+        assert data is not None
+        assert (
+            data
+            == DefaultJSONProvider(app).dumps(payload, separators=(",", ":")).encode()
+        )
+
+
+def test_fast_json_provider_leaves_non_finite_floats_to_stdlib(app):
+    with app.app_context():
+        for value in [float("nan"), float("inf"), -float("inf")]:
+            payload = {"level": None, "weeks": [{"eggs": value}]}
+            assert app.json.fast_dumps(payload) is None
+            assert app.json.encode(payload) == (
+                DefaultJSONProvider(app).dumps(payload, separators=(",", ":")).encode()
+                + b"\n"
+            )
+
+
+def test_get_metrics(client):
+    response = client.get("/api/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert b"# TYPE db_pool_checked_out gauge" in response.data
+
+
+def test_server_timing(client, db_session):
+    add_recipes(db_session, 3)
+
+    response = client.get("/api/recipes")
+
+    timings = response.headers["Server-Timing"].split(", ")
+    assert timings[0].startswith("db;dur=")
+    assert timings[0].endswith(';desc="2 queries"')
+    assert timings[1].startswith("serialize;dur=")
+    assert timings[2].startswith("total;dur=")
+
+
+def test_request_log(client, db_session, caplog):
+    with caplog.at_level("INFO", logger="api.requests"):
+        response = client.get("/api/egg-stock-records?limit=5")
+
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert entry["path"] == "/api/egg-stock-records?limit=5"
+    assert entry["endpoint"] == "get_egg_stock_records"
+    assert entry["status"] == 200
+    assert entry["queries"] == 1
+    assert entry["response_bytes"] == len(response.data)
+
+
+def test_slow_query_log(app, client, db_session, caplog):
+    app.config["SLOW_QUERY_MS"] = 0
+    try:
+        with caplog.at_level("WARNING", logger="api.slow_queries"):
+            client.get("/api/egg-stock-records?limit=5")
+    finally:
+        app.config["SLOW_QUERY_MS"] = 100.0
+
+    entry = json.loads(caplog.records[-1].getMessage())
+    assert "FROM egg_stock_records" in entry["statement"]
+    assert "6" in entry["parameters"]
+    assert entry["path"] == "/api/egg-stock-records"
+
+
+def test_request_metrics(client, db_session):
+    request_metrics.clear()
+    client.get("/api/egg-stock-records")
+    client.get("/api/egg-stock-records")
+    client.get("/api/missing")
+
+    metrics = client.get("/api/metrics").data.decode()
+
+    assert (
+        'http_requests_total{endpoint="get_egg_stock_records",method="GET",status="200"} 2'
+        in metrics
+    )
+    assert (
+        'http_requests_total{endpoint="unmatched",method="GET",status="404"} 1'
+        in metrics
+    )
+    assert (
+        'http_request_db_queries_total{endpoint="get_egg_stock_records"} 2' in metrics
+    )
+    assert "# TYPE http_response_bytes_total counter" in metrics
+
+
+@pytest.fixture()
+def stocked(db_session):
+    """Latest weekly record of 10 dozen, with the in-memory counter not yet loaded."""
+    inventory_counter.clear()
+    add_egg_stock_records(db_session, 11)
+    yield
+    inventory_counter.clear()
+
+
+def test_get_stock_from_memory(client, stocked, query_counter):
+    assert client.get("/api/stock").json == {"item": "dozen eggs", "available": 10}
+    query_counter.clear()
+
+    response = client.get("/api/stock")
+
+    assert response.json["available"] == 10
+    assert query_counter == []
+
+
+def test_reserve_and_release(client, stocked):
+    response = client.post("/api/stock/reservations", json={"quantity": 4})
+    assert response.status_code == 201
+    assert response.json["quantity"] == 4
+    assert response.json["available"] == 6
+    assert client.get("/api/stock").json["available"] == 6
+
+    response = client.post("/api/stock/reservations", json={"quantity": 7})
+    assert response.status_code == 409
+    assert response.json["available"] == 6
+
+    reservation_id = client.post("/api/stock/reservations", json={"quantity": 6}).json[
+        "id"
+    ]
+    assert client.get("/api/stock").json["available"] == 0
+
+    response = client.delete(f"/api/stock/reservations/{reservation_id}")
+    assert response.json == {"id": reservation_id, "available": 6}
+    assert client.delete(f"/api/stock/reservations/{reservation_id}").status_code == 404
+    assert client.get("/api/stock").json["available"] == 6
+
+
+@pytest.mark.parametrize("body", [{}, {"quantity": 0}, {"quantity": "2"}, None])
+def test_reserve_rejects_bad_quantity(client, stocked, body):
+    response = client.post("/api/stock/reservations", json=body)
+    assert response.status_code == 400
+
+
+@pytest.fixture()
+def pantry_recipes(db_session):
+    recipe_text_index.clear()
+    eggs, milk, sugar, flour = (
+        AbstractIngredient(name=name) for name in ["eggs", "milk", "sugar", "flour"]
+    )
+    for name, instructions, ingredients in [
+        (
+            "Custard",
+            "Whisk eggs and milk, whisk in sugar, bake the custard slowly",
+            [eggs, milk, sugar],
+        ),
+        ("Egg Custard Tart", "Blind bake the crust, then fill it", [eggs, flour]),
+        ("Pancakes", "Whisk eggs, milk and flour", [eggs, milk, flour]),
+        ("Scrambled Eggs", "Whisk eggs and cook gently", [eggs]),
+    ]:
+        recipe = Recipe(name=name, instructions=instructions, servings=2, source="")
+        for ingredient in ingredients:
+            RecipeIngredient(
+                quantity=1, units="ea", abstract_ingredient=ingredient, recipe=recipe
+            )
+        db_session.add(recipe)
+    db_session.commit()
+    yield
+    recipe_text_index.clear()
+
+
+def search_names(client, query):
+    response = client.get(f"/api/recipes/search?{query}")
+    assert response.status_code == 200
+    return [recipe["name"] for recipe in response.json]
+
+
+def test_search_recipes_text(client, pantry_recipes):
+    # ranked by how often the words occur: custard twice in Custard, once in the tart
+    assert search_names(client, "q=custard") == ["Custard", "Egg Custard Tart"]
+    assert search_names(client, "q=whisk+milk") == ["Custard", "Pancakes"]
+    assert search_names(client, "q=souffle") == []
+
+
+def test_search_recipes_ingredients(client, pantry_recipes):
+    assert search_names(client, "ingredient=eggs,flour") == [
+        "Egg Custard Tart",
+        "Pancakes",
+    ]
+    assert search_names(client, "only=eggs&only=milk&only=sugar") == [
+        "Custard",
+        "Scrambled Eggs",
+    ]
+    assert search_names(client, "q=whisk&ingredient=milk&only=eggs,milk,flour") == [
+        "Pancakes"
+    ]
+    assert search_names(client, "ingredient=eggs&limit=1") == ["Custard"]
+
+
+def test_search_recipes_sees_new_recipes(client, pantry_recipes, db_session):
+    assert search_names(client, "q=omelette") == []
+    db_session.add(Recipe(name="Omelette", instructions="Fold", servings=1, source=""))
+    db_session.commit()
+    assert search_names(client, "q=omelette") == ["Omelette"]
+
+
+def test_search_recipes_requires_a_filter(client, db_session):
+    assert client.get("/api/recipes/search").status_code == 400
+    assert client.get("/api/recipes/search?q=egg&limit=0").status_code == 400
+
+
+@pytest.fixture()
+def recipe_ids(db_session):
+    recipe_cache.clear()
+    add_recipes(db_session, 5)
+    yield [
+        recipe_id
+        for recipe_id, in db_session.query(Recipe.id).order_by(Recipe.created_at)
+    ]
+    recipe_cache.clear()
+
+
+def test_get_recipes_by_ids(client, recipe_ids, query_counter):
+    wanted = [recipe_ids[3], uuid.uuid4(), recipe_ids[0]]
+    ids = ",".join(str(recipe_id) for recipe_id in wanted)
+
+    response = client.get(f"/api/recipes?ids={ids}")
+
+    assert [recipe["id"] for recipe in response.json] == [
+        str(recipe_ids[3]),
+        str(recipe_ids[0]),
+    ]
+    assert all(len(recipe["ingredients"]) == 2 for recipe in response.json)
+    assert len(query_counter) == 3
+    query_counter.clear()
+    # cached recipes only need their edited_at and the ingredient counters checked
+    ids = f"{recipe_ids[3]},{recipe_ids[0]}"
+    assert client.get(f"/api/recipes?ids={ids}").json == response.json
+    assert len(query_counter) == 1
+
+
+def test_recipe_cache_rebuilds_edited_recipes(client, recipe_ids, db_session):
+    ids = ",".join(str(recipe_id) for recipe_id in recipe_ids[:2])
+    client.get(f"/api/recipes?ids={ids}")
+    recipe = db_session.get(Recipe, recipe_ids[1])
+    recipe.name = "renamed"
+    recipe.edited_at = datetime.datetime.utcnow()
+    db_session.commit()
+
+    response = client.get(f"/api/recipes?ids={ids}")
+
+    assert [recipe["name"] for recipe in response.json] == ["recipe 0", "renamed"]
+
+
+def test_recipe_cache_rebuilds_after_ingredient_edits(recipe_ids, db_session):
+    """Ingredient edits that leave the recipe's edited_at alone move the table counters."""
+
+    def total_quantity(cache):
+        recipe = cache.load(db_session, recipe_ids[:1])[recipe_ids[0]]
+        return sum(ingredient["quantity"] for ingredient in recipe["ingredients"])
+
+    cache = RecipeCache()
+    assert total_quantity(cache) == 1
+    db_session.query(RecipeIngredient).update({"quantity": 2})
+    db_session.commit()
+
+    assert total_quantity(cache) == 4
+
+
+def test_recipe_cache_under_the_response_cache(app, recipe_ids, db_session):
+    app.config["RESPONSE_CACHE_ENABLED"] = True
+    client = app.test_client()
+    path = f"/api/recipe/{recipe_ids[0]}"
+
+    def quantities():
+        return [
+            ingredient["quantity"]
+            for ingredient in client.get(path).json["ingredients"]
+        ]
+
+    assert sorted(quantities()) == [0, 1]
+    db_session.query(RecipeIngredient).update({"quantity": 5})
+    db_session.commit()
+
+    # the response cache misses on the new ETag and must not store the old recipe under it
+    assert quantities() == [5, 5]
+    response_cache.clear()
+
+
+def test_get_recipes_by_ids_rejects_bad_ids(client, db_session):
+    assert client.get("/api/recipes?ids=nope").status_code == 400
+    ids = ",".join(str(uuid.uuid4()) for _ in range(101))
+    assert client.get(f"/api/recipes?ids={ids}").status_code == 400
+
+
+def test_export_egg_stock_records_ndjson(client, db_session):
+    add_egg_stock_records(db_session, 3)
+
+    response = client.get("/api/egg-stock-records/export?start=2021-01-10")
+
+    assert response.is_streamed
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.data.decode().splitlines()
+    assert [json.loads(line)["quantity"] for line in lines] == [1, 2]
+    expected = client.get("/api/egg-stock-records?start=2021-01-10").json
+    assert [json.loads(line) for line in lines] == expected
+
+
+def test_export_egg_stock_records_csv_round_trip(client, db_session):
+    add_egg_stock_records(db_session, 2500)
+
+    response = client.get(
+        "/api/egg-stock-records/export?format=csv",
+        headers={"Accept-Encoding": "gzip"},
+    )
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.mimetype == "text/csv"
+    records = read_daily_egg_csvs(io.StringIO(gzip.decompress(response.data).decode()))
+    stored = db_session.query(EggStockRecord.record_date, EggStockRecord.quantity)
+    expected = sorted(
+        (record_date, quantity)
+        for record_date, quantity in stored
+        if record_date <= datetime.date.today()
+    )
+    assert records == expected
+
+
+def test_export_egg_stock_records_bad_format(client, db_session):
+    response = client.get("/api/egg-stock-records/export?format=xml")
+    assert response.status_code == 400
+
+
+def bulk_recipes(count, offset=0):
+    return [
+        {
+            "name": f"bulk recipe {offset + i}",
+            "instructions": "Whisk and bake",
+            "servings": 2,
+            "source": "",
+            "ingredients": [
+                {"name": "egg", "quantity": 2, "units": "ea"},
+                {"name": f"spice {(offset + i) % 3}", "quantity": 1, "units": "tsp"},
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+def test_create_recipes_in_bulk(client, db_session, query_counter):
+    add_recipes(db_session, 1)
+    db_session.add(AbstractIngredient(name="egg"))
+    db_session.commit()
+    query_counter.clear()
+
+    response = client.post("/api/recipes", json=bulk_recipes(50))
+
+    assert response.status_code == 201
+    # ingredient lookup, insert of the new spices, recipes, recipe ingredients, table versions
+    assert len(query_counter) == 5
+    assert db_session.query(AbstractIngredient).filter_by(name="egg").count() == 1
+    assert db_session.query(AbstractIngredient).count() == 2 + 1 + 3
+    recipes = client.get(f"/api/recipes?ids={','.join(response.json['ids'])}").json
+    assert [recipe["name"] for recipe in recipes] == [
+        f"bulk recipe {i}" for i in range(50)
+    ]
+    assert {ingredient["name"] for ingredient in recipes[4]["ingredients"]} == {
+        "egg",
+        "spice 1",
+    }
+
+    # a second batch reuses every ingredient without inserting any
+    query_counter.clear()
+    assert client.post("/api/recipes", json=bulk_recipes(5, 50)).status_code == 201
+    assert len(query_counter) == 4
+    assert db_session.query(Recipe).count() == 56
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        None,
+        [],
+        [{"name": ""}],
+        [{"name": "pie", "servings": "four"}],
+        [{"name": "pie", "ingredients": [{"name": "egg", "quantity": 1.5}]}],
+        [{"name": "pie"}, "cake"],
+    ],
+)
+def test_create_recipes_rejects_bad_body(client, db_session, body):
+    response = client.post("/api/recipes", json=body)
+    assert response.status_code == 400
+    assert db_session.query(Recipe).count() == 0
+
+
+def test_create_egg_stock_records_in_bulk(client, db_session):
+    add_egg_stock_records(db_session, 2)
+    body = [
+        {"record_date": "2021-01-11", "quantity": 7},
+        {"record_date": "2021-01-18", "quantity": 3},
+        {"record_date": "2021-01-18", "quantity": 4},
+    ]
+
+    response = client.post("/api/egg-stock-records", json=body)
+
+    assert response.status_code == 201
+    assert response.json == {"written": 2}
+    records = client.get("/api/egg-stock-records").json
+    assert [(r["record_date"], r["quantity"]) for r in records] == [
+        ("Mon, 04 Jan 2021 00:00:00 GMT", 0),
+        ("Mon, 11 Jan 2021 00:00:00 GMT", 7),
+        ("Mon, 18 Jan 2021 00:00:00 GMT", 4),
+    ]
+
+
+@pytest.mark.parametrize(
+    "record",
+    [
+        {"record_date": "2021-01-12", "quantity": 1},
+        {"record_date": "01/11/2021", "quantity": 1},
+        {"record_date": "2021-01-11", "quantity": -1},
+    ],
+)
+def test_create_egg_stock_records_rejects_bad_body(client, db_session, record):
+    response = client.post("/api/egg-stock-records", json=[record])
+    assert response.status_code == 400
+    assert db_session.query(EggStockRecord).count() == 0
+
+
+def test_create_app_connects_lazily(tmp_path):
+    database = tmp_path / "lazy.db"
+
+    application = create_app({"SQLALCHEMY_DATABASE_URI": f"sqlite:///{database}"})
+
+    endpoints = {rule.endpoint for rule in application.url_map.iter_rules()}
+    assert {"get_recipes", "create_recipes", "export_egg_stock_records"} <= endpoints
+    assert application.test_client().get("/api/").status_code == 200
+    # SQLite creates the file on the first connection
+    assert not database.exists()
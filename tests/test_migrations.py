@@ -0,0 +1,165 @@
+import datetime
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, inspect, select
+
+from api import forecast
+from api.migrations import (
+    MIGRATIONS,
+    applied_versions,
+    create_farm_harvests,
+    create_harvest_forecast,
+    create_units,
+    drop_checkpoint_week_sum,
+    upgrade,
+)
+from api.model import (
+    HOME_FARM,
+    AbstractIngredient,
+    DailyHarvest,
+    FarmHarvest,
+    HarvestForecast,
+    Recipe,
+    RecipeIngredient,
+    Unit,
+    db,
+    unit_id,
+)
+
+
+@pytest.fixture()
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'migrations.db'}")
+    yield engine
+    engine.dispose()
+
+
+def index_names(engine, table):
+    return {index["name"] for index in inspect(engine).get_indexes(table)}
+
+
+def test_upgrade_fresh_database(engine):
+    applied = upgrade(engine)
+
+    assert [version for version, _ in applied] == [m[0] for m in MIGRATIONS]
+    assert set(db.metadata.tables) <= set(inspect(engine).get_table_names())
+    assert {
+        "ix_recipe_ingredients_recipe_id",
+        "ix_recipe_ingredients_abstract_ingredient_id",
+    } <= index_names(engine, "recipe_ingredients")
+    assert "ix_egg_stock_records_edited_at" in index_names(engine, "egg_stock_records")
+
+
+def test_upgrade_is_idempotent(engine):
+    upgrade(engine)
+
+    assert upgrade(engine) == []
+    assert applied_versions(engine) == [m[0] for m in MIGRATIONS]
+
+
+def test_upgrade_adds_indexes_to_existing_tables(engine):
+    """A database created by the old drop_all/create_all gets the new indexes."""
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_recipe_ingredients_recipe_id")
+        conn.exec_driver_sql("DROP INDEX ix_recipe_ingredients_abstract_ingredient_id")
+
+    upgrade(engine)
+
+    assert {
+        "ix_recipe_ingredients_recipe_id",
+        "ix_recipe_ingredients_abstract_ingredient_id",
+    } <= index_names(engine, "recipe_ingredients")
+
+
+def test_farm_harvests_backfilled_from_daily_harvests(engine):
+    """Harvests loaded before farms existed become the home farm's."""
+    db.metadata.create_all(engine, tables=[DailyHarvest.__table__])
+    with engine.begin() as conn:
+        conn.execute(
+            DailyHarvest.__table__.insert(),
+            [
+                DailyHarvest.row(datetime.date(2023, 1, day), 1, 2, 3, 6)
+                for day in (1, 2)
+            ],
+        )
+
+    create_farm_harvests(engine)
+    create_farm_harvests(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(FarmHarvest.farm_id, FarmHarvest.harvest_date, FarmHarvest.total)
+        ).all()
+    assert sorted(rows) == [
+        (HOME_FARM, datetime.date(2023, 1, 1), 6),
+        (HOME_FARM, datetime.date(2023, 1, 2), 6),
+    ]
+
+
+def test_recipe_ingredients_linked_to_units(engine):
+    """Ingredients stored before the units table get the unit of their spelling."""
+    tables = [AbstractIngredient.__table__, Recipe.__table__]
+    db.metadata.create_all(engine, tables=tables)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE recipe_ingredients (id CHAR(32) PRIMARY KEY, "
+            "abstract_ingredient_id CHAR(32), quantity INTEGER, units VARCHAR, "
+            "recipe_id CHAR(32))"
+        )
+        for units in ["mL", "stick", "pinch"]:
+            conn.exec_driver_sql(
+                "INSERT INTO recipe_ingredients (id, quantity, units) VALUES (?, 1, ?)",
+                (uuid.uuid4().hex, units),
+            )
+
+    create_units(engine)
+    create_units(engine)
+
+    with engine.connect() as conn:
+        linked = dict(
+            conn.execute(select(RecipeIngredient.units, RecipeIngredient.unit_id)).all()
+        )
+        symbols = set(conn.scalars(select(Unit.symbol)))
+    assert linked == {"mL": unit_id("ml"), "stick": unit_id("stick"), "pinch": None}
+    assert {"ml", "stick", "g"} <= symbols
+    assert "ix_recipe_ingredients_unit_id" in index_names(engine, "recipe_ingredients")
+
+
+@pytest.mark.skipif(not forecast.FORECASTING, reason="numpy is not installed")
+def test_harvest_forecast_fitted_to_existing_harvests(engine):
+    db.metadata.create_all(engine, tables=[DailyHarvest.__table__])
+    with engine.begin() as conn:
+        conn.execute(
+            DailyHarvest.__table__.insert(),
+            [
+                DailyHarvest.row(datetime.date(2023, 1, day), 1, 2, 3, 6)
+                for day in range(1, 11)
+            ],
+        )
+
+    create_harvest_forecast(engine)
+    create_harvest_forecast(engine)
+
+    with engine.connect() as conn:
+        fitted = conn.execute(select(HarvestForecast.days, HarvestForecast.level)).all()
+    assert len(fitted) == 1
+    assert fitted[0].days == 10
+    assert fitted[0].level == pytest.approx(6)
+
+
+def test_checkpoint_week_sum_dropped(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE import_checkpoints (id CHAR(32) PRIMARY KEY, source VARCHAR, "
+            "byte_offset INTEGER, week_sum INTEGER)"
+        )
+
+    drop_checkpoint_week_sum(engine)
+    drop_checkpoint_week_sum(engine)
+
+    columns = [
+        column["name"] for column in inspect(engine).get_columns("import_checkpoints")
+    ]
+    assert columns == ["id", "source", "byte_offset"]
@@ -0,0 +1,166 @@
+import datetime
+import os
+
+import pytest
+
+from api import jobs, snapshot
+from api.model import DailyHarvest, EggStockRecord, Job
+
+
+@pytest.fixture()
+def records(db_session):
+    monday = datetime.date(2023, 1, 2)
+    db_session.add_all(
+        EggStockRecord(monday + datetime.timedelta(weeks=week), week + 1)
+        for week in range(10)
+    )
+    db_session.add_all(
+        DailyHarvest(
+            harvest_date=monday + datetime.timedelta(days=day),
+            pink=day,
+            brown=2,
+            blue=0,
+            total=day + 2,
+        )
+        for day in range(30)
+    )
+    db_session.commit()
+
+
+@pytest.fixture()
+def snapshot_path(app, tmp_path):
+    path = str(tmp_path / "stock.snapshot")
+    app.config["STOCK_SNAPSHOT_PATH"] = path
+    yield path
+    app.config["STOCK_SNAPSHOT_PATH"] = None
+    snapshot.snapshot_cache.clear()
+
+
+@pytest.mark.parametrize("series", ["stock", "harvests"])
+@pytest.mark.parametrize(
+    "start, end",
+    [
+        (None, None),
+        (datetime.date(2023, 1, 5), datetime.date(2023, 1, 23)),
+        (datetime.date(2023, 1, 3), datetime.date(2023, 1, 8)),
+        (datetime.date(2024, 1, 1), datetime.date(2024, 2, 1)),
+    ],
+)
+def test_snapshot_matches_database(
+    db_session, records, tmp_path, query_counter, series, start, end
+):
+    path = str(tmp_path / "stock.snapshot")
+    assert snapshot.write_snapshot(db_session, path) == {"stock": 10, "harvests": 30}
+    expected = snapshot.read_series(db_session, series, start, end)
+    assert expected["source"] == "database"
+
+    query_counter.clear()
+    result = snapshot.read_series(db_session, series, start, end, path=path)
+    assert query_counter == []
+    assert result["source"] == "snapshot"
+    assert (result["sums"], result["rows"]) == (expected["sums"], expected["rows"])
+
+
+def test_replaced_snapshot_read_again(db_session, records, snapshot_path):
+    snapshot.write_snapshot(db_session, snapshot_path)
+    before = snapshot.snapshot_cache.get(snapshot_path)
+    assert before.sums("stock", datetime.date(2023, 1, 1), datetime.date.today()) == {
+        "days": 10,
+        "quantity": 55,
+    }
+
+    db_session.add(EggStockRecord(datetime.date(2023, 3, 13), 100))
+    db_session.commit()
+    snapshot.write_snapshot(db_session, snapshot_path)
+
+    after = snapshot.snapshot_cache.get(snapshot_path)
+    assert after is not before
+    assert after.sums("stock", datetime.date(2023, 1, 1), datetime.date.today()) == {
+        "days": 11,
+        "quantity": 155,
+    }
+    # the replaced map stays readable by requests still holding it
+    assert (
+        before.sums("stock", datetime.date(2023, 1, 1), datetime.date.today())["days"]
+        == 10
+    )
+
+
+def test_stock_series_route(app, db_session, records, snapshot_path):
+    client = app.test_client()
+    query = "/api/stock/series?series=harvests&start=2023-01-02&end=2023-01-04"
+    response = client.get(query)
+    assert response.json["source"] == "database"
+
+    assert (
+        jobs.HANDLERS["write_snapshot"]({}, None) == "10 stock rows, 30 harvests rows"
+    )
+    snapshotted = client.get(query)
+    assert snapshotted.json == {**response.json, "source": "snapshot"}
+    assert snapshotted.json["sums"] == {
+        "days": 3,
+        "pink": 3,
+        "brown": 6,
+        "blue": 0,
+        "total": 9,
+    }
+    assert "rows" not in client.get("/api/stock/series?rows=0").json
+    assert client.get("/api/stock/series?series=recipes").status_code == 400
+
+
+def test_stock_records_post_queues_snapshot(app, db_session, records, snapshot_path):
+    snapshot.write_snapshot(db_session, snapshot_path)
+    client = app.test_client()
+    response = client.post(
+        "/api/egg-stock-records", json=[{"record_date": "2023-01-02", "quantity": 4}]
+    )
+    assert response.status_code == 201
+    assert db_session.query(Job).one().kind == "write_snapshot"
+    query = "/api/stock/series?start=2023-01-01&end=2023-01-08&rows=0"
+    assert client.get(query).json["sums"] == {"days": 1, "quantity": 1}
+
+    jobs.work(once=True)
+    response = client.get(query)
+    assert response.json["source"] == "snapshot"
+    assert response.json["sums"] == {"days": 1, "quantity": 4}
+
+
+def test_older_rebuild_does_not_replace_newer_snapshot(
+    db_session, records, snapshot_path, monkeypatch
+):
+    stale_versions = snapshot.source_versions(db_session)
+    db_session.add(EggStockRecord(datetime.date(2023, 3, 13), 100))
+    db_session.commit()
+    assert snapshot.write_snapshot(db_session, snapshot_path) == {
+        "stock": 11,
+        "harvests": 30,
+    }
+    newer = snapshot.read_versions(snapshot_path)
+    assert newer["stock"] > stale_versions["stock"]
+
+    # a rebuild that read its versions before the commit finishes last
+    monkeypatch.setattr(snapshot, "source_versions", lambda session: stale_versions)
+    assert snapshot.write_snapshot(db_session, snapshot_path) is None
+    assert snapshot.read_versions(snapshot_path) == newer
+    assert not [
+        name
+        for name in os.listdir(os.path.dirname(snapshot_path))
+        if name.endswith(".tmp")
+    ]
+
+
+def test_import_rebuilds_snapshot(db_session, snapshot_path, tmp_path):
+    from data.load_data import ingest_egg_csvs
+
+    csv = tmp_path / "eggs.csv"
+    csv.write_text(
+        "Date,Pink,Brown,Blue,Total Harvested\n"
+        "12/26/2022,1,2,3,6,\n"
+        "01/02/2023,0,0,12,12,\n"
+    )
+    ingest_egg_csvs([str(csv)], max_workers=1)
+
+    imported = snapshot.snapshot_cache.get(snapshot_path)
+    assert imported.sums(
+        "harvests", datetime.date(2022, 12, 1), datetime.date(2023, 1, 31)
+    ) == {"days": 2, "pink": 1, "brown": 2, "blue": 15, "total": 18}
@@ -0,0 +1,89 @@
+import datetime
+import io
+import os
+import unittest
+
+from api.model import EggStockRecord, db
+from data import load_data, vectorized
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "data")
+CSV_FILES = ["2021.csv", "2022.csv", "2023.csv"]
+
+
+@unittest.skipIf(vectorized.np is None, "numpy is not installed")
+class VectorizedLoadDataTests(unittest.TestCase):
+    def test_parse_mdy_dates(self):
+        dates = vectorized.parse_mdy_dates(
+            vectorized.np.array(["05/04/2023", "12/31/1999", "02/29/2024"])
+        )
+        self.assertListEqual(
+            dates.tolist(),
+            [
+                datetime.date(2023, 5, 4),
+                datetime.date(1999, 12, 31),
+                datetime.date(2024, 2, 29),
+            ],
+        )
+
+    def test_read_daily_egg_csvs_matches_python(self):
+        s = "Date,Pink,Brown,Blue,Total Harvested\n05/15/2021,1,7,6,14,\n05/16/2021,1,5,6,12\n05/17/2021,,,,,\n05/18/2021,1,6,6,13,\n"
+        self.assertListEqual(
+            vectorized.read_daily_egg_csvs(io.StringIO(s)),
+            load_data.read_daily_egg_csvs(io.StringIO(s)),
+        )
+        start, end = datetime.date(2021, 5, 16), datetime.date(2021, 5, 17)
+        self.assertListEqual(
+            vectorized.read_daily_egg_csvs(io.StringIO(s), start, end),
+            [(start, 12)],
+        )
+        self.assertListEqual(vectorized.read_daily_egg_csvs(io.StringIO("")), [])
+
+    def test_read_daily_harvests_matches_python_on_odd_fields(self):
+        s = (
+            "Date,Pink,Brown,Blue,Total Harvested\n"
+            "05/15/2021,1,7,6,-0,\n"
+            "05/16/2021, 1,7 ,6,14,\n"
+            "05/17/2021,-1,-0,-,\t13 ,\n"
+            "05/18/2021,1-,--2,1 2,1 2,\n"
+            "05/19/2021,1,2,3,+4,\n"
+            "05/20/2021,1,2,3,5\r\n"
+        )
+        self.assertListEqual(
+            vectorized.read_daily_harvests(io.StringIO(s)),
+            list(load_data.iter_daily_harvest_csv(io.StringIO(s))),
+        )
+
+    def test_data_files_match_python(self):
+        for name in CSV_FILES:
+            with open(os.path.join(DATA_DIR, name)) as f:
+                expected = list(load_data.iter_daily_harvest_csv(f))
+            with open(os.path.join(DATA_DIR, name)) as f:
+                self.assertListEqual(vectorized.read_daily_harvests(f), expected)
+
+            daily = [(harvest[0], harvest[4]) for harvest in expected]
+            self.assertListEqual(
+                vectorized.sum_weekly_dozens(daily),
+                load_data.sum_weekly_dozens(daily),
+            )
+
+    def test_convert_daily_eggs_to_weekly_dozens(self):
+        records = [
+            (datetime.date(2021, 5, 15) + datetime.timedelta(days=day), 12)
+            for day in range(11)
+        ]
+        db_records = vectorized.convert_daily_eggs_to_weekly_dozens(records)
+        self.assertListEqual(
+            [(r.record_date, r.quantity) for r in db_records],
+            [(datetime.date(2021, 5, 17), 3), (datetime.date(2021, 5, 24), 7)],
+        )
+
+    def test_ingest_egg_csvs_vectorized(self):
+        db.create_all()
+        try:
+            files = [os.path.join(DATA_DIR, name) for name in CSV_FILES]
+            written = load_data.ingest_egg_csvs(files, vectorized=True)
+            self.assertEqual(written, EggStockRecord.query.count())
+            self.assertEqual(load_data.ingest_egg_csvs(files, max_workers=1), written)
+        finally:
+            db.session.remove()
+            db.drop_all()